@@ -18,7 +18,6 @@ Usage:
 """
 
 import argparse
-import json
 import logging
 import sys
 from pathlib import Path
@@ -27,6 +26,15 @@ from typing import Dict, List, Tuple
 import pandas as pd
 import requests
 
+from build_probe import parse_build_info
+from collection_engine import (CollectionEngine, FundingMatchSearch,
+                               parse_array_text)
+from grant_parser import NOT_FOUND, PARSED_FIELDS, GrantIDParser
+from grant_search import DEFAULT_CONCURRENCY, DEFAULT_MAX_QUERY_LENGTH
+from http_session import (DEFAULT_POOL_SIZE, configure_shared_session,
+                          get_shared_session)
+from program_rows import as_program_rows, valid_rows
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -42,29 +50,78 @@ logger = logging.getLogger(__name__)
 class ProgramCollectionsAutomator:
     """Main class for automating program collections generation"""
 
-    def __init__(self, base_path: str = None):
+    def __init__(self, base_path: str = None, batch_query_length: int = 0,
+                 session: requests.Session = None,
+                 search_concurrency: int = DEFAULT_CONCURRENCY,
+                 use_funding_index: bool = False):
         """Initialize the automator with configuration"""
         self.base_path = Path(base_path) if base_path else Path.cwd()
         self.data_path = self.base_path / 'data'
         self.script_path = self.base_path
 
+        # Pooled session with retries shared by all blocking HTTP calls
+        self.session = session or get_shared_session()
+
         # Configuration
         self.google_sheets_url = "https://docs.google.com/spreadsheets/d/16ioasEqMoXuv2tgJs7xlMgD_sPLvrxs7Cp3rwz273YE/export?format=xlsx&gid=0"
         self.staging_api_url = "https://api-staging.data.niaid.nih.gov/v1/query"
         self.production_api_url = "https://api.data.niaid.nih.gov/v1/query"
+        self.staging_metadata_url = "https://api-staging.data.niaid.nih.gov/v1/metadata"
+        self.production_metadata_url = "https://api.data.niaid.nih.gov/v1/metadata"
 
         # GitHub raw URLs for control files (fallback)
         self.control_transferred_url = "https://raw.githubusercontent.com/NIAID-Data-Ecosystem/nde_research/main/program_collections_generator/data/control_transferred.txt"
         self.approved_prod_url = "https://raw.githubusercontent.com/NIAID-Data-Ecosystem/nde_research/main/program_collections_generator/data/approved_for_prod.txt"
 
-        # Find correction path
-        self.correction_path = self._find_correction_path()
+        # Grant searches matched by funding identifier, with the file output
+        # shared with the generator; batch_query_length 0 searches one grant
+        # per query
+        self.engine = CollectionEngine(
+            self._find_correction_path(),
+            FundingMatchSearch(batch_query_length),
+            session=self.session,
+            concurrency=search_concurrency,
+            index_path=self.data_path if use_funding_index else None
+        )
 
         # Load configuration data
         self.approved_prod = []
         self.control_transferred = []
         self.act_codes = []
         self.ic_codes = []
+        self.grant_parser = None
+
+    @property
+    def correction_path(self) -> Path:
+        return self.engine.correction_path
+
+    @correction_path.setter
+    def correction_path(self, path: Path):
+        self.engine.correction_path = Path(path)
+
+    @property
+    def batch_query_length(self) -> int:
+        return self.engine.strategy.max_query_length
+
+    @batch_query_length.setter
+    def batch_query_length(self, length: int):
+        self.engine.strategy.max_query_length = length
+
+    @property
+    def grant_parser(self) -> GrantIDParser:
+        return self.engine.grant_parser
+
+    @grant_parser.setter
+    def grant_parser(self, parser: GrantIDParser):
+        self.engine.grant_parser = parser
+
+    @property
+    def output_writer(self):
+        return self.engine.output_writer
+
+    @property
+    def prior_records(self):
+        return self.engine.prior_records
 
     def _find_correction_path(self) -> Path:
         """Find the nde-metadata-corrections path"""
@@ -104,8 +161,9 @@ class ProgramCollectionsAutomator:
                 self.control_transferred_url
             )
 
-            # Load NIH codes
+            # Load NIH codes and compile the grant ID parser
             self.act_codes, self.ic_codes = self._load_nih_codes()
+            self.grant_parser = GrantIDParser(self.act_codes, self.ic_codes)
 
             logger.info(
                 f"Loaded {len(self.approved_prod)} approved production programs")
@@ -136,7 +194,7 @@ class ProgramCollectionsAutomator:
 
         # Fallback to remote URL
         try:
-            response = requests.get(remote_url, timeout=30)
+            response = self.session.get(remote_url, timeout=30)
             response.raise_for_status()
             items = [line.strip()
                      for line in response.text.split('\n') if line.strip()]
@@ -177,7 +235,7 @@ class ProgramCollectionsAutomator:
             logger.info("Downloading program metadata from Google Sheets...")
 
             # Download the Excel file
-            response = requests.get(self.google_sheets_url, timeout=60)
+            response = self.session.get(self.google_sheets_url, timeout=60)
             response.raise_for_status()
 
             # Save temporarily and read with pandas
@@ -208,88 +266,36 @@ class ProgramCollectionsAutomator:
 
     def parse_array_text(self, array_text: str) -> List[str]:
         """Parse comma or pipe-separated text into a list"""
-        if pd.isna(array_text) or array_text == 'not found':
-            return []
-
-        # Remove asterisks
-        array_text = str(array_text).replace('*', '')
-
-        # Split by comma or pipe
-        if ',' in array_text:
-            items = array_text.split(',')
-        elif '|' in array_text:
-            items = array_text.split('|')
-        else:
-            items = [array_text]
-
-        return [x.strip() for x in items if x.strip()]
+        return parse_array_text(array_text)
 
     def parse_grant_id(self, grant_id: str) -> Dict[str, str]:
         """Parse a grant ID into its components"""
         grant_id = grant_id.strip()
 
-        # Initialize result
-        result = {
-            'grantID': grant_id,
-            'applTypeCode': 'not found',
-            'activityCode': 'not found',
-            'icCode': 'not found',
-            'serialNum': 'not found',
-            'supportYear': 'not found'
-        }
+        if self.grant_parser is None:
+            self.grant_parser = GrantIDParser(self.act_codes, self.ic_codes)
 
-        try:
-            # Check for support year at the end
+        # Contract IDs start with two digits and are not parsed further
+        if grant_id[:2].isdigit():
+            result = {field: NOT_FOUND for field in PARSED_FIELDS}
+            result['grantID'] = grant_id
             if '-' in grant_id[-5:]:
                 result['supportYear'] = grant_id[-2:]
+            return result
 
-            # Determine starting pattern
-            if grant_id[0].isdigit():
-                if grant_id[:2].isdigit():
-                    # Contract ID
-                    return result
-                else:
-                    # Application type code
-                    result['applTypeCode'] = grant_id[0]
-                    remaining = grant_id[2:] if grant_id[1] in '-_ ' else grant_id[1:]
-            else:
-                remaining = grant_id
-
-            # Parse activity code
-            for code in self.act_codes:
-                if remaining.startswith(code):
-                    result['activityCode'] = code
-                    remaining = remaining[len(code):]
-                    if remaining.startswith('-'):
-                        remaining = remaining[1:]
-                    break
-
-            # Parse IC code
-            for code in self.ic_codes:
-                if remaining.startswith(code):
-                    result['icCode'] = code
-                    remaining = remaining[len(code):]
-                    if remaining.startswith('-'):
-                        remaining = remaining[1:]
-                    break
-
-            # Parse serial number (first 6 digits typically)
-            serial_match = ''
-            for char in remaining:
-                if char.isdigit():
-                    serial_match += char
-                    if len(serial_match) >= 6:
-                        break
-                elif char == '-':
-                    break
-
-            if serial_match:
-                result['serialNum'] = serial_match
-
+        try:
+            return self.grant_parser.parse(grant_id)
         except Exception as e:
             logger.warning(f"Failed to parse grant ID {grant_id}: {e}")
+            result = {field: NOT_FOUND for field in PARSED_FIELDS}
+            result['grantID'] = grant_id
+            return result
 
-        return result
+    def parse_grant_ids(self, grant_ids):
+        """Parse many grant IDs; a pandas Series returns a DataFrame"""
+        if self.grant_parser is None:
+            self.grant_parser = GrantIDParser(self.act_codes, self.ic_codes)
+        return self.grant_parser.parse_grant_ids(grant_ids)
 
     def parse_program_funding(self, funding_info: str) -> List[str]:
         """Parse program funding information into standardized grant IDs"""
@@ -314,108 +320,56 @@ class ProgramCollectionsAutomator:
         return grant_list
 
     def search_for_records(self, grant_list: List[str], environment: str = 'staging') -> pd.DataFrame:
-        """Search for records matching the grant IDs"""
-        api_url = self.staging_api_url if environment == 'staging' else self.production_api_url
-        result_list = []
-        fail_list = []
+        """Search for records matching the grant IDs.
 
-        for grant in grant_list:
-            try:
-                # Try both wildcard and exact searches
-                wildcard_url = f"{api_url}?&q=funding.identifier:*{grant}*&fields=_id,funding.identifier&size=500"
-                exact_url = f"{api_url}?&q=funding.identifier:{grant}&fields=_id,funding.identifier&size=500"
-
-                responses = []
-                for url in [wildcard_url, exact_url]:
-                    try:
-                        response = requests.get(url, timeout=30)
-                        response.raise_for_status()
-                        data = response.json()
-                        if 'hits' in data and len(data['hits']) > 0:
-                            responses.extend(data['hits'])
-                    except Exception as e:
-                        logger.warning(
-                            f"Search failed for {grant} at {url}: {e}")
-
-                if responses:
-                    for hit in responses:
-                        record_id = hit['_id']
-                        funding_data = hit.get('funding', [])
-
-                        if isinstance(funding_data, list):
-                            for funding in funding_data:
-                                if grant in funding.get('identifier', ''):
-                                    result_list.append({
-                                        'query': grant,
-                                        '_id': record_id,
-                                        'fundID': funding['identifier']
-                                    })
-                        elif isinstance(funding_data, dict):
-                            if grant in funding_data.get('identifier', ''):
-                                result_list.append({
-                                    'query': grant,
-                                    '_id': record_id,
-                                    'fundID': funding_data['identifier']
-                                })
-                else:
-                    fail_list.append(grant)
-
-            except Exception as e:
-                logger.error(f"Error searching for grant {grant}: {e}")
-                fail_list.append(grant)
+        Returns one row per record with the 'query' grant it was first found
+        for and its '_id'. The 'fundID' column of earlier versions is no
+        longer returned: grant searches are memoized and cached as record
+        IDs only, and callers only read '_id'.
+        """
+        api_url = self.staging_api_url if environment == 'staging' else self.production_api_url
+        found = self.engine.search_grants(
+            api_url, grant_list, environment,
+            lambda: self.get_build_version(environment))
 
-        if fail_list:
-            logger.warning(f"Failed to find records for grants: {fail_list}")
+        result_list = [{'query': grant, '_id': record_id}
+                       for grant in grant_list
+                       for record_id in found.get(grant, [])]
 
         if result_list:
             df = pd.DataFrame(result_list)
             return df.drop_duplicates(subset=['_id'], keep='first')
         else:
-            return pd.DataFrame(columns=['query', '_id', 'fundID'])
+            return pd.DataFrame(columns=['query', '_id'])
 
-    def get_prior_records(self, filename: str, environment: str) -> List[str]:
-        """Get prior records for programs with transferred control"""
+    def get_build_version(self, environment: str) -> str:
+        """Get the current API build version of an environment"""
+        url = self.staging_metadata_url if environment == 'staging' else self.production_metadata_url
         try:
-            if environment == 'production':
-                url = f"https://raw.githubusercontent.com/NIAID-Data-Ecosystem/nde-metadata-corrections/refs/heads/main/collections_corrections_production/{filename}_records.txt"
-            else:
-                url = f"https://raw.githubusercontent.com/NIAID-Data-Ecosystem/nde-metadata-corrections/refs/heads/main/collections_corrections_staging/{filename}_records.txt"
-
-            response = requests.get(url, timeout=30)
+            response = self.session.get(url, timeout=30)
             response.raise_for_status()
-
-            prior_records = []
-            for line in response.text.split('\n'):
-                line = line.strip()
-                if line and line.startswith('https://data.niaid.nih.gov/resources?id='):
-                    record_id = line.replace(
-                        'https://data.niaid.nih.gov/resources?id=', '')
-                    prior_records.append(record_id)
-
-            logger.info(
-                f"Found {len(prior_records)} prior records for {filename}")
-            return prior_records
-
+            return parse_build_info(response.json())['build_version']
         except Exception as e:
-            logger.warning(
-                f"Could not fetch prior records for {filename}: {e}")
-            return []
+            logger.error(f"Failed to get {environment} build version: {e}")
+            return ''
+
+    def get_prior_records(self, filename: str, environment: str) -> List[str]:
+        """Get prior records for programs with transferred control"""
+        prior_records = self.prior_records.get(filename, environment)
+        logger.info(
+            f"Found {len(prior_records)} prior records for {filename}")
+        return prior_records
 
     def generate_correction_files(self, df: pd.DataFrame, environment: str = 'both') -> Dict[str, int]:
         """Generate correction files for all programs"""
         stats = {'metadata_files': 0, 'record_files': 0, 'errors': 0}
 
         # Filter valid programs
-        valid_programs = df[
-            (~df['fundingIDList'].isna()) &
-            (df['fundingIDList'] != 'not found') &
-            (~df['niaidURL'].isna()) &
-            (df['fileName'] != '--')
-        ].copy()
+        valid_programs = valid_rows(as_program_rows(df))
 
         logger.info(f"Processing {len(valid_programs)} valid programs")
 
-        for _, row in valid_programs.iterrows():
+        for row in valid_programs:
             try:
                 filename = row['fileName']
 
@@ -450,45 +404,17 @@ class ProgramCollectionsAutomator:
 
         return stats
 
-    def _generate_metadata_file(self, row: pd.Series, environment: str):
+    def _generate_metadata_file(self, row, environment: str):
         """Generate metadata correction file for a program"""
-        filename = row['fileName']
+        output_file = self.engine.output_files(row['fileName'], environment)[0]
 
-        # Parse alternate names and parent organizations
-        alt_names = self.parse_array_text(row.get('alternateName', ''))
-        parent_orgs = self.parse_array_text(row.get('parentOrganization', ''))
-
-        # Create metadata object
-        description = f"{row['description']} For more information, visit the NIAID program page: {row['niaidURL']}"
-
-        metadata = {
-            "@type": "ResearchProject",
-            "name": row["name"],
-            "abstract": row["abstract"],
-            "description": description,
-            "alternateName": alt_names,
-            "url": row["url"],
-            "parentOrganization": parent_orgs
-        }
-
-        output_data = {"sourceOrganization": [metadata]}
-
-        # Determine output path
-        if environment == 'production':
-            output_dir = self.correction_path / 'collections_corrections_production'
+        # Write file if its content changed
+        if self.engine.write_metadata_file(row, environment):
+            logger.info(f"Generated metadata file: {output_file}")
         else:
-            output_dir = self.correction_path / 'collections_corrections_staging'
-
-        output_dir.mkdir(exist_ok=True)
-        output_file = output_dir / f'{filename}_correction.json'
-
-        # Write file
-        with open(output_file, 'w') as f:
-            json.dump(output_data, f, indent=4)
-
-        logger.info(f"Generated metadata file: {output_file}")
+            logger.info(f"Metadata file unchanged: {output_file}")
 
-    def _generate_records_file(self, row: pd.Series, environment: str):
+    def _generate_records_file(self, row, environment: str):
         """Generate records file for a program"""
         filename = row['fileName']
 
@@ -514,37 +440,21 @@ class ProgramCollectionsAutomator:
         else:
             record_ids = []
 
-        # For control transferred programs, merge with prior records
-        if filename in self.control_transferred:
-            prior_records = self.get_prior_records(filename, environment)
-            record_ids = list(set(record_ids + prior_records))
-
-        # Determine output path
-        if environment == 'production':
-            output_dir = self.correction_path / 'collections_corrections_production'
+        # Write records file if its content changed, merged with the prior
+        # records of control transferred programs
+        output_file = self.engine.output_files(filename, environment)[1]
+        if self.engine.write_records_file(
+                filename, environment, record_ids,
+                filename in self.control_transferred):
+            logger.info(f"Generated records file: {output_file}")
         else:
-            output_dir = self.correction_path / 'collections_corrections_staging'
-
-        output_dir.mkdir(exist_ok=True)
-        output_file = output_dir / f'{filename}_records.txt'
-
-        # Write records file
-        with open(output_file, 'w') as f:
-            for record_id in sorted(record_ids):
-                # Handle immport prefix
-                if "immport" in record_id:
-                    clean_id = record_id.replace("immport_", "")
-                    f.write(
-                        f'https://data.niaid.nih.gov/resources?id={clean_id}\n')
-                else:
-                    f.write(
-                        f'https://data.niaid.nih.gov/resources?id={record_id}\n')
-
-        logger.info(
-            f"Generated records file: {output_file} ({len(record_ids)} records)")
+            logger.info(f"Records file unchanged: {output_file}")
 
-    def run_automation(self, environment: str = 'both', force_update: bool = False) -> bool:
+    def run_automation(self, environment: str = 'both', force_update: bool = False,
+                       summary_file: str = None) -> bool:
         """Run the complete automation process"""
+        self.engine.reset()
+
         try:
             logger.info(
                 f"Starting program collections automation (environment: {environment})")
@@ -567,12 +477,20 @@ class ProgramCollectionsAutomator:
                 logger.warning(
                     f"Encountered {stats['errors']} errors during processing")
 
+            self.output_writer.log_summary()
             return True
 
         except Exception as e:
             logger.error(f"Automation failed: {e}")
             return False
 
+        finally:
+            if summary_file:
+                try:
+                    self.output_writer.write_summary(summary_file)
+                except OSError as e:
+                    logger.warning(f"Could not write run summary: {e}")
+
 
 def main():
     """Main entry point for the script"""
@@ -583,6 +501,20 @@ def main():
     parser.add_argument('--force-update', action='store_true',
                         help='Force update even if no changes detected')
     parser.add_argument('--base-path', help='Base path for the script')
+    parser.add_argument('--batch-query-length', type=int, nargs='?',
+                        const=DEFAULT_MAX_QUERY_LENGTH, default=0,
+                        help='Pack grants into OR-queries up to this encoded length '
+                             f'(default when given without a value: {DEFAULT_MAX_QUERY_LENGTH}; '
+                             '0 searches one grant per query)')
+    parser.add_argument('--search-concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Maximum concurrent grant searches (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--funding-index', action='store_true',
+                        help='Look grants up in a local index of one funding identifier '
+                             'export per build instead of querying the API per grant')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help=f'HTTP connection pool size (default: {DEFAULT_POOL_SIZE})')
+    parser.add_argument('--summary-file',
+                        help='Write a JSON summary of changed, unchanged and removed files')
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
                         default='INFO', help='Logging level')
 
@@ -592,10 +524,15 @@ def main():
     logging.getLogger().setLevel(getattr(logging, args.log_level))
 
     # Initialize automator
-    automator = ProgramCollectionsAutomator(args.base_path)
+    configure_shared_session(pool_size=args.pool_size)
+    automator = ProgramCollectionsAutomator(
+        args.base_path, batch_query_length=args.batch_query_length,
+        search_concurrency=args.search_concurrency,
+        use_funding_index=args.funding_index)
 
     # Run automation
-    success = automator.run_automation(args.environment, args.force_update)
+    success = automator.run_automation(args.environment, args.force_update,
+                                       summary_file=args.summary_file)
 
     # Exit with appropriate code
     sys.exit(0 if success else 1)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Program Collections Benchmark
+
+Runs ProgramCollectionsGenerator and ProgramCollectionsAutomator end to end
+against the mock NDE API (see mock_nde_api.py) with a synthetic program
+sheet scaled to a multiple of today's program count. Each run gets a fresh
+data directory and corrections checkout, and reports wall time, the number
+of API requests served and the peak Python memory traced during the run.
+
+A share of the programs is marked as control-transferred, and the
+corrections checkout is seeded with prior records files for them, so the
+local prior-record reads and merges are part of every run.
+
+Usage:
+    python benchmark.py --scale 10 100 --latency 0.02
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from automated_program_collections import ProgramCollectionsAutomator
+from grant_search import DEFAULT_MAX_QUERY_LENGTH
+from http_session import configure_shared_session
+from mock_nde_api import (DEFAULT_PAGE_SIZE, MockNDEAPI, synthetic_programs,
+                          synthetic_records)
+from program_collections_automation import ProgramCollectionsGenerator
+from record_sets import records_dir_name, render_records
+
+logger = logging.getLogger(__name__)
+
+# Programs in the metadata sheet today
+BASE_PROGRAM_COUNT = 90
+
+# Records listed in the seeded prior records file of each
+# control-transferred program
+PRIOR_RECORDS_PER_PROGRAM = 10
+
+GENERATORS = ['generator', 'automator']
+CODE_FILES = ['NIH_activity_codes.csv', 'NIH_IC_codes.tsv']
+SCRIPT_DATA_PATH = Path(__file__).resolve().parent / 'data'
+
+
+def build_sheet(programs: List[Dict[str, str]]) -> bytes:
+    """Render the program rows as an xlsx export with a metadata sheet"""
+    buffer = io.BytesIO()
+    pd.DataFrame(programs).to_excel(buffer, sheet_name='metadata',
+                                    index=False, engine='openpyxl')
+    return buffer.getvalue()
+
+
+def split_programs(programs: List[Dict[str, str]], prod_share: float,
+                   control_share: float) -> Tuple[List[str], List[str]]:
+    """Pick the approved and the control-transferred programs.
+
+    Approved programs are taken from the start of the list and
+    control-transferred ones from the end, so both kinds overlap only when
+    the shares add up to more than 1.
+    """
+    names = [program['fileName'] for program in programs]
+    approved = names[:int(len(names) * prod_share)]
+    control_count = int(len(names) * control_share)
+    control_transferred = names[len(names) - control_count:]
+    return approved, control_transferred
+
+
+def prepare_base_path(root: Path, approved: List[str],
+                      control_transferred: List[str]) -> Path:
+    """Create a data directory with the NIH code lists and program lists"""
+    data_path = root / 'data'
+    data_path.mkdir(parents=True)
+    for name in CODE_FILES:
+        shutil.copy(SCRIPT_DATA_PATH / name, data_path / name)
+
+    (data_path / 'approved_for_prod.txt').write_text(
+        ''.join(f'{name}\n' for name in approved))
+    (data_path / 'control_transferred.txt').write_text(
+        ''.join(f'{name}\n' for name in control_transferred))
+    return root
+
+
+def prepare_corrections(root: Path, approved: List[str],
+                        control_transferred: List[str]) -> Path:
+    """Create a corrections checkout with the prior records files of the
+    control-transferred programs"""
+    for environment in ['staging', 'production']:
+        (root / records_dir_name(environment)).mkdir(parents=True)
+
+    approved = set(approved)
+    for number, filename in enumerate(control_transferred):
+        prior_ids = [f'prior_{number:06d}_{index:03d}'
+                     for index in range(PRIOR_RECORDS_PER_PROGRAM)]
+        _, content = render_records(prior_ids)
+        environments = ['staging'] + (['production']
+                                      if filename in approved else [])
+        for environment in environments:
+            (root / records_dir_name(environment) /
+             f'{filename}_records.txt').write_text(content)
+    return root
+
+
+def make_generator(name: str, base_path: Path, corrections: Path,
+                   api: MockNDEAPI, args):
+    """Build a generator pointed at the mock API and the temp directories"""
+    if name == 'generator':
+        runner = ProgramCollectionsGenerator(
+            str(base_path),
+            search_concurrency=args.search_concurrency,
+            batch_query_length=args.batch_query_length,
+            workers=args.workers,
+            use_funding_index=args.funding_index
+        )
+        runner.sheets_url = api.sheet_url
+        runner.staging_api = runner.prod_api = api.query_url
+        runner.staging_metadata_api = api.metadata_url
+        runner.prod_metadata_api = api.metadata_url
+    else:
+        runner = ProgramCollectionsAutomator(
+            str(base_path), batch_query_length=args.batch_query_length,
+            search_concurrency=args.search_concurrency,
+            use_funding_index=args.funding_index)
+        runner.google_sheets_url = api.sheet_url
+        runner.staging_api_url = runner.production_api_url = api.query_url
+        runner.staging_metadata_url = api.metadata_url
+        runner.production_metadata_url = api.metadata_url
+
+    runner.correction_path = corrections
+    return runner
+
+
+def run_benchmark(name: str, scale: int, args) -> Dict[str, object]:
+    """Run one generator at one scale and measure it"""
+    programs = synthetic_programs(BASE_PROGRAM_COUNT * scale,
+                                  args.grants_per_program, seed=args.seed)
+    records = synthetic_records(programs, args.records_per_grant,
+                                seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            MockNDEAPI(records, page_size=args.page_size,
+                       latency=args.latency, error_rate=args.error_rate,
+                       retry_after=0, sheet=build_sheet(programs),
+                       seed=args.seed) as api:
+        temp_path = Path(temp_dir)
+        approved, control_transferred = split_programs(
+            programs, args.prod_share, args.control_share)
+        base_path = prepare_base_path(temp_path / 'scripts', approved,
+                                      control_transferred)
+        corrections = prepare_corrections(temp_path / 'corrections',
+                                          approved, control_transferred)
+        runner = make_generator(name, base_path, corrections, api, args)
+
+        api.reset_counts()
+        tracemalloc.start()
+        start = time.perf_counter()
+        success = runner.run_automation('both', force_update=True)
+        wall_seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        outputs = sum(1 for _ in corrections.glob(
+            'collections_corrections_*/*'))
+
+        return {
+            'generator': name,
+            'scale': scale,
+            'programs': len(programs),
+            'control_transferred': len(control_transferred),
+            'records': len(records),
+            'success': success,
+            'wall_seconds': round(wall_seconds, 3),
+            'requests': api.total_requests,
+            'requests_by_endpoint': {f'{path} {status}': count for
+                                     (path, status), count
+                                     in sorted(api.request_counts.items())},
+            'bytes_served': api.bytes_sent,
+            'peak_memory_mb': round(peak / 2 ** 20, 2),
+            'output_files': outputs
+        }
+
+
+def print_results(results: List[Dict[str, object]]):
+    """Print the benchmark results as a table"""
+    header = (f"{'generator':<10} {'scale':>5} {'programs':>8} "
+              f"{'wall (s)':>9} {'requests':>9} {'peak (MB)':>10} "
+              f"{'files':>6}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        status = '' if result['success'] else '  FAILED'
+        print(f"{result['generator']:<10} {result['scale']:>5} "
+              f"{result['programs']:>8} {result['wall_seconds']:>9.2f} "
+              f"{result['requests']:>9} {result['peak_memory_mb']:>10.1f} "
+              f"{result['output_files']:>6}{status}")
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the program collections generators offline'
+    )
+    parser.add_argument('--scale', type=int, nargs='+', default=[10, 100],
+                        help='Multiples of today\'s program count '
+                             f'({BASE_PROGRAM_COUNT}) to run (default: 10 100)')
+    parser.add_argument('--generators', nargs='+', choices=GENERATORS,
+                        default=GENERATORS, help='Generators to benchmark')
+    parser.add_argument('--grants-per-program', type=int, default=8,
+                        help='Grants per synthetic program (default: 8)')
+    parser.add_argument('--records-per-grant', type=int, default=3,
+                        help='Records citing each grant (default: 3)')
+    parser.add_argument('--prod-share', type=float, default=0.6,
+                        help='Share of programs approved for production '
+                             '(default: 0.6)')
+    parser.add_argument('--control-share', type=float, default=0.1,
+                        help='Share of programs marked as control-transferred '
+                             '(default: 0.1)')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help='Mock API scroll page size '
+                             f'(default: {DEFAULT_PAGE_SIZE})')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the mock API adds to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of mock API requests answered with 503')
+    parser.add_argument('--search-concurrency', type=int, default=8,
+                        help='Concurrent grant searches (default: 8)')
+    parser.add_argument('--batch-query-length', type=int, nargs='?',
+                        const=DEFAULT_MAX_QUERY_LENGTH, default=0,
+                        help='Batch grants into OR-queries up to this length')
+    parser.add_argument('--funding-index', action='store_true',
+                        help='Look grants up in a funding identifier index')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parallel programs for ProgramCollectionsGenerator')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the synthetic data (default: 0)')
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--log-level',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        default='WARNING', help='Logging level')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    # The generators must download the sheet from the mock, not the API
+    os.environ.pop('GOOGLE_SHEETS_CREDENTIALS', None)
+    configure_shared_session()
+
+    results = []
+    for scale in args.scale:
+        for name in args.generators:
+            logger.warning(f"Running {name} at {scale}x")
+            results.append(run_benchmark(name, scale, args))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(0 if all(result['success'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
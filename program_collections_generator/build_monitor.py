@@ -3,18 +3,33 @@
 Build Monitor for Program Collections
 
 This script continuously monitors the NIAID staging API for new builds
-and triggers program collections updates when changes are detected.
+and triggers program collections updates when changes are detected. With
+--environment both, staging and production are watched on separate threads,
+so a long production update does not delay detecting a staging build.
+
+Polling is adaptive: the wait between checks doubles while builds are
+stable, up to --max-interval, and drops back to --interval as soon as a
+build lands. Build info is fetched with conditional requests, so a poll of
+an unchanged build is answered with a 304. With --listen, a local webhook
+endpoint triggers a check immediately when a build is pushed.
 
 Usage:
     python build_monitor.py [--interval 300] [--environment staging]
+                            [--max-interval 3600] [--listen 8080]
 """
 
 import argparse
+import hashlib
+import hmac
 import logging
+import os
 import signal
 import sys
-import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
 
+from http_session import create_session
 from program_collections_automation import ProgramCollectionsGenerator
 
 logging.basicConfig(
@@ -24,85 +39,284 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-class BuildMonitor:
-    """Monitors API builds and triggers updates"""
+# Shared secret for GitHub-style X-Hub-Signature-256 webhook signatures
+WEBHOOK_SECRET_ENV = 'BUILD_MONITOR_WEBHOOK_SECRET'
+
+
+class WebhookListener:
+    """Local HTTP endpoint that triggers a build check on POST.
+
+    A POST to /staging or /production checks that environment; a POST to
+    any other path checks every monitored environment.
+    """
+
+    def __init__(self, port: int, on_push: Callable[[Optional[str]], None],
+                 host: str = '127.0.0.1', secret: Optional[str] = None):
+        self.port = port
+        self.host = host
+        self.on_push = on_push
+        self.secret = secret.encode('utf-8') if secret else None
+        self._server = None
+
+    def _verify(self, body: bytes, signature: Optional[str]) -> bool:
+        """Check the request signature when a secret is configured"""
+        if not self.secret:
+            return True
+        expected = 'sha256=' + hmac.new(self.secret, body,
+                                        hashlib.sha256).hexdigest()
+        return bool(signature) and hmac.compare_digest(expected, signature)
+
+    def start(self):
+        """Serve webhook requests on a background thread"""
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                self._reply(200, b'ok')
 
-    def __init__(self, check_interval: int = 300, environment: str = 'staging'):
-        self.generator = ProgramCollectionsGenerator()
-        self.check_interval = check_interval  # seconds
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if not listener._verify(
+                        body, self.headers.get('X-Hub-Signature-256')):
+                    logger.warning("Rejected webhook with a bad signature")
+                    self._reply(401, b'invalid signature')
+                    return
+                logger.info(f"Webhook received on {self.path}")
+                environment = self.path.strip('/')
+                listener.on_push(environment if environment in
+                                 ['staging', 'production'] else None)
+                self._reply(202, b'check scheduled')
+
+            def _reply(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        logger.info(f"👂 Listening for build webhooks on "
+                    f"http://{self.host}:{self.port}/")
+
+    def stop(self):
+        """Stop serving"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class EnvironmentWatch:
+    """Polls one environment and regenerates its collections on a new build.
+
+    Each watch has its own generator, HTTP session, polling interval, last
+    seen build and update lock, so environments are monitored independently,
+    two updates of the same environment never overlap, and the run metrics
+    of one watch never count the requests of the other.
+    """
+
+    def __init__(self, environment: str, check_interval: int = 300,
+                 max_interval: int = 3600, backoff: float = 2.0):
         self.environment = environment
-        self.running = True
+        self.generator = ProgramCollectionsGenerator(session=create_session())
+        self.check_interval = check_interval  # seconds, after a new build
+        self.max_interval = max(max_interval, check_interval)
+        self.backoff = max(1.0, backoff)
+        self.last_build = None
+        self.last_build_detected = False
 
-        # Set up signal handler for graceful shutdown
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        self._update_lock = threading.Lock()
+        # Set to check before the interval ends
+        self._wake = threading.Event()
 
-    def _signal_handler(self, signum, frame):
-        """Handle shutdown signals"""
-        logger.info(f"Received signal {signum}, shutting down gracefully...")
-        self.running = False
+    @property
+    def metadata_url(self) -> str:
+        return self.generator.metadata_url(self.environment)
+
+    def trigger(self):
+        """Check for a new build now instead of at the next interval"""
+        self._wake.set()
+
+    def next_interval(self, interval: float) -> float:
+        """Tighten polling after a build, back off while builds are stable"""
+        if self.last_build_detected:
+            return self.check_interval
+        return min(interval * self.backoff, self.max_interval)
 
     def check_and_update(self) -> bool:
-        """Check for new builds and update if needed"""
+        """Check for a new build and update if needed"""
+        if not self._update_lock.acquire(blocking=False):
+            logger.info(f"[{self.environment}] Update already in progress, "
+                        "skipping check")
+            return True
+
+        self.last_build_detected = False
         try:
-            logger.info(f"Checking for new {self.environment} build...")
+            logger.info(f"[{self.environment}] Checking for new build...")
 
             # Check if update is needed
-            if self.generator.should_update(self.environment, force_update=False):
-                logger.info("New build detected, triggering update...")
+            needs_update = self.generator.should_update(self.environment,
+                                                        force_update=False)
+            self.last_build = (self.generator.build_info
+                               .get(self.environment, {})
+                               .get('build_version') or self.last_build)
+
+            if needs_update:
+                logger.info(f"[{self.environment}] New build "
+                            f"{self.last_build} detected, triggering update...")
+                self.last_build_detected = True
 
+                # The build was just checked, so the run reuses it
                 success = self.generator.run_automation(
                     self.environment,
-                    force_update=False
+                    force_update=False,
+                    build_checked=True
                 )
 
                 if success:
-                    logger.info("✅ Program collections updated successfully!")
+                    logger.info(f"[{self.environment}] ✅ Program collections "
+                                "updated successfully!")
                     return True
                 else:
-                    logger.error("❌ Program collections update failed!")
+                    logger.error(f"[{self.environment}] ❌ Program "
+                                 "collections update failed!")
                     return False
             else:
-                logger.info("No new build detected, no update needed")
+                logger.info(f"[{self.environment}] No new build detected, "
+                            "no update needed")
                 return True
 
         except Exception as e:
-            logger.error(f"Error during check and update: {e}")
+            logger.error(f"[{self.environment}] Error during check and "
+                         f"update: {e}")
             return False
 
-    def run(self):
-        """Main monitoring loop"""
-        logger.info(f"🚀 Starting build monitor for {self.environment}")
-        logger.info(f"📅 Check interval: {self.check_interval} seconds")
-        logger.info(
-            f"🔗 Monitoring: {self.generator.staging_metadata_api if self.environment == 'staging' else self.generator.prod_metadata_api}")
+        finally:
+            self._update_lock.release()
+
+    def run(self, stop: threading.Event):
+        """Monitoring loop for this environment, until stop is set"""
+        logger.info(f"[{self.environment}] 📅 Check interval: "
+                    f"{self.check_interval} to {self.max_interval} seconds")
+        logger.info(f"[{self.environment}] 🔗 Monitoring: {self.metadata_url}")
 
         # Perform initial check
-        logger.info("Performing initial build check...")
         self.check_and_update()
+        interval = self.next_interval(self.check_interval)
 
-        # Main monitoring loop
-        while self.running:
+        while not stop.is_set():
             try:
-                logger.info(
-                    f"⏰ Waiting {self.check_interval} seconds until next check...")
-
-                # Sleep in smaller chunks to respond to signals faster
-                sleep_remaining = self.check_interval
-                while sleep_remaining > 0 and self.running:
-                    sleep_chunk = min(10, sleep_remaining)
-                    time.sleep(sleep_chunk)
-                    sleep_remaining -= sleep_chunk
-
-                if self.running:
-                    self.check_and_update()
-
-            except KeyboardInterrupt:
-                logger.info("Received keyboard interrupt")
-                break
+                logger.info(f"[{self.environment}] ⏰ Waiting "
+                            f"{interval:.0f} seconds until next check...")
+
+                # Woken early by a webhook or a shutdown signal
+                triggered = self._wake.wait(interval)
+                self._wake.clear()
+                if stop.is_set():
+                    break
+
+                self.check_and_update()
+                if triggered:
+                    interval = self.check_interval
+                else:
+                    interval = self.next_interval(interval)
+
             except Exception as e:
-                logger.error(f"Unexpected error in monitoring loop: {e}")
-                time.sleep(60)  # Wait before retrying
+                logger.error(f"[{self.environment}] Unexpected error in "
+                             f"monitoring loop: {e}")
+                stop.wait(60)  # Wait before retrying
+
+
+class BuildMonitor:
+    """Monitors API builds and triggers updates"""
+
+    def __init__(self, check_interval: int = 300, environment: str = 'staging',
+                 max_interval: int = 3600, backoff: float = 2.0,
+                 intervals: Dict[str, int] = None):
+        self.environment = environment
+        self.running = True
+
+        environments = (['staging', 'production'] if environment == 'both'
+                        else [environment])
+        intervals = intervals or {}
+        self.watches = {
+            env: EnvironmentWatch(env, intervals.get(env) or check_interval,
+                                  max_interval=max_interval, backoff=backoff)
+            for env in environments
+        }
+
+        # Set to stop every environment's loop
+        self._stop = threading.Event()
+
+        # Set up signal handler for graceful shutdown
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+    def _signal_handler(self, signum, frame):
+        """Handle shutdown signals"""
+        logger.info(f"Received signal {signum}, shutting down gracefully...")
+        self.stop()
+
+    def stop(self):
+        """Stop the monitoring loops"""
+        self.running = False
+        self._stop.set()
+        for watch in self.watches.values():
+            watch.trigger()
+
+    def trigger(self, environment: Optional[str] = None):
+        """Check one environment, or all of them, now"""
+        for env, watch in self.watches.items():
+            if environment in (None, env):
+                watch.trigger()
+
+    def check_and_update(self) -> bool:
+        """Check every environment concurrently and update where needed"""
+        results = {}
+
+        def check(env, watch):
+            results[env] = watch.check_and_update()
+
+        threads = [threading.Thread(target=check, args=item)
+                   for item in self.watches.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return all(results.values())
+
+    def run(self):
+        """Main monitoring loop, one thread per environment"""
+        logger.info(f"🚀 Starting build monitor for "
+                    f"{', '.join(self.watches)}")
+
+        threads = [
+            threading.Thread(target=watch.run, args=(self._stop,),
+                             name=f'monitor-{env}')
+            for env, watch in self.watches.items()
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Wake regularly so signals are handled on the main thread
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            logger.info("Received keyboard interrupt")
+            self.stop()
+
+        # Let in-flight updates finish before exiting
+        for thread in threads:
+            thread.join()
 
         logger.info("🛑 Build monitor stopped")
 
@@ -116,7 +330,44 @@ def main():
         '--interval',
         type=int,
         default=300,
-        help='Check interval in seconds (default: 300 = 5 minutes)'
+        help='Check interval in seconds after a new build '
+             '(default: 300 = 5 minutes)'
+    )
+    parser.add_argument(
+        '--staging-interval',
+        type=int,
+        help='Check interval for staging (default: --interval)'
+    )
+    parser.add_argument(
+        '--production-interval',
+        type=int,
+        help='Check interval for production (default: --interval)'
+    )
+    parser.add_argument(
+        '--max-interval',
+        type=int,
+        default=3600,
+        help='Longest interval to back off to while builds are stable '
+             '(default: 3600 = 1 hour)'
+    )
+    parser.add_argument(
+        '--backoff',
+        type=float,
+        default=2.0,
+        help='Interval multiplier after each check without a new build '
+             '(default: 2.0; 1.0 polls at a fixed interval)'
+    )
+    parser.add_argument(
+        '--listen',
+        type=int,
+        metavar='PORT',
+        help='Trigger a check when a webhook is POSTed to this local port '
+             f'(signatures are verified if {WEBHOOK_SECRET_ENV} is set)'
+    )
+    parser.add_argument(
+        '--listen-host',
+        default='127.0.0.1',
+        help='Address for the webhook listener (default: 127.0.0.1)'
     )
     parser.add_argument(
         '--environment',
@@ -137,14 +388,34 @@ def main():
     logging.getLogger().setLevel(getattr(logging, args.log_level))
 
     # Validate interval
-    if args.interval < 60:
+    if min(x for x in [args.interval, args.staging_interval,
+                       args.production_interval] if x) < 60:
         logger.warning(
             "Check interval is less than 60 seconds, this may be too frequent")
 
     # Create and run monitor
     try:
-        monitor = BuildMonitor(args.interval, args.environment)
-        monitor.run()
+        monitor = BuildMonitor(args.interval, args.environment,
+                               max_interval=args.max_interval,
+                               backoff=args.backoff,
+                               intervals={
+                                   'staging': args.staging_interval,
+                                   'production': args.production_interval
+                               })
+
+        listener = None
+        if args.listen:
+            listener = WebhookListener(args.listen, monitor.trigger,
+                                       host=args.listen_host,
+                                       secret=os.environ.get(
+                                           WEBHOOK_SECRET_ENV))
+            listener.start()
+
+        try:
+            monitor.run()
+        finally:
+            if listener:
+                listener.stop()
     except Exception as e:
         logger.error(f"Failed to start build monitor: {e}")
         sys.exit(1)
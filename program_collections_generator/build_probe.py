@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Build Probe
+
+Fetches the build information of several API environments at once. Every
+environment's `/v1/metadata` endpoint is requested concurrently on one
+aiohttp session, so checking staging and production costs a single
+round-trip instead of one blocking request after another.
+
+A BuildProbe remembers the ETag and Last-Modified validators of each
+endpoint and sends them back as If-None-Match / If-Modified-Since, so a
+poll of an unchanged build is answered with an empty 304 and the build
+information from the previous poll is reused.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from http_session import get_json_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+
+BUILD_FIELDS = ['build_date', 'build_version', 'biothing_type']
+
+
+def parse_build_info(data: dict) -> Dict[str, str]:
+    """Keep the build fields of a metadata response"""
+    return {field: data.get(field, '') for field in BUILD_FIELDS}
+
+
+class BuildProbe:
+    """Conditional, concurrent requests for environment build information"""
+
+    def __init__(self, timeout: int = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        # url -> {'etag', 'last_modified', 'build_info'}
+        self.validators = {}
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def _conditional_headers(self, url: str) -> Dict[str, str]:
+        """Build If-None-Match / If-Modified-Since headers for a URL"""
+        with self._lock:
+            cached = self.validators.get(url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    async def _probe(self, session: aiohttp.ClientSession, environment: str,
+                     url: str) -> Dict[str, str]:
+        """Fetch the build information of one environment, {} on failure"""
+        try:
+            status, data, headers = await get_json_response(
+                session, url, headers=self._conditional_headers(url))
+
+            if status == 304:
+                with self._lock:
+                    self.not_modified += 1
+                    cached = self.validators.get(url)
+                if cached:
+                    logger.debug(f"{environment} build info not modified")
+                    return dict(cached['build_info'])
+                raise ValueError(f"HTTP 304 without a cached build from {url}")
+
+            if status >= 400 or not isinstance(data, dict):
+                raise ValueError(f"HTTP {status} from {url}")
+
+            build_info = parse_build_info(data)
+            with self._lock:
+                self.validators[url] = {
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                    'build_info': build_info
+                }
+            return dict(build_info)
+
+        except Exception as e:
+            logger.error(f"Failed to get {environment} build info: {e}")
+            return {}
+
+    async def probe_async(self, metadata_urls: Dict[str, str],
+                          trace_configs: Optional[List] = None
+                          ) -> Dict[str, Dict[str, str]]:
+        """Fetch the build information of every environment concurrently"""
+        if not metadata_urls:
+            return {}
+
+        client_timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(
+                timeout=client_timeout,
+                trace_configs=trace_configs) as session:
+            results = await asyncio.gather(*[
+                self._probe(session, environment, url)
+                for environment, url in metadata_urls.items()
+            ])
+
+        return dict(zip(metadata_urls, results))
+
+    def probe(self, metadata_urls: Dict[str, str],
+              trace_configs: Optional[List] = None
+              ) -> Dict[str, Dict[str, str]]:
+        """Blocking wrapper around probe_async"""
+        return asyncio.run(self.probe_async(metadata_urls,
+                                            trace_configs=trace_configs))
+
+
+def probe_builds(metadata_urls: Dict[str, str],
+                 timeout: int = DEFAULT_TIMEOUT,
+                 trace_configs: Optional[List] = None
+                 ) -> Dict[str, Dict[str, str]]:
+    """Fetch the build information of every environment concurrently"""
+    return BuildProbe(timeout).probe(metadata_urls,
+                                     trace_configs=trace_configs)
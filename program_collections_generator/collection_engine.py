@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Collection Engine
+
+Search and output core shared by ProgramCollectionsGenerator and
+ProgramCollectionsAutomator. The engine owns everything a run needs after
+the program sheet is loaded: the HTTP session, the concurrent grant search,
+the per-run search memo and per-build search caches, the output writer and
+the prior records of control-transferred programs.
+
+The two generators differ only in how a grant's hits become record IDs,
+which is a pluggable SearchStrategy:
+
+- WildcardSearch keeps every hit of a `*GRANT*` query (the hits of batched
+  queries are matched back to their grants by funding identifier).
+- FundingMatchSearch also runs the exact `funding.identifier:GRANT` query
+  and only keeps hits whose funding identifiers contain the grant.
+
+With an index_path, either strategy looks grants up in a local funding
+identifier index of the current build (see funding_index.py) instead of
+querying the API per grant.
+"""
+
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+import requests
+
+from funding_index import FundingIndex, load_or_build, parser_version
+from grant_parser import GrantIDParser
+from grant_search import (DEFAULT_CONCURRENCY, get_funding_identifiers,
+                          search_grants)
+from http_session import get_shared_session
+from output_writer import OutputWriter
+from record_sets import (PriorRecords, merge_prior_records, records_dir_name,
+                         write_records_file)
+from run_metrics import RunMetrics
+from search_cache import SearchCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_array_text(text: str) -> List[str]:
+    """Parse comma or pipe-separated text into a list"""
+    if pd.isna(text) or text == 'not found':
+        return []
+
+    text = str(text).replace('*', '')
+    if ',' in text:
+        items = text.split(',')
+    elif '|' in text:
+        items = text.split('|')
+    else:
+        items = [text]
+
+    return [x.strip() for x in items if x.strip()]
+
+
+def build_metadata(row) -> Dict[str, list]:
+    """Build the correction document of a program row"""
+    description = (f"{row['description']} For more information, "
+                   f"visit the NIAID program page: {row['niaidURL']}")
+
+    metadata = {
+        "@type": "ResearchProject",
+        "name": row["name"],
+        "abstract": row["abstract"],
+        "description": description,
+        "alternateName": parse_array_text(row.get('alternateName', '')),
+        "url": row["url"],
+        "parentOrganization": parse_array_text(
+            row.get('parentOrganization', ''))
+    }
+
+    return {"sourceOrganization": [metadata]}
+
+
+class SearchStrategy(ABC):
+    """How grants are queried and how their hits become record IDs"""
+
+    # Run both the wildcard and the exact query for unbatched grants
+    exact = False
+
+    def __init__(self, max_query_length: int = 0):
+        # Query length budget for batched searches (0 disables batching)
+        self.max_query_length = max_query_length
+
+    @property
+    @abstractmethod
+    def mode(self) -> str:
+        """Name of the strategy, used to key search caches"""
+
+    @abstractmethod
+    def record_ids(self, grant: str, hits: Iterable[dict]) -> List[str]:
+        """Return the IDs of the hits kept for a grant"""
+
+    def search(self, api_url: str, grants: List[str],
+               concurrency: int = DEFAULT_CONCURRENCY,
+               trace_configs: Optional[list] = None,
+               timings: Optional[Dict[str, float]] = None,
+               index: Optional[FundingIndex] = None,
+               incomplete: Optional[Set[str]] = None
+               ) -> Dict[str, List[str]]:
+        """Search grants concurrently; failed grants are left out.
+
+        Grants whose search failed in whole or in part are added to
+        incomplete. With a funding index the grants are looked up locally
+        instead.
+        """
+        if index is not None:
+            found = index.search(grants)
+        else:
+            found = search_grants(api_url, grants, concurrency=concurrency,
+                                  max_query_length=self.max_query_length,
+                                  exact=self.exact,
+                                  trace_configs=trace_configs,
+                                  timings=timings, incomplete=incomplete)
+        return {grant: self.record_ids(grant, hits)
+                for grant, hits in found.items()}
+
+
+class WildcardSearch(SearchStrategy):
+    """Keeps every hit of a grant's wildcard query"""
+
+    @property
+    def mode(self) -> str:
+        return 'matched' if self.max_query_length else 'wildcard'
+
+    def record_ids(self, grant: str, hits: Iterable[dict]) -> List[str]:
+        return list(dict.fromkeys(hit['_id'] for hit in hits))
+
+
+class FundingMatchSearch(SearchStrategy):
+    """Keeps the hits whose funding identifiers contain the grant.
+
+    Unbatched grants are searched with both the wildcard and the exact
+    query; a batched wildcard query covers the exact one once its hits are
+    filtered by identifier.
+    """
+
+    exact = True
+
+    @property
+    def mode(self) -> str:
+        return 'funding_match'
+
+    def record_ids(self, grant: str, hits: Iterable[dict]) -> List[str]:
+        return list(dict.fromkeys(
+            hit['_id'] for hit in hits
+            if any(grant in identifier
+                   for identifier in get_funding_identifiers(hit))))
+
+
+class CollectionEngine:
+    """Searches grants and writes program collection files"""
+
+    def __init__(self, correction_path: Path, strategy: SearchStrategy,
+                 session: requests.Session = None,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 use_search_cache: bool = False,
+                 index_path: Path = None):
+        self.correction_path = Path(correction_path)
+        self.strategy = strategy
+
+        # Pooled session with retries shared by all blocking HTTP calls
+        self.session = session or get_shared_session()
+
+        # Maximum number of grant searches in flight at once
+        self.concurrency = concurrency
+
+        # Grant search results cached per environment and API build
+        self.use_search_cache = use_search_cache
+
+        # Directory of the saved funding indexes; None queries the API
+        self.index_path = Path(index_path) if index_path else None
+        # Parser the index keys are built with, set by the generator
+        self.grant_parser: Optional[GrantIDParser] = None
+        # Funding index of each environment's build, kept across runs
+        self.funding_indexes = {}
+        self._index_lock = threading.Lock()
+
+        self.reset()
+
+    def reset(self):
+        """Start a new run with empty run state"""
+        # Writes output files on change and tracks what the run touched
+        self.output_writer = OutputWriter(self.correction_path)
+
+        # Records files as they were before this run
+        self.prior_records = PriorRecords(self.correction_path, self.session)
+
+        # Stage timings, HTTP calls and counters of the run
+        self.metrics = RunMetrics()
+
+        # Cache shards of the builds searched in this run, by environment
+        self.search_caches = {}
+
+        # Search results shared by all programs and environments of the run,
+        # keyed by API URL, search mode and grant
+        self._search_memo = {}
+        self._search_memo_lock = threading.Lock()
+
+        # Build versions the funding indexes were checked against this run;
+        # None for environments whose index could not be built
+        self._index_versions = {}
+
+    @property
+    def search_mode(self) -> str:
+        """Strategy mode, marking lookups in a funding index"""
+        mode = self.strategy.mode
+        return f'{mode}+index' if self.index_path else mode
+
+    def output_dir(self, environment: str) -> Path:
+        """Get the corrections directory for an environment"""
+        return self.correction_path / records_dir_name(environment)
+
+    def output_files(self, filename: str, environment: str) -> List[Path]:
+        """Get the correction and records files of a program"""
+        output_dir = self.output_dir(environment)
+        return [output_dir / f'{filename}_correction.json',
+                output_dir / f'{filename}_records.txt']
+
+    def search_cache(self, environment: str,
+                     build_version: Callable[[], str]
+                     ) -> Optional[SearchCache]:
+        """Get the search cache for the current build of an environment.
+
+        build_version is only called the first time an environment's cache
+        is needed in a run.
+        """
+        if not self.use_search_cache:
+            return None
+
+        if environment not in self.search_caches:
+            version = build_version()
+            if not version:
+                logger.warning(f"No {environment} build version available, "
+                               "searching without cache")
+                self.search_caches[environment] = None
+                return None
+
+            cache_file = (self.correction_path /
+                          f'search_cache_{environment}.json')
+            self.search_caches[environment] = SearchCache.load(
+                cache_file, version, self.search_mode)
+
+        return self.search_caches[environment]
+
+    def funding_index(self, api_url: str, environment: str,
+                      build_version: Callable[[], str] = None
+                      ) -> Optional[FundingIndex]:
+        """Get the funding index of an environment's current build.
+
+        The index is loaded or built the first time it is needed for a
+        build. Returns None, and grants are searched on the API, when
+        indexing is off or the index cannot be built.
+        """
+        if self.index_path is None:
+            return None
+
+        with self._index_lock:
+            if environment not in self._index_versions:
+                version = build_version() if build_version else ''
+                if not version or self.grant_parser is None:
+                    logger.warning(f"No {environment} build version or grant "
+                                   "parser available, searching without index")
+                    version = None
+                self._index_versions[environment] = version
+
+            version = self._index_versions[environment]
+            if version is None:
+                return None
+
+            index = self.funding_indexes.get(environment)
+            if (index is None or index.build_version != version or
+                    index.key_version != parser_version(self.grant_parser)):
+                index_file = self.index_path / f'funding_index_{environment}.pkl'
+                try:
+                    with self.metrics.stage('funding_index'):
+                        index = load_or_build(index_file, api_url, version,
+                                              self.grant_parser, self.session)
+                except Exception as e:
+                    logger.warning(f"Could not build {environment} funding "
+                                   f"index, searching without it: {e}")
+                    self._index_versions[environment] = None
+                    return None
+                self.funding_indexes[environment] = index
+
+        return index
+
+    def save_search_caches(self):
+        """Persist the search caches of all environments"""
+        for cache in self.search_caches.values():
+            if cache is None:
+                continue
+            try:
+                cache.save(self.output_writer)
+            except OSError as e:
+                logger.warning(f"Could not save search cache: {e}")
+
+    def search_grants(self, api_url: str, grants: List[str],
+                      environment: str,
+                      build_version: Callable[[], str] = None,
+                      failed: Optional[Set[str]] = None
+                      ) -> Dict[str, List[str]]:
+        """Return the record IDs of each grant.
+
+        Grants are answered from the search cache of the environment's build
+        and from searches other programs already made in this run; the rest
+        are searched concurrently. Grants whose search failed are left out,
+        and grants whose search failed in whole or in part are added to
+        failed. Only complete results are cached and shared with other
+        programs.
+        """
+        results = {}
+
+        # Look grants up locally when the build has a funding index,
+        # otherwise reuse results for grants already searched against it
+        index = self.funding_index(api_url, environment, build_version)
+        cache = (self.search_cache(environment, build_version)
+                 if build_version and index is None else None)
+        pending = []
+        for grant in dict.fromkeys(grants):
+            cached = cache.get(grant) if cache else None
+            if cached is None:
+                pending.append(grant)
+            else:
+                results[grant] = cached
+
+        # Claim the grants no other program has searched on this API yet
+        mode = self.search_mode
+        owned = []
+        waiting = []
+        with self._search_memo_lock:
+            for grant in pending:
+                future = self._search_memo.get((api_url, mode, grant))
+                if future is None:
+                    future = Future()
+                    self._search_memo[(api_url, mode, grant)] = future
+                    owned.append(grant)
+                waiting.append((grant, future))
+
+        found = {}
+        incomplete = set()
+        timings = {}
+        try:
+            if owned:
+                with self.metrics.stage('grant_search'):
+                    found = self.strategy.search(
+                        api_url, owned, concurrency=self.concurrency,
+                        trace_configs=[self.metrics.trace_config()],
+                        timings=timings, index=index, incomplete=incomplete)
+        finally:
+            for query, seconds in timings.items():
+                self.metrics.record_grant(environment, query, seconds)
+            self.metrics.increment('grants_searched', len(owned))
+            with self._search_memo_lock:
+                for grant in owned:
+                    future = self._search_memo[(api_url, mode, grant)]
+                    if grant in found and grant not in incomplete:
+                        future.set_result((found[grant], True))
+                    else:
+                        # Let a later program retry a failed search
+                        del self._search_memo[(api_url, mode, grant)]
+                        future.set_result((found.get(grant), False))
+
+        for grant, future in waiting:
+            record_ids, complete = future.result()
+            if not complete and failed is not None:
+                failed.add(grant)
+            if record_ids is None:
+                continue
+            results[grant] = record_ids
+            if cache and complete:
+                cache.set(grant, record_ids)
+
+        missing = [grant for grant in grants if not results.get(grant)]
+        if missing:
+            logger.info(f"No records found for grants: {missing}")
+
+        return results
+
+    def search_records(self, api_url: str, grants: List[str],
+                       environment: str,
+                       build_version: Callable[[], str] = None,
+                       failed: Optional[Set[str]] = None) -> List[str]:
+        """Return the record IDs found for any of the grants.
+
+        Grants whose search failed in whole or in part are added to failed.
+        """
+        record_ids = set()
+        for grant_ids in self.search_grants(api_url, grants, environment,
+                                            build_version, failed).values():
+            record_ids.update(grant_ids)
+        return list(record_ids)
+
+    def write_metadata_file(self, row, environment: str) -> bool:
+        """Write a program's correction file; returns True if written"""
+        output_file = self.output_files(row['fileName'], environment)[0]
+        output_file.parent.mkdir(exist_ok=True)
+
+        with self.metrics.stage('write_files'):
+            return self.output_writer.write_json(output_file,
+                                                 build_metadata(row),
+                                                 indent=4)
+
+    def write_records_file(self, filename: str, environment: str,
+                           record_ids: Iterable[str],
+                           control_transferred: bool = False) -> bool:
+        """Write a program's records file; returns True if written.
+
+        The records of a control-transferred program are merged with the
+        records its file already lists.
+        """
+        if control_transferred:
+            with self.metrics.stage('prior_records'):
+                prior_ids = self.prior_records.get(filename, environment)
+            record_ids = merge_prior_records(record_ids, prior_ids)
+
+        output_file = self.output_files(filename, environment)[1]
+        output_file.parent.mkdir(exist_ok=True)
+
+        with self.metrics.stage('write_files'):
+            return write_records_file(self.output_writer, output_file,
+                                      record_ids)
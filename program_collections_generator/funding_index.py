@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Funding Identifier Index
+
+A local inverted index of the funding identifiers of every record in one API
+build. The index is built from a single streamed `fetch_all` export of
+`_exists_:funding.identifier`, instead of one wildcard query per grant, and
+maps the IC code + serial number search key of each identifier (as produced
+by GrantIDParser.search_key) to the records citing it.
+
+Lookups return hit-shaped dicts ({'_id', 'funding'}), so search strategies
+filter them exactly as they filter live search hits. The records indexed
+under a key are combined with every record whose identifiers contain the key
+as a substring, so a lookup returns every record a `*KEY*` wildcard query
+would, including identifiers that parse to a different key (for example
+'NIH-AI073685').
+
+Substring matches come from a second, token index: each run of letters
+followed by a run of digits in an identifier is indexed under the digits
+prefixed with every suffix of the letters ('NIH-AI073685' under 'I073685'
+and 'AI073685'). A key made of letters and digits, such as an IC code +
+serial number, can only occur in an identifier as a prefix of one of its
+tokens, so its candidates are a range of the sorted tokens and a lookup
+costs the same whatever the number of records. Keys of any other shape
+(contract numbers, grants that do not parse) fall back to a scan of every
+identifier. Lookups are remembered per key.
+
+An index is saved as a pickle per environment, tagged with the build version
+and NIH code lists it was built from, and rebuilt when either changes.
+"""
+
+import bisect
+import logging
+import pickle
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from grant_parser import GrantIDParser
+from grant_search import get_funding_identifiers, iter_query_hits
+from output_writer import atomic_write, content_digest
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 2
+EXPORT_QUERY = '_exists_:funding.identifier'
+EXPORT_FIELDS = '_id,funding.identifier'
+
+# Separators between grants listed in one identifier
+IDENTIFIER_SEPARATORS = re.compile(r'[\s,;/|]+')
+
+# Longest letter prefix indexed before a run of digits; keys with longer
+# prefixes are scanned
+MAX_TOKEN_LETTERS = 8
+
+# A run of letters followed by a run of digits in an upper-cased identifier
+IDENTIFIER_TOKEN = re.compile(r'([A-Z]*)([0-9]+)')
+
+# Keys that can be looked up in the token index, split into the letters and
+# the digit run its tokens start with
+TOKEN_KEY = re.compile(rf'([A-Z]{{1,{MAX_TOKEN_LETTERS}}})([0-9]+)')
+
+
+def parser_version(parser: GrantIDParser) -> str:
+    """Identify the code lists a parser was compiled from"""
+    codes = '\n'.join(sorted(parser.act_codes)) + '\n\n' + \
+        '\n'.join(sorted(parser.ic_codes))
+    return content_digest(codes.encode('utf-8'))
+
+
+def identifier_keys(parser: GrantIDParser, identifier: str) -> List[str]:
+    """Return the search keys of a funding identifier and of its parts"""
+    parts = [identifier] + IDENTIFIER_SEPARATORS.split(identifier)
+    return list(dict.fromkeys(parser.search_key(part).upper()
+                              for part in parts if part.strip()))
+
+
+def identifier_tokens(identifier: str) -> List[str]:
+    """Return the substring index tokens of a funding identifier"""
+    tokens = []
+    for letters, digits in IDENTIFIER_TOKEN.findall(identifier.upper()):
+        for start in range(max(0, len(letters) - MAX_TOKEN_LETTERS),
+                           len(letters)):
+            tokens.append(letters[start:] + digits)
+    return tokens
+
+
+class FundingIndex:
+    """Records of one build, looked up by funding identifier search key"""
+
+    def __init__(self, build_version: str, key_version: str,
+                 records: Dict[str, Tuple[str, ...]],
+                 keys: Dict[str, List[str]],
+                 tokens: Dict[str, List[str]]):
+        self.build_version = build_version
+        self.key_version = key_version
+        # record ID -> funding identifiers
+        self.records = records
+        # search key -> record IDs
+        self.keys = keys
+        # identifier token -> record IDs, and the tokens in sorted order for
+        # prefix lookups
+        self.tokens = tokens
+        self._sorted_tokens = sorted(tokens)
+        self._looked_up = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_hits(cls, hits: Iterable[dict], build_version: str,
+                  parser: GrantIDParser) -> 'FundingIndex':
+        """Index the funding identifiers of a stream of hits"""
+        records = {}
+        keys = {}
+        tokens = {}
+        for hit in hits:
+            identifiers = tuple(get_funding_identifiers(hit))
+            if not identifiers:
+                continue
+            record_id = hit['_id']
+            records[record_id] = identifiers
+            for identifier in identifiers:
+                for key in identifier_keys(parser, identifier):
+                    record_ids = keys.setdefault(key, [])
+                    if not record_ids or record_ids[-1] != record_id:
+                        record_ids.append(record_id)
+                for token in identifier_tokens(identifier):
+                    record_ids = tokens.setdefault(token, [])
+                    if not record_ids or record_ids[-1] != record_id:
+                        record_ids.append(record_id)
+
+        return cls(build_version, parser_version(parser), records, keys,
+                   tokens)
+
+    @classmethod
+    def build(cls, api_url: str, build_version: str, parser: GrantIDParser,
+              session: requests.Session = None) -> 'FundingIndex':
+        """Export every record with a funding identifier and index it"""
+        logger.info(f"Building funding index for build {build_version}")
+        index = cls.from_hits(
+            iter_query_hits(api_url, EXPORT_QUERY, fields=EXPORT_FIELDS,
+                            session=session),
+            build_version, parser)
+        logger.info(f"Indexed {len(index.records)} records under "
+                    f"{len(index.keys)} funding keys and "
+                    f"{len(index.tokens)} identifier tokens")
+        return index
+
+    @classmethod
+    def load(cls, index_file: Path, build_version: str,
+             parser: GrantIDParser) -> Optional['FundingIndex']:
+        """Load a saved index, or None if it is missing or outdated"""
+        index_file = Path(index_file)
+        if not index_file.exists():
+            return None
+
+        try:
+            with open(index_file, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read funding index {index_file}: {e}")
+            return None
+
+        if (not isinstance(data, dict) or
+                data.get('format') != INDEX_FORMAT or
+                data.get('build_version') != build_version or
+                data.get('key_version') != parser_version(parser)):
+            logger.info(f"Ignoring outdated funding index {index_file.name}")
+            return None
+
+        logger.info(f"Loaded funding index of {len(data['records'])} "
+                    f"records for build {build_version}")
+        return cls(data['build_version'], data['key_version'],
+                   data['records'], data['keys'], data['tokens'])
+
+    def save(self, index_file: Path):
+        """Write the index atomically"""
+        data = {
+            'format': INDEX_FORMAT,
+            'build_version': self.build_version,
+            'key_version': self.key_version,
+            'records': self.records,
+            'keys': self.keys,
+            'tokens': self.tokens
+        }
+        atomic_write(index_file,
+                     pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def candidates(self, key: str) -> Iterable[str]:
+        """Return the IDs of the records whose identifiers may contain a key.
+
+        Keys of letters followed by digits are looked up in the token index;
+        any other key returns every record.
+        """
+        match = TOKEN_KEY.match(key)
+        if not match:
+            return self.records
+
+        prefix = match.group(1) + match.group(2)
+        candidates = {}
+        position = bisect.bisect_left(self._sorted_tokens, prefix)
+        while (position < len(self._sorted_tokens) and
+               self._sorted_tokens[position].startswith(prefix)):
+            token = self._sorted_tokens[position]
+            candidates.update(dict.fromkeys(self.tokens[token]))
+            position += 1
+        return candidates
+
+    def record_ids(self, key: str) -> List[str]:
+        """Return the IDs of the records whose identifiers contain a key.
+
+        Records indexed under the key come first, followed by the records
+        whose identifiers only contain it as a substring.
+        """
+        key = key.strip().upper()
+        with self._lock:
+            record_ids = self._looked_up.get(key)
+        if record_ids is None:
+            keyed = self.keys.get(key, [])
+            indexed = set(keyed)
+            record_ids = keyed + [
+                record_id for record_id in self.candidates(key)
+                if record_id not in indexed and
+                any(key in identifier.upper()
+                    for identifier in self.records[record_id])]
+            with self._lock:
+                self._looked_up[key] = record_ids
+        return record_ids
+
+    def hits(self, key: str) -> List[dict]:
+        """Return the records of a key shaped like search hits"""
+        return [{'_id': record_id,
+                 'funding': [{'identifier': identifier} for identifier
+                             in self.records[record_id]]}
+                for record_id in self.record_ids(key)]
+
+    def search(self, grants: Iterable[str]) -> Dict[str, List[dict]]:
+        """Look up the hits of every grant"""
+        return {grant: self.hits(grant) for grant in grants}
+
+
+def load_or_build(index_file: Path, api_url: str, build_version: str,
+                  parser: GrantIDParser,
+                  session: requests.Session = None) -> FundingIndex:
+    """Load the saved index of a build, building and saving it if needed"""
+    index = FundingIndex.load(index_file, build_version, parser)
+    if index is not None:
+        return index
+
+    index = FundingIndex.build(api_url, build_version, parser, session)
+    try:
+        index.save(index_file)
+    except OSError as e:
+        logger.warning(f"Could not save funding index: {e}")
+    return index
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Generation Manifest
+
+Records, per environment, a content hash of each program's sheet row and the
+API build its correction files were generated against. A program whose row
+hash and build version both match the manifest, and whose output files still
+exist, can be skipped entirely on the next run.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+from output_writer import OutputWriter, write_if_changed
+
+logger = logging.getLogger(__name__)
+
+
+def hash_values(values: Dict[str, object]) -> str:
+    """Hash a mapping of values independently of key order"""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GenerationManifest:
+    """Row hashes and build versions of the generated programs"""
+
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = Path(manifest_file)
+        self.programs = {}
+        self._dirty = False
+
+    @classmethod
+    def load(cls, manifest_file: Path) -> 'GenerationManifest':
+        """Load a manifest, starting empty if it is missing or unreadable"""
+        manifest = cls(manifest_file)
+
+        if manifest.manifest_file.exists():
+            try:
+                with open(manifest.manifest_file, 'r') as f:
+                    manifest.programs = json.load(f).get('programs', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read manifest "
+                               f"{manifest.manifest_file}: {e}")
+
+        return manifest
+
+    def is_current(self, filename: str, row_hash: str,
+                   build_version: Optional[str]) -> bool:
+        """Check whether a program was generated from this row and build"""
+        if not build_version:
+            return False
+        entry = self.programs.get(filename)
+        return bool(entry and entry.get('row_hash') == row_hash and
+                    entry.get('build_version') == build_version)
+
+    def record(self, filename: str, row_hash: str,
+               build_version: Optional[str]):
+        """Record the row hash and build a program was generated from"""
+        entry = {'row_hash': row_hash, 'build_version': build_version}
+        if self.programs.get(filename) != entry:
+            self.programs[filename] = entry
+            self._dirty = True
+
+    def forget(self, filename: str):
+        """Drop a program that is no longer generated"""
+        if self.programs.pop(filename, None) is not None:
+            self._dirty = True
+
+    def save(self, writer: OutputWriter = None):
+        """Write the manifest if it has changed"""
+        if not self._dirty:
+            return
+
+        content = json.dumps({'programs': self.programs}, indent=2,
+                             sort_keys=True)
+        if writer:
+            writer.write(self.manifest_file, content, state=True)
+        else:
+            write_if_changed(self.manifest_file, content)
+        self._dirty = False
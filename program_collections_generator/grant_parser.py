@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Grant ID Parser
+
+Splits NIH grant IDs such as `1-R01-AI073685-01` into application type,
+activity code, IC code, serial number and support year. The activity and IC
+code lists are compiled once into a single regular expression whose
+alternations are sorted longest-first, so every grant is parsed with one
+match and the longest known code always wins regardless of list order.
+"""
+
+import re
+from typing import Dict, Iterable, List
+
+NOT_FOUND = 'not found'
+
+PARSED_FIELDS = ['grantID', 'applTypeCode', 'activityCode', 'icCode',
+                 'serialNum', 'supportYear']
+
+
+def _alternation(codes: Iterable[str]) -> str:
+    """Build a longest-first regex alternation from a list of codes"""
+    unique = sorted({code.strip() for code in codes if code and code.strip()},
+                    key=lambda code: (-len(code), code))
+    if not unique:
+        # Matches nothing, keeping the group in the pattern
+        return '(?!)'
+    return '|'.join(re.escape(code) for code in unique)
+
+
+class GrantIDParser:
+    """Precompiled parser for NIH grant IDs"""
+
+    def __init__(self, act_codes: Iterable[str], ic_codes: Iterable[str]):
+        self.act_codes = list(act_codes)
+        self.ic_codes = list(ic_codes)
+        self.pattern = re.compile(
+            r'(?:(?P<applTypeCode>\d)(?!\d)[-_ ]?)?'
+            rf'(?:(?P<activityCode>{_alternation(self.act_codes)})-?)?'
+            rf'(?:(?P<icCode>{_alternation(self.ic_codes)})-?)?'
+            r'(?P<remaining>.*)',
+            re.DOTALL
+        )
+
+    @staticmethod
+    def _serial_number(remaining: str) -> str:
+        """Collect up to six digits before the next dash"""
+        digits = ''.join(char for char in remaining.split('-', 1)[0]
+                         if char.isdigit())
+        return digits[:6]
+
+    def parse(self, grant_id: str) -> Dict[str, str]:
+        """Parse a single grant ID into its components"""
+        grant_id = str(grant_id).strip()
+        result = {field: NOT_FOUND for field in PARSED_FIELDS}
+        result['grantID'] = grant_id
+
+        if '-' in grant_id[-5:]:
+            result['supportYear'] = grant_id[-2:]
+
+        match = self.pattern.match(grant_id)
+        for field in ('applTypeCode', 'activityCode', 'icCode'):
+            if match.group(field):
+                result[field] = match.group(field)
+
+        serial = self._serial_number(match.group('remaining'))
+        if serial:
+            result['serialNum'] = serial
+
+        return result
+
+    def parse_grant_ids(self, grant_ids):
+        """Parse many grant IDs at once.
+
+        A pandas Series is parsed with vectorized string operations and
+        returns a DataFrame with one column per component. Any other
+        iterable returns a list of dicts.
+        """
+        if hasattr(grant_ids, 'str'):
+            return self._parse_series(grant_ids)
+        return [self.parse(grant_id) for grant_id in grant_ids]
+
+    def _parse_series(self, grant_ids):
+        """Vectorized parse of a pandas Series of grant IDs"""
+        grant_ids = grant_ids.astype(str).str.strip()
+        parts = grant_ids.str.extract(self.pattern)
+
+        serials = (parts['remaining'].fillna('')
+                   .str.split('-', n=1).str[0]
+                   .str.replace(r'\D', '', regex=True)
+                   .str[:6])
+        support_years = grant_ids.str[-2:].where(
+            grant_ids.str[-5:].str.contains('-', regex=False))
+
+        parsed = parts.drop(columns='remaining')
+        parsed.insert(0, 'grantID', grant_ids)
+        parsed['serialNum'] = serials.where(serials != '')
+        parsed['supportYear'] = support_years
+        return parsed[PARSED_FIELDS].fillna(NOT_FOUND)
+
+    def search_key(self, grant_id: str) -> str:
+        """Return the IC code + serial number search key for a grant.
+
+        Grants that cannot be parsed are searched as written.
+        """
+        parsed = self.parse(grant_id)
+        if parsed['icCode'] != NOT_FOUND and parsed['serialNum'] != NOT_FOUND:
+            return parsed['icCode'] + parsed['serialNum']
+        return parsed['grantID']
+
+    def search_keys(self, grant_ids: Iterable[str]) -> List[str]:
+        """Return the search key of every grant ID"""
+        return [self.search_key(grant_id) for grant_id in grant_ids]
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Grant Search Helpers
+
+Concurrent funding.identifier searches against the NDE query API. Grants are
+searched on a single aiohttp session with a bounded number of requests in
+flight, so a program's full grant list costs roughly one round-trip per
+`concurrency` grants instead of one per grant.
+
+When a query-length budget is given, grants are packed into batched
+`funding.identifier:(*A* OR *B* ...)` queries and each hit is mapped back to
+the grants it matched by checking its funding identifiers locally.
+
+Every query first asks for one ordinary page of PAGE_SIZE hits. Only when
+the reported total is larger is the query repeated with the API's
+`fetch_all=true` + `_scroll_id` protocol, so results are never truncated,
+while the common small result never opens a scroll context on the server.
+"""
+
+import asyncio
+import logging
+import time
+import urllib.parse
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set
+
+import aiohttp
+import requests
+
+from http_session import (HTTPStatusError, get_json_with_retry,
+                          get_shared_session)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PER_HOST_LIMIT = 8
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_QUERY_LENGTH = 1500
+SEARCH_FIELDS = '_id,funding.identifier'
+
+# Hits of the first, ordinary page of a query; larger results are scrolled
+PAGE_SIZE = 500
+
+# Characters with a meaning in the query_string syntax
+QUERY_SPECIAL_CHARS = set('+-=&|><!(){}[]^"~*?:\\/ ')
+
+
+def escape_query_term(term: str) -> str:
+    """Escape query_string special characters in a search term"""
+    return ''.join(f'\\{char}' if char in QUERY_SPECIAL_CHARS else char
+                   for char in term)
+
+
+def build_wildcard_query(grants: List[str]) -> str:
+    """Build a funding.identifier wildcard query for one or more grants"""
+    terms = [f'*{escape_query_term(grant)}*' for grant in grants]
+    if len(terms) == 1:
+        return f'funding.identifier:{terms[0]}'
+    return f"funding.identifier:({' OR '.join(terms)})"
+
+
+def build_exact_query(grant: str) -> str:
+    """Build an exact funding.identifier query for a grant"""
+    return f'funding.identifier:{escape_query_term(grant)}'
+
+
+def batch_grants(grants: Iterable[str],
+                 max_query_length: int) -> List[List[str]]:
+    """Pack grants into batches whose encoded query fits the length budget.
+
+    A grant that does not fit the budget on its own gets a batch to itself.
+    """
+    batches = []
+    current = []
+
+    for grant in grants:
+        candidate = current + [grant]
+        query = urllib.parse.quote(build_wildcard_query(candidate))
+        if current and len(query) > max_query_length:
+            batches.append(current)
+            current = [grant]
+        else:
+            current = candidate
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def get_funding_identifiers(hit: dict) -> List[str]:
+    """Return the funding identifiers of a search hit"""
+    funding_data = hit.get('funding', [])
+    if isinstance(funding_data, dict):
+        funding_data = [funding_data]
+
+    identifiers = []
+    for funding in funding_data:
+        if not isinstance(funding, dict):
+            continue
+        identifier = funding.get('identifier', '')
+        if isinstance(identifier, list):
+            identifiers.extend(str(x) for x in identifier)
+        elif identifier:
+            identifiers.append(str(identifier))
+
+    return identifiers
+
+
+def matching_grants(hit: dict, grants: List[str]) -> List[str]:
+    """Return the grants contained in any funding identifier of a hit"""
+    identifiers = [x.lower() for x in get_funding_identifiers(hit)]
+    return [grant for grant in grants
+            if any(grant.lower() in identifier for identifier in identifiers)]
+
+
+def match_hits_to_grants(hits: Iterable[dict],
+                         grants: List[str]) -> Dict[str, List[dict]]:
+    """Map each hit to the grants found in its funding identifiers"""
+    matches = {grant: [] for grant in grants}
+
+    for hit in hits:
+        matched = matching_grants(hit, grants)
+        for grant in matched:
+            matches[grant].append(hit)
+        if not matched:
+            logger.debug(f"Hit {hit.get('_id')} matched none of {grants}")
+
+    return matches
+
+
+def _total_hits(data: dict) -> Optional[int]:
+    """Return the total hit count of a query response, if reported"""
+    total = data.get('total')
+    if isinstance(total, dict):
+        total = total.get('value')
+    return total if isinstance(total, int) else None
+
+
+def _first_page_params(query: str, fields: str) -> Dict[str, str]:
+    """Return the parameters of a query's first, ordinary page"""
+    return {'q': query, 'fields': fields, 'size': str(PAGE_SIZE)}
+
+
+def _scroll_params(data: dict, hits: List[dict], query: str,
+                   fields: str) -> Optional[Dict[str, str]]:
+    """Return fetch_all parameters if a first page holds only part of the hits"""
+    total = _total_hits(data)
+    if total is None:
+        more = len(hits) >= PAGE_SIZE
+    else:
+        more = total > len(hits)
+    if not more:
+        return None
+    return {'q': query, 'fields': fields, 'fetch_all': 'true'}
+
+
+def _next_page_params(data: dict, seen: int) -> Optional[Dict[str, str]]:
+    """Return the parameters for the next scroll page, or None when done"""
+    total = _total_hits(data)
+    scroll_id = data.get('_scroll_id')
+    if not data.get('hits') or not scroll_id:
+        return None
+    if total is not None and seen >= total:
+        return None
+    return {'scroll_id': scroll_id}
+
+
+def _is_scroll_exhausted(data) -> bool:
+    """Check for the API's response to scrolling past the last page"""
+    return (isinstance(data, dict) and
+            'No results to return' in str(data.get('error', '')))
+
+
+def iter_query_hits(api_url: str, query: str, fields: str = SEARCH_FIELDS,
+                    timeout: int = DEFAULT_TIMEOUT,
+                    session: requests.Session = None) -> Iterator[dict]:
+    """Yield every hit of a query, scrolling when it exceeds one page"""
+    http = session or get_shared_session()
+    params = _first_page_params(query, fields)
+    # IDs yielded from the first page, None until the query is scrolled
+    first_page = None
+    seen = 0
+
+    while params:
+        response = http.get(api_url, params=params, timeout=timeout)
+        if 'scroll_id' in params and not response.ok:
+            try:
+                if _is_scroll_exhausted(response.json()):
+                    return
+            except ValueError:
+                pass
+        response.raise_for_status()
+        data = response.json()
+        if _is_scroll_exhausted(data):
+            return
+
+        hits = data.get('hits', [])
+        if first_page is None:
+            yield from hits
+            params = _scroll_params(data, hits, query, fields)
+            first_page = {hit.get('_id') for hit in hits}
+            continue
+
+        seen += len(hits)
+        yield from (hit for hit in hits if hit.get('_id') not in first_page)
+
+        params = _next_page_params(data, seen)
+
+
+async def aiter_query_hits(session: aiohttp.ClientSession,
+                           semaphore: asyncio.Semaphore, api_url: str,
+                           query: str, fields: str = SEARCH_FIELDS
+                           ) -> AsyncIterator[dict]:
+    """Asynchronously yield every hit of a query, scrolling when needed"""
+    params = _first_page_params(query, fields)
+    first_page = None
+    seen = 0
+
+    while params:
+        async with semaphore:
+            status, data = await get_json_with_retry(session, api_url, params)
+
+        if _is_scroll_exhausted(data):
+            return
+        if status >= 400 or not isinstance(data, dict):
+            raise HTTPStatusError(status, api_url)
+
+        hits = data.get('hits', [])
+        if first_page is None:
+            for hit in hits:
+                yield hit
+            params = _scroll_params(data, hits, query, fields)
+            first_page = {hit.get('_id') for hit in hits}
+            continue
+
+        seen += len(hits)
+        for hit in hits:
+            if hit.get('_id') not in first_page:
+                yield hit
+
+        params = _next_page_params(data, seen)
+
+
+async def _search_grant(session: aiohttp.ClientSession,
+                        semaphore: asyncio.Semaphore, api_url: str,
+                        grant: str, exact: bool = False,
+                        incomplete: Optional[Set[str]] = None
+                        ) -> Dict[str, List[dict]]:
+    """Run the wildcard search, and optionally the exact one, for a grant.
+
+    When one of the queries fails the hits of the others are still returned
+    and the grant is added to incomplete; when all fail it is left out.
+    """
+    queries = [build_wildcard_query([grant])]
+    if exact:
+        queries.append(build_exact_query(grant))
+
+    hits = {}
+    failed = 0
+    for query in queries:
+        try:
+            async for hit in aiter_query_hits(session, semaphore, api_url,
+                                              query):
+                hits.setdefault(hit['_id'], hit)
+        except Exception as e:
+            logger.warning(f"Search failed for {grant} with {query}: {e}")
+            failed += 1
+
+    if failed:
+        if incomplete is not None:
+            incomplete.add(grant)
+        if failed == len(queries):
+            return {}
+
+    return {grant: list(hits.values())}
+
+
+async def _search_batch(session: aiohttp.ClientSession,
+                        semaphore: asyncio.Semaphore, api_url: str,
+                        batch: List[str],
+                        incomplete: Optional[Set[str]] = None
+                        ) -> Dict[str, List[dict]]:
+    """Run one batched query and map its hits back to the grants"""
+    try:
+        hits = [hit async for hit in aiter_query_hits(
+            session, semaphore, api_url, build_wildcard_query(batch))]
+    except Exception as e:
+        for grant in batch:
+            logger.warning(f"Search failed for {grant}: {e}")
+        if incomplete is not None:
+            incomplete.update(batch)
+        return {}
+
+    return match_hits_to_grants(hits, batch)
+
+
+async def _timed(task, key: str, timings: Optional[Dict[str, float]]):
+    """Await a search task, recording its latency under key"""
+    if timings is None:
+        return await task
+    start = time.perf_counter()
+    try:
+        return await task
+    finally:
+        timings[key] = time.perf_counter() - start
+
+
+async def search_grants_async(api_url: str, grants: Iterable[str],
+                              concurrency: int = DEFAULT_CONCURRENCY,
+                              per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                              timeout: int = DEFAULT_TIMEOUT,
+                              max_query_length: Optional[int] = None,
+                              exact: bool = False,
+                              trace_configs: Optional[list] = None,
+                              timings: Optional[Dict[str, float]] = None,
+                              incomplete: Optional[Set[str]] = None
+                              ) -> Dict[str, List[dict]]:
+    """Search all grants concurrently and return the hits for each grant.
+
+    Without a max_query_length every grant is sent as its own query and keeps
+    all of its hits. With one, grants are batched and only hits whose funding
+    identifiers contain the grant are kept. With exact=True an unbatched
+    grant is also searched with the exact `funding.identifier:GRANT` query
+    and the hits of both queries are combined.
+
+    Grants whose search fails are logged and left out of the result. When an
+    incomplete set is given, every grant whose search failed, including a
+    grant that kept the hits of its other query, is added to it.
+
+    trace_configs are passed to the aiohttp session, and when a timings dict
+    is given the latency of each query is stored in it, keyed by the grant
+    (or by the batch's grants joined with ' OR ').
+    """
+    grants = list(dict.fromkeys(grants))
+    results = {}
+    if not grants:
+        return results
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    connector = aiohttp.TCPConnector(limit=max(1, concurrency),
+                                     limit_per_host=max(1, per_host_limit))
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=client_timeout,
+                                     trace_configs=trace_configs) as session:
+        if max_query_length:
+            batches = batch_grants(grants, max_query_length)
+            logger.info(f"Searching {len(grants)} grants "
+                        f"in {len(batches)} batched queries")
+            tasks = [_timed(_search_batch(session, semaphore, api_url, batch,
+                                          incomplete),
+                            ' OR '.join(batch), timings)
+                     for batch in batches]
+        else:
+            tasks = [_timed(_search_grant(session, semaphore, api_url, grant,
+                                          exact=exact, incomplete=incomplete),
+                            grant, timings)
+                     for grant in grants]
+
+        for outcome in await asyncio.gather(*tasks):
+            results.update(outcome)
+
+    return results
+
+
+def search_grants(api_url: str, grants: Iterable[str],
+                  concurrency: int = DEFAULT_CONCURRENCY,
+                  per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                  timeout: int = DEFAULT_TIMEOUT,
+                  max_query_length: Optional[int] = None,
+                  exact: bool = False,
+                  trace_configs: Optional[list] = None,
+                  timings: Optional[Dict[str, float]] = None,
+                  incomplete: Optional[Set[str]] = None
+                  ) -> Dict[str, List[dict]]:
+    """Blocking wrapper around search_grants_async"""
+    return asyncio.run(search_grants_async(
+        api_url, grants, concurrency=concurrency,
+        per_host_limit=per_host_limit, timeout=timeout,
+        max_query_length=max_query_length, exact=exact,
+        trace_configs=trace_configs,
+        timings=timings, incomplete=incomplete
+    ))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+HTTP Session Helpers
+
+Shared HTTP layer for the program collections generators. Blocking calls go
+through one pooled `requests.Session` that keeps connections to the NDE API
+and raw.githubusercontent.com alive between requests. Both the blocking
+session and the aiohttp helpers retry 429 and 5xx responses with exponential
+backoff, honoring the server's `Retry-After` header.
+"""
+
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF_FACTOR = 1.0
+MAX_RETRY_AFTER = 120
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+class HTTPStatusError(Exception):
+    """Raised for an error status that survived all retries"""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status = status
+        self.url = url
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE,
+                   retries: int = DEFAULT_RETRIES,
+                   backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+                   ) -> requests.Session:
+    """Create a pooled session that retries throttled and failed requests"""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_shared_session(pool_size: int = DEFAULT_POOL_SIZE,
+                             retries: int = DEFAULT_RETRIES,
+                             backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+                             ) -> requests.Session:
+    """Replace the shared session with one using the given settings"""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is not None:
+            _shared_session.close()
+        _shared_session = create_session(pool_size, retries, backoff_factor)
+        return _shared_session
+
+
+def get_shared_session() -> requests.Session:
+    """Return the process-wide session, creating it on first use"""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def get_json_response(session: aiohttp.ClientSession, url: str,
+                            params: Dict[str, str] = None,
+                            headers: Dict[str, str] = None,
+                            retries: int = DEFAULT_RETRIES,
+                            backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+                            ) -> Tuple[int, Any, Dict[str, str]]:
+    """GET a JSON document, retrying 429/5xx responses and network errors.
+
+    Returns the final response status, decoded body (None if the body is
+    empty or not JSON) and response headers, so callers can inspect error
+    payloads and cache validators themselves.
+    """
+    for attempt in range(retries + 1):
+        wait_time = backoff_factor * (2 ** attempt)
+        try:
+            async with session.get(url, params=params,
+                                   headers=headers) as response:
+                if (response.status in RETRY_STATUS_CODES and
+                        attempt < retries):
+                    retry_after = parse_retry_after(
+                        response.headers.get('Retry-After'))
+                    if retry_after is not None:
+                        wait_time = min(retry_after, MAX_RETRY_AFTER)
+                    logger.info(f"HTTP {response.status} from {url}, "
+                                f"retrying in {wait_time:.2f} seconds...")
+                else:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = None
+                    return response.status, data, dict(response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt >= retries:
+                raise
+            logger.info(f"Request to {url} failed ({e}), "
+                        f"retrying in {wait_time:.2f} seconds...")
+
+        await asyncio.sleep(wait_time)
+
+
+async def get_json_with_retry(session: aiohttp.ClientSession, url: str,
+                              params: Dict[str, str] = None,
+                              retries: int = DEFAULT_RETRIES,
+                              backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+                              ) -> Tuple[int, Any]:
+    """GET a JSON document with retries; returns the status and body"""
+    status, data, _ = await get_json_response(
+        session, url, params, retries=retries, backoff_factor=backoff_factor)
+    return status, data
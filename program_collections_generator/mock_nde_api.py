@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Mock NDE API
+
+A local stand-in for the NDE `/v1/query` and `/v1/metadata` endpoints used to
+benchmark and regression-test the generators without network access. It
+serves synthetic records and supports the parts of the API the generators
+use:
+
+- `funding.identifier:*TERM*` wildcard queries, batched
+  `funding.identifier:(*A* OR *B*)` queries and exact identifier queries
+- the `_exists_:funding.identifier` export of every funded record
+- `fetch_all=true` paging with `scroll_id`, ending with the API's
+  "No results to return" response
+- `size`/`from` paging for ordinary queries
+
+The metadata endpoint sends an ETag and answers a matching If-None-Match
+with 304. Latency, scroll page size and the rate of injected 503 errors are
+configurable, and every request is counted. The program sheet can be served
+as an xlsx export from `/sheet.xlsx`.
+
+Usage:
+    python mock_nde_api.py --programs 900 --latency 0.02 --port 8000
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_SIZE = 10
+DEFAULT_BUILD_VERSION = 'mock-build-1'
+FIELD_PREFIX = 'funding.identifier:'
+EXISTS_QUERY = '_exists_:funding.identifier'
+
+# IC code + serial number, the part of an identifier grants are searched by
+GRANT_KEY_PATTERN = re.compile(r'[A-Z]{2}\d{6}')
+
+SAMPLE_ACTIVITY_CODES = ['R01', 'R21', 'R33', 'U01', 'U19', 'P01', 'T32',
+                         'K08', 'F31', 'UM1']
+SAMPLE_IC_CODES = ['AI', 'AR', 'AG', 'HL', 'DK', 'GM', 'TR', 'TW']
+
+
+def synthetic_programs(count: int, grants_per_program: int = 8,
+                       act_codes: List[str] = None,
+                       ic_codes: List[str] = None,
+                       seed: int = 0) -> List[Dict[str, str]]:
+    """Build program sheet rows with unique, parseable grant IDs"""
+    rng = random.Random(seed)
+    act_codes = act_codes or SAMPLE_ACTIVITY_CODES
+    ic_codes = ic_codes or SAMPLE_IC_CODES
+
+    programs = []
+    serial = 100000
+    for index in range(count):
+        grants = []
+        for _ in range(grants_per_program):
+            serial += 1
+            grants.append(f"{rng.randint(1, 5)}-{rng.choice(act_codes)}-"
+                          f"{rng.choice(ic_codes)}{serial:06d}-"
+                          f"{rng.randint(1, 20):02d}")
+
+        name = f'Mock Program {index}'
+        programs.append({
+            'fileName': f'mock_program_{index:05d}',
+            'name': name,
+            'abstract': f'Abstract of {name}.',
+            'description': f'Description of {name}.',
+            'alternateName': f'MP{index}',
+            'url': f'https://example.org/programs/{index}',
+            'parentOrganization': 'NIAID',
+            'niaidURL': f'https://www.niaid.nih.gov/programs/{index}',
+            'fundingIDList': ', '.join(grants),
+            'PriorProjectGrantIDs': 'not found'
+        })
+
+    return programs
+
+
+def synthetic_records(programs: List[Dict[str, str]],
+                      records_per_grant: int = 3,
+                      seed: int = 0) -> List[dict]:
+    """Build records whose funding identifiers reference the programs' grants.
+
+    A share of the records cite a second grant, and every fifth record comes
+    from ImmPort, so batching, de-duplication and ID cleanup are exercised.
+    """
+    rng = random.Random(seed)
+    grants = [grant.strip() for program in programs
+              for grant in program['fundingIDList'].split(',')]
+
+    records = []
+    for grant in grants:
+        # Records cite grants without the application type prefix
+        identifier = grant.split('-', 1)[-1].replace('-', '', 1)
+        for _ in range(records_per_grant):
+            number = len(records)
+            prefix = 'immport_' if number % 5 == 0 else 'mock_'
+            funding = [{'identifier': identifier}]
+            if rng.random() < 0.2:
+                other = rng.choice(grants)
+                funding.append(
+                    {'identifier': other.split('-', 1)[-1].replace('-', '', 1)})
+            records.append({'_id': f'{prefix}{number:08d}',
+                            'funding': funding})
+
+    return records
+
+
+def _unescape(term: str) -> str:
+    """Remove query_string escaping from a term"""
+    return re.sub(r'\\(.)', r'\1', term)
+
+
+def parse_funding_query(query: str) -> Optional[List[str]]:
+    """Split a funding.identifier query into its terms.
+
+    Returns None for queries the mock does not understand.
+    """
+    if not query.startswith(FIELD_PREFIX):
+        return None
+
+    body = query[len(FIELD_PREFIX):]
+    if body.startswith('(') and body.endswith(')'):
+        return [term for term in body[1:-1].split(' OR ') if term]
+    return [body]
+
+
+class RecordIndex:
+    """Looks up records by funding identifier"""
+
+    def __init__(self, records: List[dict]):
+        self.records = records
+        self.identifiers = []
+        self.exact = defaultdict(set)
+        self.by_grant_key = defaultdict(set)
+        self.funded = set()
+
+        for position, record in enumerate(records):
+            funding = record.get('funding', [])
+            if isinstance(funding, dict):
+                funding = [funding]
+            for entry in funding:
+                identifier = str(entry.get('identifier', '')).upper()
+                if identifier:
+                    self.funded.add(position)
+                self.identifiers.append((identifier, position))
+                self.exact[identifier].add(position)
+                for key in GRANT_KEY_PATTERN.findall(identifier):
+                    self.by_grant_key[key].add(position)
+
+    def match_term(self, term: str) -> set:
+        """Return the positions of the records matching one query term"""
+        wildcard = term.startswith('*') and term.endswith('*') and len(term) > 1
+        value = _unescape(term.strip('*') if wildcard else term).upper()
+        if not value:
+            return set()
+
+        if not wildcard:
+            return set(self.exact.get(value.strip('"'), ()))
+
+        if GRANT_KEY_PATTERN.fullmatch(value):
+            return set(self.by_grant_key.get(value, ()))
+
+        return {position for identifier, position in self.identifiers
+                if value in identifier}
+
+    def funded_records(self) -> List[dict]:
+        """Return the records with a funding identifier, in index order"""
+        return [self.records[position] for position in sorted(self.funded)]
+
+    def search(self, terms: List[str]) -> List[dict]:
+        """Return the records matching any of the terms, in index order"""
+        positions = set()
+        for term in terms:
+            positions |= self.match_term(term)
+        return [self.records[position] for position in sorted(positions)]
+
+
+def _project(record: dict, fields: Optional[str]) -> dict:
+    """Keep only the requested top-level fields of a record"""
+    if not fields:
+        return dict(record)
+    keep = {field.split('.', 1)[0] for field in fields.split(',')}
+    return {key: value for key, value in record.items()
+            if key == '_id' or key in keep}
+
+
+class MockNDEAPI:
+    """Threaded HTTP server imitating the NDE query and metadata API"""
+
+    def __init__(self, records: List[dict] = None,
+                 page_size: int = DEFAULT_PAGE_SIZE,
+                 latency: float = 0.0, error_rate: float = 0.0,
+                 retry_after: Optional[int] = None,
+                 build_version: str = DEFAULT_BUILD_VERSION,
+                 sheet: bytes = None, host: str = '127.0.0.1',
+                 port: int = 0, seed: int = 0):
+        self.index = RecordIndex(records or [])
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.build_version = build_version
+        self.build_date = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.sheet = sheet
+        self.host = host
+        self.port = port
+
+        self.request_counts = Counter()
+        self.bytes_sent = 0
+        self._scrolls = {}
+        self._totals = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def query_url(self) -> str:
+        return f'{self.url}/v1/query'
+
+    @property
+    def metadata_url(self) -> str:
+        return f'{self.url}/v1/metadata'
+
+    @property
+    def sheet_url(self) -> str:
+        return f'{self.url}/sheet.xlsx'
+
+    def start(self) -> 'MockNDEAPI':
+        """Start serving in a background thread"""
+        self._server = ThreadingHTTPServer((self.host, self.port),
+                                           self._handler_class())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Mock NDE API listening on {self.url}")
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'MockNDEAPI':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        """Clear the request counters"""
+        with self._lock:
+            self.request_counts.clear()
+            self.bytes_sent = 0
+
+    @property
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.request_counts.values())
+
+    @property
+    def open_scrolls(self) -> int:
+        """Scroll contexts that were opened and not read to the end"""
+        with self._lock:
+            return len(self._scrolls)
+
+    def _should_fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def metadata(self) -> dict:
+        """Build information served by /v1/metadata"""
+        return {'build_date': self.build_date,
+                'build_version': self.build_version,
+                'biothing_type': 'resource'}
+
+    def metadata_etag(self) -> str:
+        """Validator of the current build information"""
+        return f'"{self.build_version}"'
+
+    def query(self, params: Dict[str, str]) -> dict:
+        """Answer a /v1/query request"""
+        fields = params.get('fields')
+
+        scroll_id = params.get('scroll_id')
+        if scroll_id:
+            return self._next_scroll_page(scroll_id, fields)
+
+        query = params.get('q', '')
+        terms = parse_funding_query(query)
+        if query == EXISTS_QUERY:
+            hits = self.index.funded_records()
+        elif terms is None:
+            return {'success': False, 'status': 400,
+                    'error': f"Unsupported query: {query}"}
+        else:
+            hits = self.index.search(terms)
+        if params.get('fetch_all', '').lower() == 'true':
+            scroll_id = uuid.uuid4().hex
+            with self._lock:
+                self._scrolls[scroll_id] = hits
+                self._totals[scroll_id] = len(hits)
+            return self._next_scroll_page(scroll_id, fields)
+
+        start = int(params.get('from', 0))
+        size = int(params.get('size', DEFAULT_SIZE))
+        page = hits[start:start + size]
+        return {'total': len(hits), 'max_score': 1.0, 'took': 1,
+                'hits': [_project(hit, fields) for hit in page]}
+
+    def _next_scroll_page(self, scroll_id: str,
+                          fields: Optional[str]) -> dict:
+        """Pop the next page of a scroll context"""
+        with self._lock:
+            remaining = self._scrolls.get(scroll_id)
+            if not remaining:
+                self._scrolls.pop(scroll_id, None)
+                self._totals.pop(scroll_id, None)
+                return {'success': False, 'error': 'No results to return.'}
+            page = remaining[:self.page_size]
+            self._scrolls[scroll_id] = remaining[self.page_size:]
+            total = self._totals[scroll_id]
+
+        return {'total': total, 'max_score': 1.0, 'took': 1,
+                'hits': [_project(hit, fields) for hit in page],
+                '_scroll_id': scroll_id}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                params = {key: values[-1] for key, values
+                          in parse_qs(parts.query).items()}
+
+                if api.latency:
+                    time.sleep(api.latency)
+
+                if api._should_fail():
+                    self._send(503, {'success': False,
+                                     'error': 'Service Unavailable'},
+                               retry_after=api.retry_after)
+                elif parts.path == '/v1/query':
+                    self._send(200, api.query(params))
+                elif parts.path == '/v1/metadata':
+                    etag = api.metadata_etag()
+                    if self.headers.get('If-None-Match') == etag:
+                        self._send(304, b'', etag=etag)
+                    else:
+                        self._send(200, api.metadata(), etag=etag)
+                elif parts.path == '/sheet.xlsx' and api.sheet is not None:
+                    self._send(200, api.sheet, content_type=(
+                        'application/vnd.openxmlformats-officedocument.'
+                        'spreadsheetml.sheet'))
+                else:
+                    self._send(404, {'success': False, 'error': 'Not found'})
+
+            def _send(self, status: int, body, content_type: str =
+                      'application/json', retry_after: int = None,
+                      etag: str = None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+
+                with api._lock:
+                    api.request_counts[
+                        (urlsplit(self.path).path, status)] += 1
+                    api.bytes_sent += len(body)
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    """Serve synthetic programs and records until interrupted"""
+    parser = argparse.ArgumentParser(description='Run a mock NDE API')
+    parser.add_argument('--programs', type=int, default=90,
+                        help='Number of synthetic programs (default: 90)')
+    parser.add_argument('--grants-per-program', type=int, default=8,
+                        help='Grants per program (default: 8)')
+    parser.add_argument('--records-per-grant', type=int, default=3,
+                        help='Records citing each grant (default: 3)')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f'Scroll page size (default: {DEFAULT_PAGE_SIZE})')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests answered with 503 (default: 0)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port to listen on (default: 8000)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    programs = synthetic_programs(args.programs, args.grants_per_program)
+    records = synthetic_records(programs, args.records_per_grant)
+    api = MockNDEAPI(records, page_size=args.page_size, latency=args.latency,
+                     error_rate=args.error_rate, port=args.port).start()
+    logger.info(f"Serving {len(records)} records for {len(programs)} programs")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Output Writer
+
+Writes generated files only when their content changes. Content is rendered
+in memory and compared by hash with the file already on disk; changed files
+are written to a temporary file in the same directory and moved into place
+with `os.replace`, so a run that dies mid-write never leaves a truncated
+file behind. The writer keeps a per-run summary of changed, unchanged,
+removed and stale files that the workflows read instead of running
+`git diff`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+
+def content_digest(data: bytes) -> str:
+    """Hash file content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: PathLike) -> Optional[str]:
+    """Hash an existing file, or return None if it does not exist"""
+    try:
+        with open(path, 'rb') as f:
+            return content_digest(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def atomic_write(path: PathLike, content: Union[str, bytes]):
+    """Write a file through a temporary file and os.replace"""
+    path = Path(path)
+    data = content.encode('utf-8') if isinstance(content, str) else content
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent,
+                                     prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_if_changed(path: PathLike, content: Union[str, bytes]) -> bool:
+    """Atomically write a file unless it already has this content"""
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    if file_digest(path) == content_digest(data):
+        return False
+    atomic_write(path, data)
+    return True
+
+
+class OutputWriter:
+    """Writes files on change and summarizes what a run touched.
+
+    Collection outputs (correction and records files) and state files
+    (build info, caches, manifests) are tracked separately so the summary
+    can tell whether any collection actually changed.
+    """
+
+    def __init__(self, root: PathLike = None):
+        self.root = Path(root) if root else None
+        self.changed = []
+        self.unchanged = []
+        self.removed = []
+        self.stale = []
+        self.state_changed = []
+        self.record_diffs = {}
+        self._lock = threading.Lock()
+
+    def _display_path(self, path: PathLike) -> str:
+        """Path relative to the writer root, for the summary"""
+        path = Path(path)
+        if self.root:
+            try:
+                return str(path.relative_to(self.root))
+            except ValueError:
+                pass
+        return str(path)
+
+    def write(self, path: PathLike, content: Union[str, bytes],
+              state: bool = False) -> bool:
+        """Write a file if its content changed; returns True if written"""
+        written = write_if_changed(path, content)
+        self._track(path, written, state)
+        return written
+
+    def replace(self, path: PathLike, content: Union[str, bytes],
+                state: bool = False):
+        """Write a file the caller already found to differ from its content"""
+        atomic_write(path, content)
+        self._track(path, True, state)
+
+    def _track(self, path: PathLike, written: bool, state: bool):
+        """Record a written or unchanged file in the summary"""
+        name = self._display_path(path)
+        with self._lock:
+            if state:
+                if written:
+                    self.state_changed.append(name)
+            elif written:
+                self.changed.append(name)
+            else:
+                self.unchanged.append(name)
+
+    def write_json(self, path: PathLike, data, indent: int = 4,
+                   state: bool = False, **kwargs) -> bool:
+        """Render JSON the way json.dump would and write it on change"""
+        return self.write(path, json.dumps(data, indent=indent, **kwargs),
+                          state=state)
+
+    def mark_unchanged(self, path: PathLike):
+        """Record an output that was skipped without being rendered"""
+        with self._lock:
+            self.unchanged.append(self._display_path(path))
+
+    def record_diff(self, path: PathLike, added: List[str],
+                    removed: List[str]):
+        """Record the IDs a rewritten records file added and removed"""
+        with self._lock:
+            self.record_diffs[self._display_path(path)] = {
+                'added': list(added),
+                'removed': list(removed)
+            }
+
+    def mark_stale(self, path: PathLike):
+        """Record an output the run no longer generates but left in place"""
+        with self._lock:
+            self.stale.append(self._display_path(path))
+
+    def remove(self, path: PathLike) -> bool:
+        """Remove an output file; returns True if it existed"""
+        try:
+            Path(path).unlink()
+        except FileNotFoundError:
+            return False
+
+        with self._lock:
+            self.removed.append(self._display_path(path))
+        return True
+
+    @property
+    def has_changes(self) -> bool:
+        """True if any file was written or removed"""
+        return bool(self.changed or self.removed or self.state_changed)
+
+    def summary(self) -> Dict[str, object]:
+        """Summarize the files touched during the run"""
+        with self._lock:
+            return {
+                'has_changes': self.has_changes,
+                'collections_changed': bool(self.changed or self.removed),
+                'changed': sorted(self.changed),
+                'removed': sorted(self.removed),
+                'stale': sorted(self.stale),
+                'unchanged_count': len(self.unchanged),
+                'state_changed': sorted(self.state_changed),
+                'record_diffs': dict(sorted(self.record_diffs.items()))
+            }
+
+    def log_summary(self):
+        """Log the run summary"""
+        logger.info(f"Output files: {len(self.changed)} changed, "
+                    f"{len(self.unchanged)} unchanged, "
+                    f"{len(self.removed)} removed, {len(self.stale)} stale")
+        if self.record_diffs:
+            added = sum(len(x['added']) for x in self.record_diffs.values())
+            removed = sum(len(x['removed'])
+                          for x in self.record_diffs.values())
+            logger.info(f"Records: {added} added, {removed} removed across "
+                        f"{len(self.record_diffs)} programs")
+
+    def write_summary(self, path: PathLike):
+        """Write the run summary as JSON"""
+        atomic_write(path, json.dumps(self.summary(), indent=2))
@@ -7,18 +7,34 @@ It can be run manually or integrated into CI/CD pipelines.
 """
 
 import argparse
+import io
 import json
 import logging
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import pandas as pd
 import requests
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 
+from build_probe import BuildProbe, parse_build_info
+from collection_engine import CollectionEngine, WildcardSearch, parse_array_text
+from generation_manifest import GenerationManifest, hash_values
+from grant_parser import GrantIDParser
+from grant_search import DEFAULT_CONCURRENCY, DEFAULT_MAX_QUERY_LENGTH
+from http_session import (DEFAULT_POOL_SIZE, configure_shared_session,
+                          get_shared_session)
+from output_writer import content_digest
+from program_rows import (ProgramRow, as_program_rows, rows_from_values,
+                          rows_from_xlsx, rows_to_dataframe, valid_rows)
+from sheet_snapshot import SheetSnapshot
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,15 +42,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Last parsed copy of the program sheet, kept in the data directory
+SHEET_SNAPSHOT_FILE = 'program_sheet_snapshot.pkl'
+
+# Sheets access for the program data, Drive metadata for its modifiedTime
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets.readonly',
+    'https://www.googleapis.com/auth/drive.metadata.readonly'
+]
+
+# Sheet columns that determine a program's generated files
+ROW_HASH_COLUMNS = [
+    'fileName', 'name', 'abstract', 'description', 'alternateName', 'url',
+    'parentOrganization', 'niaidURL', 'fundingIDList', 'PriorProjectGrantIDs'
+]
+
+
+class _TaskLogBuffer(logging.Filter):
+    """Holds back log records from worker threads.
+
+    Installed on the root handlers while programs are generated in parallel,
+    so each program's log lines can be replayed together, in program order.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffers = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        buffer = self._buffers.get(threading.get_ident())
+        if buffer is None:
+            return True
+        # Each root handler sees the same record; buffer it once
+        if not buffer or buffer[-1] is not record:
+            buffer.append(record)
+        return False
+
+    def start(self):
+        """Start buffering records of the current thread"""
+        self._buffers[threading.get_ident()] = []
+
+    def stop(self) -> List[logging.LogRecord]:
+        """Stop buffering and return the current thread's records"""
+        return self._buffers.pop(threading.get_ident(), [])
+
+    def install(self):
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(self)
+
+    def uninstall(self):
+        for handler in logging.getLogger().handlers:
+            handler.removeFilter(self)
+
+    @staticmethod
+    def replay(records: List[logging.LogRecord]):
+        """Emit buffered records through the root handlers"""
+        for record in records:
+            for handler in logging.getLogger().handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
 
 class ProgramCollectionsGenerator:
     """Generates program collection correction files"""
 
-    def __init__(self, base_path: str = None):
+    def __init__(self, base_path: str = None,
+                 search_concurrency: int = DEFAULT_CONCURRENCY,
+                 batch_query_length: int = 0,
+                 use_search_cache: bool = True,
+                 session: requests.Session = None,
+                 incremental: bool = True,
+                 workers: int = 1,
+                 use_sheet_cache: bool = True,
+                 use_funding_index: bool = False,
+                 remove_stale: bool = False):
         self.base_path = Path(base_path) if base_path else Path.cwd()
         self.data_path = self.base_path / 'data'
 
+        # Pooled session with retries shared by all blocking HTTP calls
+        self.session = session or get_shared_session()
+
+        # Wildcard grant searches, caches and file output shared with the
+        # automator; batch_query_length 0 searches one grant per query, and
+        # with a funding index grants are looked up in a local export of
+        # each build kept in the data directory
+        self.engine = CollectionEngine(
+            self._find_correction_path(),
+            WildcardSearch(batch_query_length),
+            session=self.session,
+            concurrency=search_concurrency,
+            use_search_cache=use_search_cache,
+            index_path=self.data_path if use_funding_index else None
+        )
+        self.build_info = {}
+
+        # Conditional metadata requests; kept across runs so a long-running
+        # monitor polls unchanged builds with 304s
+        self.build_probe = BuildProbe()
+
+        # Skip programs whose row and build are unchanged since the last run
+        self.incremental = incremental
+
+        # Number of (program, environment) work units run in parallel
+        self.workers = max(1, workers)
+
+        # Delete the files of programs no longer generated instead of only
+        # listing them as stale in the run summary
+        self.remove_stale = remove_stale
+
+        # Grant ID parser compiled from the NIH code lists
+        self._grant_parser_codes = (None, None)
+
+        # Parsed sheet reused while its version is unchanged
+        self.use_sheet_cache = use_sheet_cache
+        self.sheet_snapshot_file = self.data_path / SHEET_SNAPSHOT_FILE
+
         # URLs and configuration
+        self.sheet_id = "16ioasEqMoXuv2tgJs7xlMgD_sPLvrxs7Cp3rwz273YE"
         self.sheets_url = (
             "https://docs.google.com/spreadsheets/d/"
             "16ioasEqMoXuv2tgJs7xlMgD_sPLvrxs7Cp3rwz273YE/"
@@ -45,8 +169,45 @@ class ProgramCollectionsGenerator:
         self.staging_metadata_api = "https://api-staging.data.niaid.nih.gov/v1/metadata"
         self.prod_metadata_api = "https://api.data.niaid.nih.gov/v1/metadata"
 
-        # Find correction path
-        self.correction_path = self._find_correction_path()
+    @property
+    def correction_path(self) -> Path:
+        return self.engine.correction_path
+
+    @correction_path.setter
+    def correction_path(self, path: Path):
+        self.engine.correction_path = Path(path)
+
+    @property
+    def batch_query_length(self) -> int:
+        return self.engine.strategy.max_query_length
+
+    @batch_query_length.setter
+    def batch_query_length(self, length: int):
+        self.engine.strategy.max_query_length = length
+
+    @property
+    def output_writer(self):
+        return self.engine.output_writer
+
+    @property
+    def grant_parser(self) -> Optional[GrantIDParser]:
+        return self.engine.grant_parser
+
+    @grant_parser.setter
+    def grant_parser(self, parser: GrantIDParser):
+        self.engine.grant_parser = parser
+
+    @property
+    def prior_records(self):
+        return self.engine.prior_records
+
+    @property
+    def metrics(self):
+        return self.engine.metrics
+
+    @property
+    def search_caches(self):
+        return self.engine.search_caches
 
     def _find_correction_path(self) -> Path:
         """Find the nde-metadata-corrections directory"""
@@ -105,6 +266,9 @@ class ProgramCollectionsGenerator:
         except FileNotFoundError:
             logger.warning("NIH_IC_codes.tsv not found")
 
+        self.grant_parser = GrantIDParser(act_codes, ic_codes)
+        self._grant_parser_codes = (act_codes, ic_codes)
+
         return approved_prod, control_transferred, act_codes, ic_codes
 
     def _get_google_sheets_credentials(self):
@@ -116,7 +280,7 @@ class ProgramCollectionsGenerator:
                 credentials_info = json.loads(creds_json)
                 credentials = service_account.Credentials.from_service_account_info(
                     credentials_info,
-                    scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
+                    scopes=GOOGLE_SCOPES
                 )
                 return credentials
             except Exception as e:
@@ -129,7 +293,7 @@ class ProgramCollectionsGenerator:
             try:
                 credentials = service_account.Credentials.from_service_account_file(
                     str(creds_file),
-                    scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
+                    scopes=GOOGLE_SCOPES
                 )
                 return credentials
             except Exception as e:
@@ -138,9 +302,16 @@ class ProgramCollectionsGenerator:
         return None
 
     def download_program_data(self) -> pd.DataFrame:
-        """Download program metadata from Google Sheets using API authentication"""
-        # Extract spreadsheet ID from the URL
-        sheet_id = "16ioasEqMoXuv2tgJs7xlMgD_sPLvrxs7Cp3rwz273YE"
+        """Download program metadata as a DataFrame of the sheet columns"""
+        return rows_to_dataframe(self.load_program_rows())
+
+    def load_program_rows(self) -> List[ProgramRow]:
+        """Download program metadata from Google Sheets using API authentication.
+
+        The rows are reused from the sheet snapshot when the sheet has not
+        changed since it was taken.
+        """
+        snapshot = self._load_sheet_snapshot()
 
         try:
             logger.info("Downloading program metadata...")
@@ -148,13 +319,19 @@ class ProgramCollectionsGenerator:
             # Try authenticated Google Sheets API first
             credentials = self._get_google_sheets_credentials()
             if credentials:
+                version = self._get_sheet_version(credentials)
+                if snapshot and version and snapshot.version == version:
+                    logger.info(f"Program sheet unchanged since {version}, "
+                                f"using {len(snapshot.rows)} cached programs")
+                    return snapshot.rows
+
                 logger.info("Using Google Sheets API with service account")
                 service = build('sheets', 'v4', credentials=credentials)
 
                 # Get the data from the 'metadata' sheet
                 range_name = 'metadata'  # Adjust if your sheet has a different name
                 result = service.spreadsheets().values().get(
-                    spreadsheetId=sheet_id,
+                    spreadsheetId=self.sheet_id,
                     range=range_name
                 ).execute()
 
@@ -162,33 +339,27 @@ class ProgramCollectionsGenerator:
                 if not values:
                     raise Exception("No data found in Google Sheet")
 
-                # Convert to DataFrame
-                headers = values[0]
-                data = values[1:] if len(values) > 1 else []
-                df = pd.DataFrame(data, columns=headers)
-
+                rows = rows_from_values(values)
                 logger.info(
-                    f"Downloaded {len(df)} programs via Google Sheets API")
-                return df
+                    f"Downloaded {len(rows)} programs via Google Sheets API")
 
             else:
                 logger.warning(
                     "No Google Sheets credentials found, trying direct download")
                 # Fallback to direct download (will fail for private sheets)
-                response = requests.get(self.sheets_url, timeout=60)
+                response = self.session.get(self.sheets_url, timeout=60)
                 response.raise_for_status()
 
-                # Save and read Excel file
-                temp_file = self.data_path / 'temp_collections.xlsx'
-                with open(temp_file, 'wb') as f:
-                    f.write(response.content)
-
-                df = pd.read_excel(temp_file, sheet_name='metadata',
-                                   engine='openpyxl')
-                temp_file.unlink()
+                # The export has no modifiedTime, so its content is the version
+                version = f'sha256:{content_digest(response.content)}'
+                if snapshot and snapshot.version == version:
+                    logger.info(f"Program sheet export unchanged, "
+                                f"using {len(snapshot.rows)} cached programs")
+                    return snapshot.rows
 
-                logger.info(f"Downloaded {len(df)} programs")
-                return df
+                # Stream the Excel export from memory
+                rows = rows_from_xlsx(io.BytesIO(response.content))
+                logger.info(f"Downloaded {len(rows)} programs")
 
         except Exception as e:
             logger.error(f"Download failed: {e}")
@@ -196,188 +367,320 @@ class ProgramCollectionsGenerator:
             local_file = self.data_path / 'Program Collections.xlsx'
             if local_file.exists():
                 logger.warning("Using local file as fallback")
-                return pd.read_excel(local_file, sheet_name='metadata',
-                                     engine='openpyxl')
+                return rows_from_xlsx(local_file)
             raise
 
+        self._save_sheet_snapshot(version, rows)
+        return rows
+
+    def _get_sheet_version(self, credentials) -> Optional[str]:
+        """Get the sheet's Drive modifiedTime and revision"""
+        try:
+            drive = build('drive', 'v3', credentials=credentials)
+            metadata = drive.files().get(
+                fileId=self.sheet_id, fields='modifiedTime,version'
+            ).execute()
+            return f"{metadata.get('modifiedTime')}/{metadata.get('version')}"
+        except Exception as e:
+            logger.warning(f"Could not get program sheet version: {e}")
+            return None
+
+    def _load_sheet_snapshot(self) -> Optional[SheetSnapshot]:
+        """Load the sheet snapshot if snapshots are enabled"""
+        if not self.use_sheet_cache:
+            return None
+        return SheetSnapshot.load(self.sheet_snapshot_file)
+
+    def _save_sheet_snapshot(self, version: Optional[str],
+                             rows: List[ProgramRow]):
+        """Save freshly downloaded rows as the sheet snapshot"""
+        if not self.use_sheet_cache or not version:
+            return
+        try:
+            SheetSnapshot(version, rows).save(self.sheet_snapshot_file)
+        except OSError as e:
+            logger.warning(f"Could not save sheet snapshot: {e}")
+
     def parse_array_text(self, text: str) -> List[str]:
         """Parse comma/pipe separated text"""
-        if pd.isna(text) or text == 'not found':
-            return []
-
-        text = str(text).replace('*', '')
-        if ',' in text:
-            items = text.split(',')
-        elif '|' in text:
-            items = text.split('|')
-        else:
-            items = [text]
-
-        return [x.strip() for x in items if x.strip()]
+        return parse_array_text(text)
+
+    def _get_grant_parser(self, act_codes: List[str],
+                          ic_codes: List[str]) -> GrantIDParser:
+        """Return the compiled parser for these code lists"""
+        source = self._grant_parser_codes
+        if (self.grant_parser is None or source[0] is not act_codes or
+                source[1] is not ic_codes):
+            self.grant_parser = GrantIDParser(act_codes, ic_codes)
+            self._grant_parser_codes = (act_codes, ic_codes)
+        return self.grant_parser
 
     def parse_grant_id(self, grant_id: str, act_codes: List[str],
                        ic_codes: List[str]) -> Dict[str, str]:
         """Parse grant ID into components"""
-        result = {
-            'icCode': 'not found',
-            'serialNum': 'not found'
-        }
-
         try:
-            remaining = grant_id.strip()
-
-            # Skip application type if present
-            if remaining[0].isdigit() and not remaining[:2].isdigit():
-                remaining = remaining[2:] if remaining[1] in '-_ ' else remaining[1:]
-
-            # Parse activity code
-            for code in act_codes:
-                if remaining.startswith(code):
-                    remaining = remaining[len(code):]
-                    if remaining.startswith('-'):
-                        remaining = remaining[1:]
-                    break
-
-            # Parse IC code
-            for code in ic_codes:
-                if remaining.startswith(code):
-                    result['icCode'] = code
-                    remaining = remaining[len(code):]
-                    if remaining.startswith('-'):
-                        remaining = remaining[1:]
-                    break
-
-            # Extract serial number (first 6 digits)
-            serial = ''
-            for char in remaining:
-                if char.isdigit():
-                    serial += char
-                    if len(serial) >= 6:
-                        break
-                elif char == '-':
-                    break
-
-            if serial:
-                result['serialNum'] = serial
-
+            return self._get_grant_parser(act_codes, ic_codes).parse(grant_id)
         except Exception as e:
             logger.warning(f"Failed to parse {grant_id}: {e}")
+            return {'icCode': 'not found', 'serialNum': 'not found'}
 
-        return result
+    def parse_grant_ids(self, grant_ids, act_codes: List[str],
+                        ic_codes: List[str]):
+        """Parse many grant IDs; a pandas Series returns a DataFrame"""
+        return self._get_grant_parser(act_codes, ic_codes).parse_grant_ids(
+            grant_ids)
 
     def search_records(self, grant_list: List[str],
-                       environment: str = 'staging') -> List[str]:
-        """Search for records matching grant IDs"""
-        api_url = self.staging_api if environment == 'staging' else self.prod_api
-        record_ids = set()
-
-        for grant in grant_list:
-            try:
-                # Try wildcard search
-                url = (f"{api_url}?q=funding.identifier:*{grant}*"
-                       "&fields=_id,funding.identifier&size=500")
-
-                response = requests.get(url, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-
-                if 'hits' in data:
-                    for hit in data['hits']:
-                        record_ids.add(hit['_id'])
-
-            except Exception as e:
-                logger.warning(f"Search failed for {grant}: {e}")
-
-        return list(record_ids)
-
-    def generate_files(self, df: pd.DataFrame, environment: str = 'both'):
-        """Generate all correction files"""
-        approved_prod, control_transferred, act_codes, ic_codes = (
-            self.load_config_files()
-        )
+                       environment: str = 'staging',
+                       failed: Optional[Set[str]] = None) -> List[str]:
+        """Search for records matching grant IDs.
+
+        Grants whose search failed in whole or in part are added to failed.
+        """
+        return self.engine.search_records(
+            self._api_url(environment), grant_list, environment,
+            lambda: self._current_build_version(environment), failed)
+
+    def _api_url(self, environment: str) -> str:
+        """Get the query endpoint of an environment"""
+        return self.staging_api if environment == 'staging' else self.prod_api
+
+    def save_search_caches(self):
+        """Persist the search caches of all environments"""
+        self.engine.save_search_caches()
+
+    def generate_files(self, df: Union[pd.DataFrame, List[ProgramRow]],
+                       environment: str = 'both',
+                       full_regenerate: bool = False) -> Dict[str, int]:
+        """Generate all correction files from the sheet or its rows.
+
+        With full_regenerate every program is generated, even when the
+        manifest lists it as current.
+        """
+        with self.metrics.stage('load_config'):
+            approved_prod, control_transferred, act_codes, ic_codes = (
+                self.load_config_files()
+            )
 
         # Filter valid programs
-        valid_df = df[
-            (~df['fundingIDList'].isna()) &
-            (df['fundingIDList'] != 'not found') &
-            (~df['niaidURL'].isna()) &
-            (df['fileName'] != '--')
-        ].copy()
-
-        logger.info(f"Processing {len(valid_df)} valid programs")
-
-        for _, row in valid_df.iterrows():
-            try:
-                filename = row['fileName']
-
-                write_staging = environment in ['staging', 'both']
-                write_production = (
-                    filename in approved_prod and
-                    environment in ['production', 'both']
-                )
-
-                # Skip entirely if neither environment applies
-                if not write_staging and not write_production:
+        programs = valid_rows(as_program_rows(df))
+
+        logger.info(f"Processing {len(programs)} valid programs")
+
+        # One work unit per (program, environment) pair
+        tasks = []
+        for row in programs:
+            filename = row['fileName']
+            if environment in ['staging', 'both']:
+                tasks.append((row, 'staging'))
+            if (filename in approved_prod and
+                    environment in ['production', 'both']):
+                tasks.append((row, 'production'))
+
+        # Shared state is prepared up front so workers only read it
+        target_envs = sorted({env for _, env in tasks})
+        self.refresh_build_info([env for env in target_envs
+                                 if env not in self.build_info])
+        manifests = {}
+        processed = {}
+        for target_env in target_envs:
+            manifests[target_env] = self._load_manifest(target_env)
+            processed[target_env] = set()
+            build_version = (
+                lambda env=target_env: self._current_build_version(env))
+            if not self.engine.funding_index(self._api_url(target_env),
+                                             target_env, build_version):
+                self.engine.search_cache(target_env, build_version)
+
+        stats = {'generated': 0, 'skipped': 0, 'incomplete': 0, 'errors': 0}
+        self.metrics.increment('programs_valid', len(programs))
+
+        incremental = self.incremental and not full_regenerate
+        for (row, target_env), outcome in zip(
+                tasks, self._run_tasks(tasks, manifests, act_codes, ic_codes,
+                                       control_transferred, incremental)):
+            filename = row['fileName']
+            processed[target_env].add(filename)
+
+            status, row_hash, build_version = outcome
+            stats[status] += 1
+            if status == 'generated':
+                manifests[target_env].record(filename, row_hash,
+                                             build_version)
+            elif status == 'incomplete':
+                # Regenerate the program on the next run
+                manifests[target_env].forget(filename)
+
+        logger.info(f"Generated {stats['generated']} program files, "
+                    f"skipped {stats['skipped']} unchanged, "
+                    f"{stats['incomplete']} incomplete, "
+                    f"{stats['errors']} errors")
+
+        # Files of programs this generator made that were not generated
+        # this run (for example, no longer approved, or a row that is
+        # briefly invalid) are only listed, unless removal was requested
+        for target_env, manifest in manifests.items():
+            for filename in sorted(set(manifest.programs) -
+                                   processed[target_env]):
+                output_files = self._output_files(filename, target_env)
+                if self.remove_stale:
+                    for output_file in output_files:
+                        self.output_writer.remove(output_file)
+                    manifest.forget(filename)
+                    logger.info(f"Removed {target_env} files for {filename}")
                     continue
 
-                if write_staging:
-                    self._create_metadata_file(row, 'staging')
-                    self._create_records_file(row, 'staging', act_codes,
-                                              ic_codes, control_transferred)
-                    logger.info(
-                        f"Generated staging files for {filename}")
+                for output_file in output_files:
+                    if output_file.exists():
+                        self.output_writer.mark_stale(output_file)
+                logger.warning(f"{target_env} files for {filename} were not "
+                               f"generated this run; use --remove-stale to "
+                               f"remove them")
 
-                if write_production:
-                    self._create_metadata_file(row, 'production')
-                    self._create_records_file(row, 'production', act_codes,
-                                              ic_codes, control_transferred)
-                    logger.info(
-                        f"Generated production files for {filename}")
-
-            except Exception as e:
-                logger.error(f"Error processing {filename}: {e}")
+        for manifest in manifests.values():
+            try:
+                manifest.save(self.output_writer)
+            except OSError as e:
+                logger.warning(f"Could not save generation manifest: {e}")
+
+        for status, count in stats.items():
+            self.metrics.increment(f'programs_{status}', count)
+
+        return stats
+
+    def _run_tasks(self, tasks: List[Tuple[ProgramRow, str]],
+                   manifests: Dict[str, GenerationManifest],
+                   act_codes: List[str], ic_codes: List[str],
+                   control_transferred: List[str], incremental: bool = True):
+        """Run the program work units, yielding outcomes in task order"""
+        def run(task):
+            row, target_env = task
+            return self._generate_program(row, target_env,
+                                          manifests[target_env], act_codes,
+                                          ic_codes, control_transferred,
+                                          incremental)
+
+        if self.workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield run(task)
+            return
+
+        task_logs = _TaskLogBuffer()
+
+        def run_buffered(task):
+            task_logs.start()
+            try:
+                return run(task), task_logs.stop()
+            except BaseException:
+                task_logs.stop()
+                raise
 
-    def _create_metadata_file(self, row: pd.Series, environment: str):
-        """Create metadata correction file"""
+        task_logs.install()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(run_buffered, task)
+                           for task in tasks]
+                for future in futures:
+                    outcome, records = future.result()
+                    task_logs.replay(records)
+                    yield outcome
+        finally:
+            task_logs.uninstall()
+
+    def _generate_program(self, row: ProgramRow, environment: str,
+                          manifest: GenerationManifest,
+                          act_codes: List[str], ic_codes: List[str],
+                          control_transferred: List[str],
+                          incremental: bool = True
+                          ) -> Tuple[str, Optional[str], Optional[str]]:
+        """Generate one program's files for one environment.
+
+        Returns the outcome status with the row hash and build version the
+        files were generated from. A program is 'incomplete' when the search
+        of any of its grants failed, so it is not recorded as current.
+        """
         filename = row['fileName']
-        alt_names = self.parse_array_text(row.get('alternateName', ''))
-        parent_orgs = self.parse_array_text(row.get('parentOrganization', ''))
-
-        description = (f"{row['description']} For more information, "
-                       f"visit the NIAID program page: {row['niaidURL']}")
-
-        metadata = {
-            "@type": "ResearchProject",
-            "name": row["name"],
-            "abstract": row["abstract"],
-            "description": description,
-            "alternateName": alt_names,
-            "url": row["url"],
-            "parentOrganization": parent_orgs
-        }
-
-        output_data = {"sourceOrganization": [metadata]}
-
-        # Write file
-        if environment == 'production':
-            output_dir = (
-                self.correction_path / 'collections_corrections_production'
-            )
-        else:
-            output_dir = (
-                self.correction_path / 'collections_corrections_staging'
-            )
+        start = time.perf_counter()
+        status = 'errors'
 
-        output_dir.mkdir(exist_ok=True)
-        output_file = output_dir / f'{filename}_correction.json'
+        try:
+            row_hash = self._row_hash(
+                row, environment, filename in control_transferred)
+            build_version = self._current_build_version(environment)
+
+            if (incremental and
+                    manifest.is_current(filename, row_hash, build_version) and
+                    self._outputs_exist(filename, environment)):
+                for output_file in self._output_files(filename, environment):
+                    self.output_writer.mark_unchanged(output_file)
+                status = 'skipped'
+                return status, row_hash, build_version
+
+            self._create_metadata_file(row, environment)
+            failed = self._create_records_file(row, environment, act_codes,
+                                               ic_codes, control_transferred)
+            if failed:
+                logger.warning(f"Generated {environment} files for {filename} "
+                               f"without the records of grants whose search "
+                               f"failed: {sorted(failed)}")
+                status = 'incomplete'
+            else:
+                logger.info(f"Generated {environment} files for {filename}")
+                status = 'generated'
+            return status, row_hash, build_version
 
-        with open(output_file, 'w') as f:
-            json.dump(output_data, f, indent=4)
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {e}")
+            return status, None, None
+
+        finally:
+            self.metrics.record_program(environment, filename,
+                                        time.perf_counter() - start, status)
+
+    def _output_dir(self, environment: str) -> Path:
+        """Get the corrections directory for an environment"""
+        return self.engine.output_dir(environment)
+
+    def _output_files(self, filename: str, environment: str) -> List[Path]:
+        """Get the correction and records files of a program"""
+        return self.engine.output_files(filename, environment)
+
+    def _outputs_exist(self, filename: str, environment: str) -> bool:
+        """Check that both output files of a program exist"""
+        return all(output_file.exists()
+                   for output_file in self._output_files(filename, environment))
+
+    def _load_manifest(self, environment: str) -> GenerationManifest:
+        """Load the generation manifest of an environment"""
+        return GenerationManifest.load(
+            self.correction_path / f'generation_manifest_{environment}.json')
+
+    def _row_hash(self, row: ProgramRow, environment: str,
+                  control_transferred: bool) -> str:
+        """Hash the row values and settings that determine a program's files"""
+        values = {
+            column: ('' if pd.isna(row.get(column)) else str(row.get(column)))
+            for column in ROW_HASH_COLUMNS
+        }
+        values['_environment'] = environment
+        values['_control_transferred'] = control_transferred
+        values['_search_mode'] = self.engine.strategy.mode
+        return hash_values(values)
+
+    def _current_build_version(self, environment: str) -> str:
+        """Get the current API build version of an environment"""
+        build_info = (self.build_info.get(environment) or
+                      self.get_build_info(environment))
+        return build_info.get('build_version', '')
+
+    def _create_metadata_file(self, row: ProgramRow, environment: str):
+        """Create metadata correction file"""
+        self.engine.write_metadata_file(row, environment)
 
-    def _create_records_file(self, row: pd.Series, environment: str,
+    def _create_records_file(self, row: ProgramRow, environment: str,
                              act_codes: List[str], ic_codes: List[str],
-                             control_transferred: List[str]):
-        """Create records file"""
+                             control_transferred: List[str]) -> Set[str]:
+        """Create records file; returns the grants whose search failed"""
         filename = row['fileName']
 
         # Parse grants
@@ -386,113 +689,75 @@ class ProgramCollectionsGenerator:
             row.get('PriorProjectGrantIDs', ''))
 
         # Process grants to get searchable IDs
-        search_grants = []
-        for grant_text in grant_texts + prior_grants:
-            grant_text = grant_text.replace("*", "").strip()
-            parsed = self.parse_grant_id(grant_text, act_codes, ic_codes)
-
-            if (parsed['icCode'] != 'not found' and
-                    parsed['serialNum'] != 'not found'):
-                search_grants.append(parsed['icCode'] + parsed['serialNum'])
-            else:
-                search_grants.append(grant_text)
-
-        # Search for records
-        record_ids = self.search_records(search_grants, environment)
+        parser = self._get_grant_parser(act_codes, ic_codes)
+        search_terms = parser.search_keys(grant_texts + prior_grants)
 
-        # Handle control transferred programs
-        if filename in control_transferred:
-            prior_records = self._get_prior_records(filename, environment)
-            record_ids = list(set(record_ids + prior_records))
-
-        # Write records file
-        if environment == 'production':
-            output_dir = (
-                self.correction_path / 'collections_corrections_production'
-            )
-        else:
-            output_dir = (
-                self.correction_path / 'collections_corrections_staging'
-            )
-
-        output_dir.mkdir(exist_ok=True)
-        output_file = output_dir / f'{filename}_records.txt'
-
-        with open(output_file, 'w') as f:
-            for record_id in sorted(record_ids):
-                if "immport" in record_id:
-                    clean_id = record_id.replace("immport_", "")
-                    f.write(
-                        f'https://data.niaid.nih.gov/resources?id={clean_id}\n'
-                    )
-                else:
-                    f.write(
-                        'https://data.niaid.nih.gov/resources?id='
-                        f'{record_id}\n'
-                    )
+        # Search for records and write them, merged with the prior records
+        # of control transferred programs
+        failed = set()
+        record_ids = self.search_records(search_terms, environment, failed)
+        self.engine.write_records_file(filename, environment, record_ids,
+                                       filename in control_transferred)
+        return failed
 
     def _get_prior_records(self, filename: str, environment: str) -> List[str]:
         """Get prior records for programs with transferred control"""
-        try:
-            if environment == 'production':
-                base_url = (
-                    "https://raw.githubusercontent.com/"
-                    "NIAID-Data-Ecosystem/nde-metadata-corrections/"
-                    "refs/heads/main/collections_corrections_production/"
-                )
-            else:
-                base_url = ("https://raw.githubusercontent.com/"
-                            "NIAID-Data-Ecosystem/nde-metadata-corrections/"
-                            "refs/heads/main/collections_corrections_staging/")
-
-            url = f"{base_url}{filename}_records.txt"
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-
-            records = []
-            for line in response.text.split('\n'):
-                line = line.strip()
-                if line and 'resources?id=' in line:
-                    record_id = line.split('resources?id=')[-1]
-                    records.append(record_id)
-
-            return records
-
-        except Exception as e:
-            logger.warning(f"Could not get prior records for {filename}: {e}")
-            return []
+        return self.engine.prior_records.get(filename, environment)
 
     def get_build_info(self, environment: str = 'staging') -> Dict[str, str]:
         """Get build information from the API metadata endpoint"""
         try:
-            if environment == 'staging':
-                url = self.staging_metadata_api
-            else:
-                url = self.prod_metadata_api
-
-            response = requests.get(url, timeout=30)
+            url = self.metadata_url(environment)
+            response = self.session.get(url, timeout=30)
             response.raise_for_status()
 
-            data = response.json()
-            build_info = {
-                'build_date': data.get('build_date', ''),
-                'build_version': data.get('build_version', ''),
-                'biothing_type': data.get('biothing_type', '')
-            }
-
-            logger.info(f"Retrieved {environment} build info: "
-                        f"version={build_info['build_version']}, "
-                        f"date={build_info['build_date']}")
+            build_info = parse_build_info(response.json())
+            self._store_build_info(environment, build_info)
             return build_info
 
         except Exception as e:
             logger.error(f"Failed to get {environment} build info: {e}")
             return {}
 
-    def check_for_new_build(self, environment: str = 'staging') -> bool:
-        """Check if there's a new build since last run"""
+    def refresh_build_info(self, environments: List[str]
+                           ) -> Dict[str, Dict[str, str]]:
+        """Get the build information of several environments concurrently"""
+        if not environments:
+            return {}
+
+        builds = self.build_probe.probe(
+            {env: self.metadata_url(env) for env in environments},
+            trace_configs=[self.metrics.trace_config()])
+        for environment, build_info in builds.items():
+            if build_info:
+                self._store_build_info(environment, build_info)
+        return builds
+
+    def _store_build_info(self, environment: str, build_info: Dict[str, str]):
+        """Remember the current build of an environment for this run"""
+        self.build_info[environment] = build_info
+        logger.info(f"Retrieved {environment} build info: "
+                    f"version={build_info['build_version']}, "
+                    f"date={build_info['build_date']}")
+
+    def metadata_url(self, environment: str) -> str:
+        """Get the metadata endpoint of an environment"""
+        if environment == 'staging':
+            return self.staging_metadata_api
+        return self.prod_metadata_api
+
+    def check_for_new_build(self, environment: str = 'staging',
+                            refresh: bool = True) -> bool:
+        """Check if there's a new build since last run.
+
+        With refresh=False the build info already fetched for this run is
+        compared instead of requesting it again.
+        """
         try:
-            current_build = self.get_build_info(environment)
+            if refresh:
+                current_build = self.get_build_info(environment)
+            else:
+                current_build = self.build_info.get(environment, {})
             if not current_build:
                 return False
 
@@ -513,8 +778,8 @@ class ProgramCollectionsGenerator:
                                 f"{current_build.get('build_version')}")
 
                     # Update stored build info
-                    with open(build_file, 'w') as f:
-                        json.dump(current_build, f, indent=2)
+                    self.output_writer.write_json(build_file, current_build,
+                                                  indent=2, state=True)
 
                     return True
                 else:
@@ -523,8 +788,8 @@ class ProgramCollectionsGenerator:
             else:
                 # First run - store current build info
                 logger.info(f"First run - storing {environment} build info")
-                with open(build_file, 'w') as f:
-                    json.dump(current_build, f, indent=2)
+                self.output_writer.write_json(build_file, current_build,
+                                              indent=2, state=True)
                 return True
 
         except Exception as e:
@@ -538,37 +803,64 @@ class ProgramCollectionsGenerator:
             logger.info("Force update requested")
             return True
 
-        # Check for new builds
-        needs_update = False
+        # Check for new builds, probing all environments in one round-trip
+        environments = [env for env in ['staging', 'production']
+                        if environment in [env, 'both']]
+        self.refresh_build_info(environments)
 
-        if environment in ['staging', 'both']:
-            if self.check_for_new_build('staging'):
-                logger.info("New staging build detected - update needed")
-                needs_update = True
-
-        if environment in ['production', 'both']:
-            if self.check_for_new_build('production'):
-                logger.info("New production build detected - update needed")
+        needs_update = False
+        for env in environments:
+            if self.check_for_new_build(env, refresh=False):
+                logger.info(f"New {env} build detected - update needed")
                 needs_update = True
 
         return needs_update
 
     def run_automation(self, environment: str = 'both',
-                       force_update: bool = False) -> bool:
-        """Run the complete automation process with build checking"""
+                       force_update: bool = False,
+                       summary_file: str = None,
+                       report_file: str = None,
+                       step_summary_file: str = None,
+                       build_checked: bool = False) -> bool:
+        """Run the complete automation process with build checking.
+
+        A caller that has already run should_update for this tick passes
+        build_checked=True, so the builds are not checked a second time and
+        the build info it fetched is reused.
+        """
+        self.engine.reset()
+        if not build_checked:
+            self.build_info = {}
+
+        # The session is shared, so the hook is removed after the run
+        self.session.hooks['response'].append(self.metrics.requests_hook)
+
         try:
             logger.info(f"Starting program collections automation "
                         f"(environment: {environment})")
 
             # Check if update is needed based on build changes
-            if not self.should_update(environment, force_update):
+            if build_checked:
+                needs_update = True
+            else:
+                with self.metrics.stage('build_check'):
+                    needs_update = self.should_update(environment,
+                                                      force_update)
+            if not needs_update:
                 logger.info("No update needed - no new builds detected")
                 return True
 
             # Download and process data
-            df = self.download_program_data()
-            self.generate_files(df, environment)
+            with self.metrics.stage('download_sheet'):
+                rows = self.load_program_rows()
+            try:
+                with self.metrics.stage('generate'):
+                    self.generate_files(rows, environment)
+            finally:
+                with self.metrics.stage('save_caches'):
+                    self.save_search_caches()
 
+            self.output_writer.log_summary()
             logger.info(
                 "Program collections generation completed successfully!")
             return True
@@ -577,6 +869,39 @@ class ProgramCollectionsGenerator:
             logger.error(f"Automation failed: {e}")
             return False
 
+        finally:
+            self.session.hooks['response'].remove(self.metrics.requests_hook)
+
+            if summary_file:
+                try:
+                    self.output_writer.write_summary(summary_file)
+                except OSError as e:
+                    logger.warning(f"Could not write run summary: {e}")
+
+            self._write_run_report(report_file, step_summary_file)
+
+    def _write_run_report(self, report_file: str = None,
+                          step_summary_file: str = None):
+        """Log the run metrics and write the requested reports"""
+        for env, cache in self.search_caches.items():
+            if cache is not None:
+                self.metrics.increment(f'{env}_search_cache_hits', cache.hits)
+                self.metrics.increment(f'{env}_search_cache_misses',
+                                       cache.misses)
+
+        report = self.metrics.report()
+        logger.info(f"Run took {report['wall_seconds']:.1f}s with "
+                    f"{report['http']['requests']} HTTP requests "
+                    f"({report['http']['bytes']} bytes)")
+
+        try:
+            if report_file:
+                self.metrics.write_report(report_file)
+            if step_summary_file:
+                self.metrics.write_step_summary(step_summary_file)
+        except OSError as e:
+            logger.warning(f"Could not write run report: {e}")
+
 
 def main():
     """Main entry point"""
@@ -596,16 +921,101 @@ def main():
     parser.add_argument(
         '--force-update',
         action='store_true',
-        help='Force update even if no new build detected'
+        help=('Force update even if no new build detected; unchanged '
+              'programs are still skipped unless --full-regenerate is given')
+    )
+    parser.add_argument(
+        '--search-concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'Maximum concurrent grant searches (default: {DEFAULT_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--batch-query-length',
+        type=int,
+        nargs='?',
+        const=DEFAULT_MAX_QUERY_LENGTH,
+        default=0,
+        help=('Pack grants into OR-queries up to this encoded length '
+              f'(default when given without a value: {DEFAULT_MAX_QUERY_LENGTH}; '
+              '0 searches one grant per query)')
+    )
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help=f'HTTP connection pool size (default: {DEFAULT_POOL_SIZE})'
+    )
+    parser.add_argument(
+        '--full-regenerate',
+        action='store_true',
+        help='Regenerate every program, even if its row and build are unchanged'
+    )
+    parser.add_argument(
+        '--no-search-cache',
+        action='store_true',
+        help='Search every grant even if cached for the current build'
+    )
+    parser.add_argument(
+        '--no-sheet-cache',
+        action='store_true',
+        help='Download and parse the program sheet even if it is unchanged'
+    )
+    parser.add_argument(
+        '--funding-index',
+        action='store_true',
+        help=('Look grants up in a local index of one funding identifier '
+              'export per build instead of querying the API per grant')
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of programs to generate in parallel (default: 1)'
+    )
+    parser.add_argument(
+        '--remove-stale',
+        action='store_true',
+        help=('Delete the files of programs that are no longer generated '
+              'instead of listing them as stale in the summary')
+    )
+    parser.add_argument(
+        '--summary-file',
+        help='Write a JSON summary of changed, unchanged, removed and stale files'
+    )
+    parser.add_argument(
+        '--report-file',
+        help='Write a JSON report of stage timings, HTTP calls and cache hits'
+    )
+    parser.add_argument(
+        '--step-summary',
+        action='store_true',
+        help='Append the run report to $GITHUB_STEP_SUMMARY'
     )
 
     args = parser.parse_args()
 
     try:
-        generator = ProgramCollectionsGenerator(args.base_path)
+        configure_shared_session(pool_size=args.pool_size)
+        generator = ProgramCollectionsGenerator(
+            args.base_path,
+            search_concurrency=args.search_concurrency,
+            batch_query_length=args.batch_query_length,
+            use_search_cache=not args.no_search_cache,
+            incremental=not args.full_regenerate,
+            workers=args.workers,
+            use_sheet_cache=not args.no_sheet_cache,
+            use_funding_index=args.funding_index,
+            remove_stale=args.remove_stale
+        )
 
         # Run automation with build monitoring
-        success = generator.run_automation(args.environment, args.force_update)
+        step_summary_file = (os.environ.get('GITHUB_STEP_SUMMARY')
+                             if args.step_summary else None)
+        success = generator.run_automation(args.environment, args.force_update,
+                                           summary_file=args.summary_file,
+                                           report_file=args.report_file,
+                                           step_summary_file=step_summary_file)
 
         if success:
             logger.info(
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Program Rows
+
+Lightweight records for the rows of the program metadata sheet. Rows are
+built straight from the Sheets API `values` array or streamed from an xlsx
+export with openpyxl in read-only mode, so a sheet is never boxed into a
+DataFrame and then back into one Series per row. Only the columns the
+generators use are kept, in `__slots__`.
+
+ProgramRow supports `row['column']` and `row.get('column')` like the pandas
+Series it replaces, with empty cells read as None.
+"""
+
+import math
+from typing import Dict, Iterable, List, Sequence, Union
+
+import openpyxl
+import pandas as pd
+
+PROGRAM_COLUMNS = (
+    'fileName', 'name', 'abstract', 'description', 'alternateName', 'url',
+    'parentOrganization', 'niaidURL', 'fundingIDList', 'PriorProjectGrantIDs'
+)
+
+_COLUMN_SET = frozenset(PROGRAM_COLUMNS)
+
+
+def _clean(value):
+    """Read NaN cells from a DataFrame as None"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class ProgramRow:
+    """One program from the metadata sheet"""
+
+    __slots__ = PROGRAM_COLUMNS
+
+    def __init__(self, values: Dict[str, object] = None):
+        values = values or {}
+        for column in PROGRAM_COLUMNS:
+            setattr(self, column, _clean(values.get(column)))
+
+    @classmethod
+    def from_sequence(cls, positions: Dict[str, int],
+                      values: Sequence) -> 'ProgramRow':
+        """Build a row from a list of cells and the column positions"""
+        row = cls.__new__(cls)
+        size = len(values)
+        for column in PROGRAM_COLUMNS:
+            position = positions.get(column)
+            value = (values[position]
+                     if position is not None and position < size else None)
+            setattr(row, column, _clean(value))
+        return row
+
+    def __getitem__(self, column: str):
+        if column not in _COLUMN_SET:
+            raise KeyError(column)
+        return getattr(self, column)
+
+    def get(self, column: str, default=None):
+        """Return a column's value, or default for an unknown column"""
+        if column not in _COLUMN_SET:
+            return default
+        return getattr(self, column)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {column: getattr(self, column) for column in PROGRAM_COLUMNS}
+
+    @property
+    def is_valid(self) -> bool:
+        """True if the program has funding IDs, a NIAID URL and a file name"""
+        return (self.fundingIDList is not None and
+                self.fundingIDList != 'not found' and
+                self.niaidURL is not None and
+                self.fileName != '--')
+
+    def __repr__(self) -> str:
+        return f'ProgramRow(fileName={self.fileName!r})'
+
+
+def _column_positions(header: Sequence) -> Dict[str, int]:
+    """Map the known columns to their position in a header row"""
+    positions = {}
+    for position, column in enumerate(header):
+        if column in _COLUMN_SET and column not in positions:
+            positions[column] = position
+    return positions
+
+
+def rows_from_values(values: List[List]) -> List[ProgramRow]:
+    """Build rows from a Sheets API values array, header row first"""
+    if not values:
+        return []
+    positions = _column_positions(values[0])
+    return [ProgramRow.from_sequence(positions, row) for row in values[1:]]
+
+
+def rows_from_xlsx(source, sheet_name: str = 'metadata') -> List[ProgramRow]:
+    """Stream rows from an xlsx file or file-like object"""
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        cells = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(cells, None)
+        if header is None:
+            return []
+
+        positions = _column_positions(header)
+        return [ProgramRow.from_sequence(positions, row) for row in cells
+                if any(value is not None for value in row)]
+    finally:
+        workbook.close()
+
+
+def rows_from_dataframe(df: pd.DataFrame) -> List[ProgramRow]:
+    """Build rows from a DataFrame of the sheet"""
+    positions = _column_positions(list(df.columns))
+    return [ProgramRow.from_sequence(positions, row)
+            for row in df.itertuples(index=False, name=None)]
+
+
+def as_program_rows(data: Union[pd.DataFrame, Iterable[ProgramRow]]
+                    ) -> List[ProgramRow]:
+    """Accept a DataFrame of the sheet or already-built rows"""
+    if isinstance(data, pd.DataFrame):
+        return rows_from_dataframe(data)
+    return list(data)
+
+
+def rows_to_dataframe(rows: Iterable[ProgramRow]) -> pd.DataFrame:
+    """Build a DataFrame of the sheet columns from rows"""
+    return pd.DataFrame.from_records(
+        [tuple(getattr(row, column) for column in PROGRAM_COLUMNS)
+         for row in rows],
+        columns=list(PROGRAM_COLUMNS))
+
+
+def valid_rows(rows: Iterable[ProgramRow]) -> List[ProgramRow]:
+    """Keep the rows that can be generated"""
+    return [row for row in rows if row.is_valid]
+
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Record Sets
+
+Reads, writes and compares the `_records.txt` files of program collections.
+Record IDs are held as sets of the IDs that appear in the resource URLs, so
+the prior records of control-transferred programs can be merged with a new
+search without duplicates, and every rewritten records file can report the
+IDs it added and removed.
+
+Records files are rendered with a single join and parsed back with one
+regular expression scan, so large programs cost no per-line Python work.
+
+Prior records are read from the local corrections checkout, which the
+workflows already have, and only fetched from GitHub when the local file is
+missing.
+"""
+
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+import requests
+
+from http_session import get_shared_session
+from output_writer import OutputWriter
+
+logger = logging.getLogger(__name__)
+
+RECORD_URL_PREFIX = 'https://data.niaid.nih.gov/resources?id='
+
+# ImmPort record IDs carry a prefix their resource URLs leave out
+IMMPORT_PREFIX = 'immport_'
+
+RECORD_ID_PATTERN = re.compile(r'resources\?id=(\S+)')
+
+PRIOR_RECORDS_BASE_URL = (
+    'https://raw.githubusercontent.com/NIAID-Data-Ecosystem/'
+    'nde-metadata-corrections/refs/heads/main'
+)
+
+
+def records_dir_name(environment: str) -> str:
+    """Name of the corrections directory of an environment"""
+    if environment == 'production':
+        return 'collections_corrections_production'
+    return 'collections_corrections_staging'
+
+
+def record_url_id(record_id: str) -> str:
+    """The ID a record has in its resource URL"""
+    if record_id.startswith(IMMPORT_PREFIX):
+        return record_id[len(IMMPORT_PREFIX):]
+    return record_id
+
+
+def render_records(record_ids: Iterable[str]) -> Tuple[List[str], str]:
+    """Render a records file in order of the record IDs.
+
+    Returns the de-duplicated URL IDs and the file content.
+    """
+    url_ids = list(dict.fromkeys(map(record_url_id, sorted(record_ids))))
+    if not url_ids:
+        return url_ids, ''
+    separator = '\n' + RECORD_URL_PREFIX
+    return url_ids, f'{RECORD_URL_PREFIX}{separator.join(url_ids)}\n'
+
+
+def parse_record_ids(text: str) -> FrozenSet[str]:
+    """Read the record IDs of a records file"""
+    return frozenset(RECORD_ID_PATTERN.findall(text))
+
+
+def _read_bytes(path: Path) -> Optional[bytes]:
+    """Read a file, or None if it does not exist"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def read_record_ids(path: Path) -> Optional[FrozenSet[str]]:
+    """Read a local records file, or None if it does not exist"""
+    data = _read_bytes(path)
+    if data is None:
+        return None
+    return parse_record_ids(data.decode('utf-8'))
+
+
+def merge_prior_records(record_ids: Iterable[str],
+                        prior_ids: Iterable[str]) -> List[str]:
+    """Add prior URL IDs to new record IDs without duplicating records.
+
+    A prior ID that is the URL ID of a new record is the same record, so it
+    is mapped back to that record's ID before the union.
+    """
+    record_ids = set(record_ids)
+    by_url_id = {record_url_id(record_id): record_id
+                 for record_id in record_ids}
+    return sorted(record_ids |
+                  {by_url_id.get(prior_id, prior_id) for prior_id in prior_ids})
+
+
+def diff_record_ids(previous: Iterable[str],
+                    current: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Return the sorted added and removed IDs"""
+    previous = set(previous)
+    current = set(current)
+    return sorted(current - previous), sorted(previous - current)
+
+
+def write_records_file(writer: OutputWriter, path: Path,
+                       record_ids: Iterable[str]) -> bool:
+    """Write a records file on change and record its ID diff.
+
+    Records are listed in order of their record IDs, one resource URL per
+    line. The existing file is read once, and only parsed when it changed.
+    Returns True if the file was written.
+    """
+    previous = _read_bytes(path)
+    url_ids, content = render_records(record_ids)
+    data = content.encode('utf-8')
+
+    if previous == data:
+        writer.mark_unchanged(path)
+        return False
+
+    writer.replace(path, data)
+    if previous is not None:
+        added, removed = diff_record_ids(
+            parse_record_ids(previous.decode('utf-8')), url_ids)
+        writer.record_diff(path, added, removed)
+        logger.info(f"{Path(path).name}: {len(added)} records added, "
+                    f"{len(removed)} removed")
+    return True
+
+
+class PriorRecords:
+    """Record sets of the existing records files, read once per run"""
+
+    def __init__(self, correction_path: Path,
+                 session: requests.Session = None,
+                 remote_base_url: str = PRIOR_RECORDS_BASE_URL):
+        self.correction_path = Path(correction_path)
+        self.session = session or get_shared_session()
+        self.remote_base_url = remote_base_url
+        self.remote_fetches = 0
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def local_path(self, filename: str, environment: str) -> Path:
+        return (self.correction_path / records_dir_name(environment) /
+                f'{filename}_records.txt')
+
+    def get(self, filename: str, environment: str) -> List[str]:
+        """Return the sorted prior record IDs of a program"""
+        key = (environment, filename)
+        with self._lock:
+            if key in self._records:
+                return self._records[key]
+
+        record_ids = read_record_ids(self.local_path(filename, environment))
+        if record_ids is None:
+            record_ids = self._fetch_remote(filename, environment)
+        else:
+            logger.info(f"Read {len(record_ids)} prior records for "
+                        f"{filename} from the corrections checkout")
+
+        sorted_ids = sorted(record_ids)
+        with self._lock:
+            self._records[key] = sorted_ids
+        return sorted_ids
+
+    def _fetch_remote(self, filename: str,
+                      environment: str) -> FrozenSet[str]:
+        """Fetch a records file from the corrections repository on GitHub"""
+        url = (f'{self.remote_base_url}/{records_dir_name(environment)}/'
+               f'{filename}_records.txt')
+        try:
+            with self._lock:
+                self.remote_fetches += 1
+            response = self.session.get(url, timeout=30)
+            response.raise_for_status()
+            record_ids = parse_record_ids(response.text)
+            logger.info(f"Fetched {len(record_ids)} prior records for "
+                        f"{filename} from GitHub")
+            return record_ids
+        except Exception as e:
+            logger.warning(f"Could not get prior records for {filename}: {e}")
+            return frozenset()
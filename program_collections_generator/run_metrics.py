@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Run Metrics
+
+Timing and request instrumentation for a program collections run. Records
+per-stage durations, every HTTP call made through the shared requests session
+or the aiohttp search sessions, bytes transferred, cache hits and the slowest
+grant searches and programs. The collected metrics are written as a JSON run
+report and, optionally, as a Markdown GitHub step summary.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+logger = logging.getLogger(__name__)
+
+SLOWEST_COUNT = 10
+
+
+class RunMetrics:
+    """Collects timings and counters for one run"""
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+        self.counters = defaultdict(int)
+        self.hosts = defaultdict(lambda: {'requests': 0, 'seconds': 0.0,
+                                          'bytes': 0, 'errors': 0})
+        self.http_calls = []
+        self.grant_timings = []
+        self.program_timings = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage; repeated stages accumulate"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name]['seconds'] += elapsed
+                self.stages[name]['calls'] += 1
+
+    def increment(self, counter: str, amount: int = 1):
+        """Increase a named counter"""
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_http(self, method: str, url: str, status: int,
+                    seconds: float, num_bytes: int = 0):
+        """Record a single HTTP request"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            entry = self.hosts[host]
+            entry['requests'] += 1
+            entry['seconds'] += seconds
+            entry['bytes'] += num_bytes
+            if status is None or status >= 400:
+                entry['errors'] += 1
+            self.http_calls.append({
+                'method': method,
+                'url': url,
+                'status': status,
+                'seconds': round(seconds, 4),
+                'bytes': num_bytes
+            })
+
+    def add_bytes(self, url: str, num_bytes: int):
+        """Add received bytes to a host's total"""
+        with self._lock:
+            self.hosts[urlsplit(url).netloc]['bytes'] += num_bytes
+
+    def record_grant(self, environment: str, query: str, seconds: float):
+        """Record the latency of one grant search"""
+        with self._lock:
+            self.grant_timings.append({'environment': environment,
+                                       'query': query,
+                                       'seconds': round(seconds, 4)})
+
+    def record_program(self, environment: str, filename: str,
+                       seconds: float, status: str):
+        """Record how long one program took to generate"""
+        with self._lock:
+            self.program_timings.append({'environment': environment,
+                                         'fileName': filename,
+                                         'status': status,
+                                         'seconds': round(seconds, 4)})
+
+    def requests_hook(self, response: requests.Response, *args, **kwargs):
+        """Response hook for a requests.Session"""
+        self.record_http(response.request.method, response.url,
+                         response.status_code,
+                         response.elapsed.total_seconds(),
+                         len(response.content or b''))
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Build an aiohttp TraceConfig that records every request"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            self.record_http(params.method, str(params.url),
+                             params.response.status,
+                             time.perf_counter() - context.start)
+
+        async def on_request_exception(session, context, params):
+            self.record_http(params.method, str(params.url), None,
+                             time.perf_counter() - context.start)
+
+        async def on_chunk(session, context, params):
+            self.add_bytes(str(params.url), len(params.chunk))
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_response_chunk_received.append(on_chunk)
+        return trace_config
+
+    @staticmethod
+    def _slowest(entries: List[Dict], count: int = SLOWEST_COUNT) -> List[Dict]:
+        return sorted(entries, key=lambda x: x['seconds'], reverse=True)[:count]
+
+    def report(self) -> Dict[str, object]:
+        """Build the run report"""
+        with self._lock:
+            total_requests = sum(x['requests'] for x in self.hosts.values())
+            total_bytes = sum(x['bytes'] for x in self.hosts.values())
+            return {
+                'started_at': self.started_at.isoformat(),
+                'wall_seconds': round(time.perf_counter() - self._start, 4),
+                'stages': {name: {'seconds': round(x['seconds'], 4),
+                                  'calls': x['calls']}
+                           for name, x in self.stages.items()},
+                'counters': dict(self.counters),
+                'http': {
+                    'requests': total_requests,
+                    'bytes': total_bytes,
+                    'hosts': {host: dict(x, seconds=round(x['seconds'], 4))
+                              for host, x in self.hosts.items()},
+                    'slowest': self._slowest(self.http_calls)
+                },
+                'slowest_grants': self._slowest(self.grant_timings),
+                'slowest_programs': self._slowest(self.program_timings)
+            }
+
+    def write_report(self, path: str):
+        """Write the run report as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info(f"Wrote run report to {path}")
+
+    def step_summary(self) -> str:
+        """Render the run report as Markdown for a GitHub step summary"""
+        report = self.report()
+        lines = [
+            '## Program Collections Run Report',
+            f"- **Wall time**: {report['wall_seconds']:.1f}s",
+            f"- **HTTP requests**: {report['http']['requests']}",
+            f"- **Bytes received**: {report['http']['bytes']}",
+        ]
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f"- **{name}**: {value}")
+
+        lines += ['', '| Stage | Seconds | Calls |', '|---|---|---|']
+        for name, stage in report['stages'].items():
+            lines.append(f"| {name} | {stage['seconds']:.2f} | "
+                         f"{stage['calls']} |")
+
+        if report['slowest_grants']:
+            lines += ['', '| Slowest grant searches | Environment | Seconds |',
+                      '|---|---|---|']
+            for entry in report['slowest_grants']:
+                lines.append(f"| {entry['query']} | {entry['environment']} | "
+                             f"{entry['seconds']:.2f} |")
+
+        if report['slowest_programs']:
+            lines += ['', '| Slowest programs | Environment | Seconds |',
+                      '|---|---|---|']
+            for entry in report['slowest_programs']:
+                lines.append(f"| {entry['fileName']} | "
+                             f"{entry['environment']} | "
+                             f"{entry['seconds']:.2f} |")
+
+        return '\n'.join(lines) + '\n'
+
+    def write_step_summary(self, path: str):
+        """Append the Markdown summary to a GitHub step summary file"""
+        with open(path, 'a') as f:
+            f.write(self.step_summary())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Grant Search Cache
+
+Persists the record IDs returned for each grant query so that runs against an
+unchanged API build can skip searches they have already made. There is one
+JSON shard per environment, stored next to `last_{environment}_build.json` in
+the corrections repository. A shard is only valid for the build version and
+search mode it was written for; loading it for any other build starts from an
+empty cache, which evicts every entry from older builds.
+"""
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from output_writer import OutputWriter, write_if_changed
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """Maps grant queries to record IDs for one environment and build"""
+
+    def __init__(self, cache_file: Path, build_version: str,
+                 search_mode: str = 'wildcard'):
+        self.cache_file = Path(cache_file)
+        self.build_version = build_version
+        self.search_mode = search_mode
+        self.queries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, cache_file: Path, build_version: str,
+             search_mode: str = 'wildcard') -> 'SearchCache':
+        """Load a cache shard, discarding it if it belongs to another build"""
+        cache = cls(cache_file, build_version, search_mode)
+
+        if not cache.cache_file.exists():
+            return cache
+
+        try:
+            with open(cache.cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read search cache "
+                           f"{cache.cache_file}: {e}")
+            return cache
+
+        if (data.get('build_version') != build_version or
+                data.get('search_mode') != search_mode):
+            logger.info(f"Evicting search cache {cache.cache_file.name} "
+                        f"from build {data.get('build_version')}")
+            cache._dirty = True
+            return cache
+
+        cache.queries = data.get('queries', {})
+        logger.info(f"Loaded {len(cache.queries)} cached grant searches "
+                    f"for build {build_version}")
+        return cache
+
+    def get(self, query: str) -> Optional[List[str]]:
+        """Return the cached record IDs for a query, or None on a miss"""
+        with self._lock:
+            record_ids = self.queries.get(query)
+            if record_ids is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return record_ids
+
+    def set(self, query: str, record_ids: Iterable[str]):
+        """Store the record IDs returned for a query"""
+        with self._lock:
+            self.queries[query] = sorted(set(record_ids))
+            self._dirty = True
+
+    def save(self, writer: OutputWriter = None):
+        """Write the cache shard if it has changed"""
+        if not self._dirty:
+            return
+
+        data = {
+            'build_version': self.build_version,
+            'search_mode': self.search_mode,
+            'queries': self.queries
+        }
+
+        content = json.dumps(data, indent=2, sort_keys=True)
+        if writer:
+            writer.write(self.cache_file, content, state=True)
+        else:
+            write_if_changed(self.cache_file, content)
+
+        self._dirty = False
+        logger.info(f"Saved {len(self.queries)} grant searches to "
+                    f"{self.cache_file.name} "
+                    f"({self.hits} hits, {self.misses} misses)")
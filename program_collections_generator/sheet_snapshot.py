@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Program Sheet Snapshot
+
+Keeps the last parsed copy of the program metadata sheet as a pickle of its
+rows, tagged with the sheet version it was read from: the Drive
+`modifiedTime` and revision when the Sheets API is used, or a hash of the
+xlsx export otherwise. A run whose sheet version matches the snapshot reuses
+the rows instead of fetching and parsing the sheet again.
+"""
+
+import logging
+import pickle
+from pathlib import Path
+from typing import List, Optional
+
+from output_writer import atomic_write
+from program_rows import PROGRAM_COLUMNS, ProgramRow
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+
+class SheetSnapshot:
+    """Parsed program rows of one version of the sheet"""
+
+    def __init__(self, version: str, rows: List[ProgramRow]):
+        self.version = version
+        self.rows = rows
+
+    @classmethod
+    def load(cls, snapshot_file: Path) -> Optional['SheetSnapshot']:
+        """Load a snapshot, or None if it is missing or unusable"""
+        snapshot_file = Path(snapshot_file)
+        if not snapshot_file.exists():
+            return None
+
+        try:
+            with open(snapshot_file, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read sheet snapshot "
+                           f"{snapshot_file}: {e}")
+            return None
+
+        if (not isinstance(data, dict) or
+                data.get('format') != SNAPSHOT_FORMAT or
+                tuple(data.get('columns', ())) != PROGRAM_COLUMNS):
+            logger.info(f"Ignoring outdated sheet snapshot {snapshot_file}")
+            return None
+
+        return cls(data['version'], data['rows'])
+
+    def save(self, snapshot_file: Path):
+        """Write the snapshot atomically"""
+        data = {
+            'format': SNAPSHOT_FORMAT,
+            'columns': PROGRAM_COLUMNS,
+            'version': self.version,
+            'rows': self.rows
+        }
+        atomic_write(snapshot_file,
+                     pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        logger.info(f"Saved sheet snapshot of {len(self.rows)} programs "
+                    f"(version {self.version})")
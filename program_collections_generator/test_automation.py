@@ -8,11 +8,24 @@ without making actual changes to the correction files.
 
 import json
 import logging
+import os
 import sys
 import tempfile
+import time
 from pathlib import Path
 
+import pandas as pd
+
+import grant_search
+from benchmark import build_sheet, prepare_base_path, prepare_corrections
+from funding_index import FundingIndex
+from generation_manifest import GenerationManifest, hash_values
+from grant_parser import GrantIDParser
+from mock_nde_api import MockNDEAPI, synthetic_programs, synthetic_records
+from output_writer import OutputWriter
 from program_collections_automation import ProgramCollectionsGenerator
+from program_rows import rows_from_dataframe, rows_from_values, valid_rows
+from search_cache import SearchCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -70,6 +83,37 @@ def test_data_download():
         return False
 
 
+def test_program_rows():
+    """Test that sheet rows filter like the DataFrame they replace"""
+    logger.info("Testing program rows...")
+
+    values = [
+        ['fileName', 'name', 'fundingIDList', 'niaidURL'],
+        ['valid', 'Valid Program', 'R01AI073685', 'https://niaid.nih.gov/a'],
+        ['no_funding', 'No Funding', 'not found', 'https://niaid.nih.gov/b'],
+        ['--', 'Placeholder', 'R01AI073685', 'https://niaid.nih.gov/c'],
+        ['short_row', 'Short Row'],
+    ]
+    rows = rows_from_values(values)
+
+    df = pd.DataFrame(values[1:], columns=values[0])
+    valid_df = df[
+        (~df['fundingIDList'].isna()) &
+        (df['fundingIDList'] != 'not found') &
+        (~df['niaidURL'].isna()) &
+        (df['fileName'] != '--')
+    ]
+
+    assert [row['fileName'] for row in valid_rows(rows)] == \
+        list(valid_df['fileName']), "Row filter should match DataFrame filter"
+    assert [row.to_dict() for row in rows_from_dataframe(df)] == \
+        [row.to_dict() for row in rows], "DataFrame rows should match"
+    assert rows[3].get('niaidURL') is None, "Missing cells should be None"
+
+    print(f"✓ Loaded {len(rows)} rows, {len(valid_rows(rows))} valid")
+    return True
+
+
 def test_grant_parsing():
     """Test grant ID parsing functionality"""
     logger.info("Testing grant ID parsing...")
@@ -90,6 +134,19 @@ def test_grant_parsing():
         print(
             f"✓ Parsed {grant}: IC={parsed['icCode']}, Serial={parsed['serialNum']}")
 
+    # Batch parsing should agree with single-grant parsing
+    parsed_all = generator.parse_grant_ids(test_grants, act_codes, ic_codes)
+    for grant, parsed in zip(test_grants, parsed_all):
+        assert parsed == generator.parse_grant_id(grant, act_codes, ic_codes), \
+            f"Batch parse mismatch for {grant}"
+
+    parsed_series = generator.parse_grant_ids(pd.Series(test_grants),
+                                              act_codes, ic_codes)
+    assert list(parsed_series['serialNum']) == [
+        parsed['serialNum'] for parsed in parsed_all
+    ], "Vectorized parse should match batch parse"
+    print(f"✓ Parsed {len(test_grants)} grants in one batch")
+
     return True
 
 
@@ -112,6 +169,143 @@ def test_search_functionality():
         return False
 
 
+def test_mock_api_search():
+    """Test record search against the offline mock API"""
+    logger.info("Testing search against the mock API...")
+
+    programs = synthetic_programs(3, grants_per_program=2)
+    records = synthetic_records(programs, records_per_grant=3)
+
+    with MockNDEAPI(records, page_size=2) as api:
+        generator = ProgramCollectionsGenerator(use_search_cache=False)
+        generator.staging_api = api.query_url
+        _, _, act_codes, ic_codes = generator.load_config_files()
+
+        grants = generator.parse_array_text(programs[0]['fundingIDList'])
+        search_keys = generator.grant_parser.search_keys(grants)
+        expected = {record['_id'] for record in records
+                    if any(key in funding['identifier']
+                           for funding in record['funding']
+                           for key in search_keys)}
+
+        records_found = generator.search_records(search_keys, 'staging')
+        assert set(records_found) == expected, \
+            "Search should return every record citing the grants"
+        assert api.open_scrolls == 0, \
+            "Queries that fit one page should not open scroll contexts"
+
+        # A small first page forces every query through several scroll pages
+        page_size = grant_search.PAGE_SIZE
+        grant_search.PAGE_SIZE = 2
+        try:
+            # Start a new run so the grants are not answered from its memo
+            generator.engine.reset()
+            scrolled = generator.search_records(search_keys, 'staging')
+            assert set(scrolled) == expected, \
+                "Scrolled search should return the same records"
+
+            generator.batch_query_length = 200
+            batched = generator.search_records(search_keys, 'staging')
+            assert set(batched) == expected, \
+                "Batched search should return the same records"
+        finally:
+            grant_search.PAGE_SIZE = page_size
+
+        # One export of the build answers every grant from a local index
+        with tempfile.TemporaryDirectory() as index_dir:
+            generator.engine.index_path = Path(index_dir)
+            generator.staging_metadata_api = api.metadata_url
+            indexed = generator.search_records(search_keys, 'staging')
+            assert set(indexed) == expected, \
+                "Indexed search should return the same records"
+            assert list(Path(index_dir).glob('funding_index_*.pkl')), \
+                "The funding index should be saved"
+
+        print(f"✓ Found {len(expected)} records with "
+              f"{api.total_requests} mock API requests")
+
+    return True
+
+
+def test_funding_index_identifier_shapes():
+    """Test that index lookups match wildcard searches on real identifiers"""
+    logger.info("Testing funding index lookups against wildcard search...")
+
+    # Identifier shapes seen in the API, several of which do not parse to
+    # the grant's search key but still contain it
+    identifiers = [
+        '1R01AI073685-01', 'R01 AI073685', 'NIH-AI073685', 'AI073685-05S1',
+        '5U19AI135664-03 / R01AI073685', 'NIAID grant AI073685',
+        'HHSN272201400008C', '75N93019C00076', 'U19 AI135664'
+    ]
+    records = [{'_id': f'shape_{number:03d}',
+                'funding': [{'identifier': identifier}]}
+               for number, identifier in enumerate(identifiers)]
+    grants = ['1-R01-AI073685-01', 'U19AI135664', 'HHSN272201400008C',
+              '75N93019C00076']
+
+    with MockNDEAPI(records) as api, \
+            tempfile.TemporaryDirectory() as index_dir:
+        generator = ProgramCollectionsGenerator(use_search_cache=False)
+        generator.staging_api = api.query_url
+        generator.staging_metadata_api = api.metadata_url
+        generator.load_config_files()
+        search_keys = generator.grant_parser.search_keys(grants)
+
+        for key in search_keys:
+            generator.engine.reset()
+            generator.engine.index_path = None
+            wildcard = set(generator.search_records([key], 'staging'))
+
+            generator.engine.reset()
+            generator.engine.index_path = Path(index_dir)
+            indexed = set(generator.search_records([key], 'staging'))
+
+            assert indexed == wildcard, \
+                f"Index lookup of {key} should match the wildcard search"
+            print(f"✓ {key}: {len(indexed)} records")
+
+    return True
+
+
+def test_funding_index_lookup_cost():
+    """Test that index lookups do not grow with the number of records"""
+    logger.info("Testing funding index lookup cost...")
+
+    parser = GrantIDParser(['R01', 'U19'], ['AI'])
+    shapes = ['1R01AI{:06d}-01', 'NIH-AI{:06d}', 'U19 AI{:06d}',
+              'AI{:06d}-05S1', 'HHSN2722014{:06d}C']
+    keys = ['AI100007', 'AI100123', 'HHSN2722014100042C', 'AI10001']
+
+    def build(count):
+        hits = [{'_id': f'record_{number:06d}',
+                 'funding': [{'identifier':
+                              shapes[number % len(shapes)].format(
+                                  100000 + number % 1000 + 1000 * (number // 1000))}]}
+                for number in range(count)]
+        return FundingIndex.from_hits(hits, 'v1', parser)
+
+    small, large = build(2000), build(20000)
+    for key in keys:
+        for index in (small, large):
+            expected = {record_id for record_id, identifiers
+                        in index.records.items()
+                        if any(key in identifier.upper()
+                               for identifier in identifiers)}
+            assert set(index.record_ids(key)) == expected, \
+                f"Lookup of {key} should match a scan of every identifier"
+        assert len(large.candidates(key)) == len(small.candidates(key)), \
+            f"Candidates of {key} should not grow with the record count"
+
+    assert len(large.candidates('75N93019C00076')) == len(large.records), \
+        "Keys starting with digits should fall back to a scan"
+
+    print(f"✓ {len(keys)} keys checked against the same number of "
+          f"candidates in {len(small.records)} and "
+          f"{len(large.records)} records")
+    return True
+
+
 def test_file_generation():
     """Test file generation without writing to actual correction directories"""
     logger.info("Testing file generation...")
@@ -190,14 +384,353 @@ def test_file_generation():
             return False
 
 
+def test_output_writer():
+    """Test write-on-change, stale and removed outputs and the run summary"""
+    logger.info("Testing the output writer...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        output_dir = root / 'collections_corrections_staging'
+        writer = OutputWriter(root)
+
+        records_file = output_dir / 'program_records.txt'
+        assert writer.write(records_file, 'a\nb\n'), \
+            "A new file should be written"
+        assert not writer.write(records_file, 'a\nb\n'), \
+            "Unchanged content should not be rewritten"
+        assert writer.write_json(output_dir / 'program_correction.json',
+                                 {'name': 'Program'}), \
+            "A new JSON file should be written"
+
+        stale_file = output_dir / 'old_program_records.txt'
+        stale_file.write_text('c\n')
+        writer.mark_stale(stale_file)
+        assert stale_file.exists(), "Stale files should be left in place"
+
+        removed_file = output_dir / 'removed_program_records.txt'
+        removed_file.write_text('d\n')
+        assert writer.remove(removed_file) and not removed_file.exists(), \
+            "Removed files should be deleted"
+        assert not writer.remove(removed_file), \
+            "Removing a missing file should report nothing removed"
+
+        assert not list(output_dir.glob('.*.tmp')), \
+            "No temporary files should be left behind"
+
+        summary = writer.summary()
+        assert summary['changed'] == [
+            'collections_corrections_staging/program_correction.json',
+            'collections_corrections_staging/program_records.txt'
+        ], f"Unexpected changed files: {summary['changed']}"
+        assert summary['unchanged_count'] == 1
+        assert summary['stale'] == [
+            'collections_corrections_staging/old_program_records.txt']
+        assert summary['removed'] == [
+            'collections_corrections_staging/removed_program_records.txt']
+        assert summary['collections_changed'] and summary['has_changes']
+
+        # State files are changes, but not collection changes
+        state_writer = OutputWriter(root)
+        state_writer.write(root / 'last_staging_build.json', '{}', state=True)
+        state_summary = state_writer.summary()
+        assert state_summary['has_changes'], "State writes should count"
+        assert not state_summary['collections_changed'], \
+            "State writes should not count as collection changes"
+
+        print(f"✓ {len(summary['changed'])} changed, "
+              f"{summary['unchanged_count']} unchanged, "
+              f"{len(summary['stale'])} stale, "
+              f"{len(summary['removed'])} removed")
+
+    return True
+
+
+def test_generation_manifest():
+    """Test that the manifest tracks the row and build of each program"""
+    logger.info("Testing the generation manifest...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manifest_file = Path(temp_dir) / 'generation_manifest_staging.json'
+        manifest = GenerationManifest.load(manifest_file)
+        row_hash = hash_values({'fileName': 'program', 'name': 'Program'})
+
+        assert hash_values({'name': 'Program', 'fileName': 'program'}) == \
+            row_hash, "Row hashes should not depend on key order"
+        assert not manifest.is_current('program', row_hash, 'v1'), \
+            "Unknown programs should not be current"
+
+        manifest.record('program', row_hash, 'v1')
+        manifest.record('other', row_hash, 'v1')
+        manifest.forget('other')
+        manifest.save()
+
+        manifest = GenerationManifest.load(manifest_file)
+        assert list(manifest.programs) == ['program'], \
+            "Forgotten programs should not be saved"
+        assert manifest.is_current('program', row_hash, 'v1')
+        assert not manifest.is_current('program', row_hash, 'v2'), \
+            "A new build should make programs stale"
+        assert not manifest.is_current('program', 'changed', 'v1'), \
+            "A changed row should make its program stale"
+        assert not manifest.is_current('program', row_hash, ''), \
+            "Without a build version nothing should be current"
+
+        print(f"✓ Saved and reloaded {len(manifest.programs)} program")
+
+    return True
+
+
+def test_incremental_generation():
+    """Test skipped, incomplete and stale programs across generation runs"""
+    logger.info("Testing incremental generation against the mock API...")
+
+    programs = synthetic_programs(3, grants_per_program=2)
+    records = synthetic_records(programs, records_per_grant=2)
+    header = list(programs[0])
+
+    def program_rows(programs):
+        return rows_from_values(
+            [header] + [[program[column] for column in header]
+                        for program in programs])
+
+    def run(rows, **kwargs):
+        # Every run starts with fresh run state, like run_automation
+        generator.engine.reset()
+        return generator.generate_files(rows, 'staging', **kwargs)
+
+    def manifest_programs():
+        return set(GenerationManifest.load(
+            temp_path / 'generation_manifest_staging.json').programs)
+
+    with MockNDEAPI(records) as api, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir)
+        generator = ProgramCollectionsGenerator(use_search_cache=False)
+        generator.correction_path = temp_path
+        generator.staging_api = api.query_url
+        generator.staging_metadata_api = api.metadata_url
+        rows = program_rows(programs)
+        names = [program['fileName'] for program in programs]
+
+        stats = run(rows)
+        assert stats['generated'] == 3, f"Unexpected stats: {stats}"
+        assert manifest_programs() == set(names)
+
+        stats = run(rows)
+        assert stats['skipped'] == 3, \
+            f"Current programs should be skipped: {stats}"
+        assert not generator.output_writer.changed
+
+        stats = run(rows, full_regenerate=True)
+        assert stats['generated'] == 3, \
+            f"A full regeneration should skip nothing: {stats}"
+
+        # A changed row whose grant searches fail is written but not
+        # recorded, so the next run generates it again
+        changed = [dict(programs[0], description='Changed description.')]
+        rows = program_rows(changed + programs[1:])
+        search_records = generator.search_records
+
+        def failing_search(grant_list, environment, failed=None):
+            failed.update(grant_list)
+            return []
+
+        generator.search_records = failing_search
+        try:
+            stats = run(rows)
+        finally:
+            generator.search_records = search_records
+        assert (stats['incomplete'], stats['skipped']) == (1, 2), \
+            f"Only the changed program should be incomplete: {stats}"
+        assert manifest_programs() == set(names[1:]), \
+            "Incomplete programs should not be recorded as current"
+
+        stats = run(rows)
+        assert (stats['generated'], stats['skipped']) == (1, 2), \
+            f"The incomplete program should be generated again: {stats}"
+
+        # Programs missing from the sheet are listed, and only removed
+        # when asked to
+        output_files = generator.engine.output_files(names[0], 'staging')
+        run(rows[1:])
+        stale = [str(path.relative_to(temp_path)) for path in output_files]
+        assert generator.output_writer.summary()['stale'] == sorted(stale), \
+            "Files of missing programs should be listed as stale"
+        assert all(path.exists() for path in output_files), \
+            "Stale files should be kept by default"
+
+        generator.remove_stale = True
+        run(rows[1:])
+        assert not any(path.exists() for path in output_files), \
+            "Stale files should be removed with remove_stale"
+        assert manifest_programs() == set(names[1:])
+
+        print(f"✓ Generated, skipped and regenerated {len(names)} programs")
+
+    return True
+
+
+def test_forced_runs_stay_incremental():
+    """Test that a forced run without a new build skips unchanged programs"""
+    logger.info("Testing repeated forced runs against the mock API...")
+
+    programs = synthetic_programs(3, grants_per_program=2)
+    records = synthetic_records(programs, records_per_grant=2)
+    credentials = os.environ.pop('GOOGLE_SHEETS_CREDENTIALS', None)
+
+    try:
+        with MockNDEAPI(records, sheet=build_sheet(programs)) as api, \
+                tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            base_path = prepare_base_path(temp_path / 'scripts', [], [])
+            corrections = prepare_corrections(temp_path / 'corrections',
+                                              [], [])
+            generator = ProgramCollectionsGenerator(str(base_path),
+                                                    use_search_cache=False)
+            generator.sheets_url = api.sheet_url
+            generator.staging_api = api.query_url
+            generator.staging_metadata_api = api.metadata_url
+            generator.correction_path = corrections
+
+            counters = []
+            for _ in range(2):
+                assert generator.run_automation('staging', force_update=True)
+                counters.append(generator.metrics.report()['counters'])
+
+            assert counters[0].get('programs_generated') == len(programs), \
+                f"The first run should generate every program: {counters[0]}"
+            assert counters[1].get('programs_skipped') == len(programs), \
+                f"The second run should skip every program: {counters[1]}"
+            assert not counters[1].get('programs_generated'), \
+                "A forced run should not regenerate unchanged programs"
+            assert not generator.output_writer.summary()['changed']
+
+            print(f"✓ Second forced run skipped all {len(programs)} programs")
+    finally:
+        if credentials is not None:
+            os.environ['GOOGLE_SHEETS_CREDENTIALS'] = credentials
+
+    return True
+
+
+def test_worker_log_order():
+    """Test that parallel program logs are replayed grouped, in task order"""
+    logger.info("Testing log buffering of parallel workers...")
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    names = [f'program_{number}' for number in range(4)]
+
+    def generate_program(row, environment, *args):
+        # Later programs finish first, so unbuffered logs would interleave
+        logger.info(f"start {row['fileName']}")
+        time.sleep(0.02 * (len(names) - names.index(row['fileName'])))
+        logger.info(f"end {row['fileName']}")
+        return 'generated', row['fileName'], None
+
+    generator = ProgramCollectionsGenerator(workers=len(names))
+    generator._generate_program = generate_program
+    tasks = [({'fileName': name}, 'staging') for name in names]
+
+    # The records must reach the root handlers whatever the caller's
+    # logging configuration
+    root_logger = logging.getLogger()
+    root_level = root_logger.level
+    handler = ListHandler()
+    handler.setLevel(logging.INFO)
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(handler)
+    try:
+        outcomes = list(generator._run_tasks(tasks, {'staging': None},
+                                             [], [], []))
+    finally:
+        root_logger.removeHandler(handler)
+        root_logger.setLevel(root_level)
+
+    assert [outcome[1] for outcome in outcomes] == names, \
+        "Outcomes should be yielded in task order"
+    expected = [message for name in names
+                for message in (f"start {name}", f"end {name}")]
+    assert handler.messages == expected, \
+        f"Logs should be grouped by program: {handler.messages}"
+    assert not any(root_handler.filters
+                   for root_handler in root_logger.handlers), \
+        "The log buffer should be removed after the run"
+
+    print(f"✓ Replayed the logs of {len(names)} parallel programs in order")
+    return True
+
+
+def test_search_cache():
+    """Test that cached searches are reused only for the same build"""
+    logger.info("Testing the search cache...")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file = Path(temp_dir) / 'search_cache_staging.json'
+        cache = SearchCache.load(cache_file, 'v1')
+        assert cache.get('AI073685') is None, "An empty cache should miss"
+
+        cache.set('AI073685', ['record_b', 'record_a', 'record_b'])
+        writer = OutputWriter(temp_dir)
+        cache.save(writer)
+        assert writer.state_changed == ['search_cache_staging.json'], \
+            "The cache should be written as a state file"
+        assert not writer.changed, "The cache is not a collection output"
+
+        cache = SearchCache.load(cache_file, 'v1')
+        assert cache.get('AI073685') == ['record_a', 'record_b'], \
+            "Cached record IDs should be reloaded deduplicated and sorted"
+        assert cache.get('AI123456') is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        writer = OutputWriter(temp_dir)
+        cache.save(writer)
+        assert not writer.state_changed, \
+            "A cache with no new searches should not be rewritten"
+
+        for build_version, search_mode in [('v2', 'wildcard'),
+                                           ('v1', 'wildcard+index')]:
+            evicted = SearchCache.load(cache_file, build_version, search_mode)
+            assert evicted.get('AI073685') is None, \
+                f"The cache should be evicted for {build_version} " \
+                f"{search_mode}"
+
+        evicted = SearchCache.load(cache_file, 'v2')
+        evicted.save()
+        with open(cache_file) as f:
+            data = json.load(f)
+        assert (data['build_version'], data['queries']) == ('v2', {}), \
+            "Saving an evicted cache should drop the old build's entries"
+
+        print("✓ Reused searches of the same build and evicted older builds")
+
+    return True
+
+
 def run_all_tests():
     """Run all tests"""
     tests = [
         ("Configuration Loading", test_configuration_loading),
         ("Data Download", test_data_download),
+        ("Program Rows", test_program_rows),
         ("Grant Parsing", test_grant_parsing),
         ("Search Functionality", test_search_functionality),
+        ("Mock API Search", test_mock_api_search),
+        ("Funding Index Identifier Shapes", test_funding_index_identifier_shapes),
+        ("Funding Index Lookup Cost", test_funding_index_lookup_cost),
         ("File Generation", test_file_generation),
+        ("Output Writer", test_output_writer),
+        ("Generation Manifest", test_generation_manifest),
+        ("Incremental Generation", test_incremental_generation),
+        ("Forced Runs Stay Incremental", test_forced_runs_stay_incremental),
+        ("Worker Log Order", test_worker_log_order),
+        ("Search Cache", test_search_cache),
     ]
 
     passed = 0
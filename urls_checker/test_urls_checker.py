@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Test script for the URL monitor
+
+Exercises the scheduling, body matching, retry, revalidation, history and
+timing helpers against in-memory fakes, without network access or the
+Google Sheet.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import urls_checker
+from url_history import UrlHistory
+
+
+class FakeContent:
+    """Stands in for aiohttp's StreamReader, counting the bytes read"""
+
+    def __init__(self, body):
+        self.body = body
+        self.read_bytes = 0
+
+    async def read(self, n):
+        chunk, self.body = self.body[:n], self.body[n:]
+        self.read_bytes += len(chunk)
+        return chunk
+
+
+class FakeResponse:
+    def __init__(self, status=200, body=b"", headers=None, url="https://example.org/"):
+        self.status = status
+        self.content = FakeContent(body)
+        self.headers = headers or {}
+        self.charset = "utf-8"
+        self.url = url
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """Answers each request with the next response of a list"""
+
+    def __init__(self, responses, timings=None):
+        self.responses = list(responses)
+        self.requests = []
+        self.timings = timings or {}
+
+    def get(self, url, headers=None, timeout=None, trace_request_ctx=None):
+        self.requests.append(dict(headers or {}))
+        if trace_request_ctx is not None:
+            trace_request_ctx.update(self.timings)
+        return self.responses.pop(0)
+
+
+def test_interleave_by_host():
+    """Test that rows are ordered round-robin across hosts"""
+    rows = [{"URL": url} for url in [
+        "https://a.org/1", "https://a.org/2", "https://a.org/3",
+        "https://b.org/1", "https://c.org/1", "https://b.org/2",
+    ]]
+    ordered = [row["URL"] for row in urls_checker.interleave_by_host(rows)]
+
+    assert ordered == [
+        "https://a.org/1", "https://b.org/1", "https://c.org/1",
+        "https://a.org/2", "https://b.org/2", "https://a.org/3",
+    ], f"Unexpected order: {ordered}"
+    assert sorted(ordered) == sorted(row["URL"] for row in rows), "No row should be lost"
+
+    print(f"✓ Interleaved {len(rows)} rows across 3 hosts")
+    return True
+
+
+def test_host_limiter():
+    """Test the global and per-host caps of HostLimiter"""
+    limiter = urls_checker.HostLimiter(max_requests=3, max_per_host=2)
+    active = {"total": 0}
+    peaks = {"total": 0}
+
+    async def request(url):
+        host = urls_checker.url_host(url)
+        async with limiter.slot(url):
+            active["total"] += 1
+            active[host] = active.get(host, 0) + 1
+            peaks["total"] = max(peaks["total"], active["total"])
+            peaks[host] = max(peaks.get(host, 0), active[host])
+            await asyncio.sleep(0.01)
+            active["total"] -= 1
+            active[host] -= 1
+
+    async def run():
+        # Grouped by host, so the per-host cap has to hold back the first host
+        urls = [f"https://{host}.org/{n}" for host in "abc" for n in range(5)]
+        await asyncio.gather(*(request(url) for url in urls))
+
+    asyncio.run(run())
+
+    assert peaks["total"] == 3, f"Global cap not reached or exceeded: {peaks}"
+    assert peaks["a.org"] == 2, f"Per-host cap not reached: {peaks}"
+    for host in ["a.org", "b.org", "c.org"]:
+        assert peaks[host] <= 2, f"Per-host cap exceeded for {host}: {peaks}"
+
+    print(f"✓ Peak concurrency {peaks['total']}, per host {max(peaks[h] for h in ['a.org', 'b.org', 'c.org'])}")
+    return True
+
+
+def test_body_contains():
+    """Test streaming body matching at chunk boundaries and the byte cap"""
+    body = b"x" * 100 + b"needle" + b"y" * 100
+
+    # The marker straddles every chunk boundary position
+    for chunk_size in range(1, 10):
+        found, _ = asyncio.run(urls_checker.body_contains(FakeResponse(body=body), "needle", chunk_size=chunk_size))
+        assert found, f"Marker split across {chunk_size}-byte chunks not found"
+
+    response = FakeResponse(body=body)
+    found, bytes_read = asyncio.run(urls_checker.body_contains(response, "needle", chunk_size=16))
+    assert found and bytes_read < len(body), "Reading should stop at the match"
+    assert bytes_read == response.content.read_bytes, "Bytes read should be reported"
+
+    response = FakeResponse(body=body)
+    found, bytes_read = asyncio.run(urls_checker.body_contains(response, "needle", max_bytes=50, chunk_size=16))
+    assert not found and bytes_read == 50, "Reading should stop at max_bytes"
+
+    found, bytes_read = asyncio.run(urls_checker.body_contains(FakeResponse(body=body), ""))
+    assert found and bytes_read == 0, "Empty expected content should pass without reading"
+
+    found, _ = asyncio.run(urls_checker.body_contains(FakeResponse(body=b"short"), "needle"))
+    assert not found, "Missing content should fail at the end of the body"
+
+    print("✓ Matched across chunk boundaries, stopped at the match and at the cap")
+    return True
+
+
+def test_retry_after():
+    """Test that a 429 is retried after its Retry-After wait"""
+    assert urls_checker.retry_after_seconds("2") == 2.0
+    assert urls_checker.retry_after_seconds("-5") == 0.0
+    assert urls_checker.retry_after_seconds(str(10 * urls_checker.MAX_RETRY_AFTER)) == urls_checker.MAX_RETRY_AFTER
+    assert urls_checker.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+    session = FakeSession([
+        FakeResponse(429, headers={"Retry-After": "0"}),
+        FakeResponse(200, body=b"hello world"),
+    ])
+    result = asyncio.run(urls_checker.test_url(session, "https://example.org/", 200, "hello"))
+
+    assert result["code_passed"] and result["content_passed"], f"Retry should pass: {result}"
+    assert result["attempts"] == 2, "The throttled attempt should be counted"
+    assert len(session.requests) == 2
+
+    # A 429 that is expected is not retried
+    session = FakeSession([FakeResponse(429, headers={"Retry-After": "0"})])
+    result = asyncio.run(urls_checker.test_url(session, "https://example.org/", 429, ""))
+    assert result["code_passed"] and result["attempts"] == 1
+
+    print("✓ Retried a throttled request and passed on the second attempt")
+    return True
+
+
+def test_not_modified_reuse():
+    """Test conditional revalidation and reuse of the last verdict"""
+    validators = {}
+    url = "https://example.org/page"
+
+    session = FakeSession([FakeResponse(200, body=b"hello world", headers={"ETag": '"v1"'})])
+    first = asyncio.run(urls_checker.test_url(session, url, 200, "hello", validators=validators))
+    assert "If-None-Match" not in session.requests[0], "First request should not be conditional"
+    assert validators[url]["etag"] == '"v1"' and validators[url]["content_passed"]
+
+    session = FakeSession([FakeResponse(304)])
+    second = asyncio.run(urls_checker.test_url(session, url, 200, "hello", validators=validators))
+    assert session.requests[0]["If-None-Match"] == '"v1"', "Second request should send the ETag"
+    assert second["not_modified"] and second["bytes_read"] == 0
+    assert (second["code_passed"], second["content_passed"], second["status_code"]) == \
+        (first["code_passed"], first["content_passed"], first["status_code"]), "The verdict should be reused"
+
+    # A different expected text invalidates the cached verdict
+    session = FakeSession([FakeResponse(200, body=b"hello world", headers={"ETag": '"v1"'})])
+    asyncio.run(urls_checker.test_url(session, url, 200, "other", validators=validators))
+    assert "If-None-Match" not in session.requests[0], "A changed expectation should not revalidate"
+
+    print("✓ Reused the verdict of a 304 and revalidated only unchanged expectations")
+    return True
+
+
+def test_url_history():
+    """Test failure state, notification and import in UrlHistory"""
+    now = datetime.now()
+    long_ago = (now - timedelta(minutes=urls_checker.FAILURE_THRESHOLD_MINUTES + 60)).isoformat()
+
+    def check(url, passed):
+        return {"url": url, "code_passed": passed, "content_passed": True,
+                "status_code": 200 if passed else 500, "latency_ms": 10.0, "bytes_read": 1}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        status_file = os.path.join(temp_dir, "url_status.json")
+        with open(status_file, "w") as f:
+            json.dump({
+                "https://old.org/": {"fail_count": 9, "last_fail_time": long_ago, "notified": False},
+                "https://ok.org/": {"fail_count": 0, "last_fail_time": None, "notified": False},
+            }, f)
+
+        with UrlHistory(os.path.join(temp_dir, "url_history.db")) as history:
+            assert history.import_status_file(status_file) == 1, "Only failing URLs should be imported"
+
+            history.record_results([check("https://old.org/", False), check("https://new.org/", False),
+                                    check("https://ok.org/", True)])
+            assert history.import_status_file(status_file) == 0, "A used database should not import again"
+
+            overdue = history.failing_longer_than(urls_checker.FAILURE_THRESHOLD_MINUTES, now=now)
+            assert overdue == {"https://old.org/"}, f"Only the old failure is overdue: {overdue}"
+
+            history.mark_notified(overdue)
+            assert not history.failing_longer_than(urls_checker.FAILURE_THRESHOLD_MINUTES, now=now), \
+                "A notified failure should not be reported again"
+
+            history.record_results([check("https://old.org/", True)])
+            state = dict(history.conn.execute("SELECT url, fail_count FROM url_state"))
+            assert state == {"https://new.org/": 1}, f"A recovered URL should lose its state: {state}"
+
+            assert history.uptime("https://old.org/") == 0.5
+            assert history.latency_percentiles("https://old.org/")[50] == 10.0
+            assert history.uptime("https://unknown.org/") is None
+
+    print("✓ Imported, reported once, and cleared failure state on recovery")
+    return True
+
+
+def test_slow_url_report():
+    """Test that a URL slow for several checks is reported once on its own"""
+    def check(url, latency_ms):
+        return {"url": url, "code_passed": True, "content_passed": True, "status_code": 200,
+                "latency_ms": latency_ms, "bytes_read": 1, "ttfb_ms": None, "dns_ms": None, "connect_ms": None}
+
+    slow_ms = urls_checker.SLOW_URL_MS
+    slow_url, fast_url = "https://slow.org/", "https://fast.org/"
+
+    def run(history, latency_ms):
+        results = [check(slow_url, latency_ms), check(fast_url, 10.0)]
+        history.record_results(results, slow_ms=slow_ms)
+        return urls_checker.generate_slack_report(results, history)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with UrlHistory(os.path.join(temp_dir, "url_history.db")) as history:
+            sent = [run(history, 2 * slow_ms)[0] for _ in range(urls_checker.SLOW_URL_CHECKS - 1)]
+            assert not any(sent), "A URL should be slow for several checks before it is reported"
+
+            send, message = run(history, 2 * slow_ms)
+            text = json.dumps(message)
+            assert send, "A slow URL should trigger a report without any failure"
+            assert ":large_yellow_circle:" in text and slow_url in text and fast_url not in text
+
+            assert not run(history, 2 * slow_ms)[0], "A reported slow URL should not be reported again"
+
+            # A fast check ends the streak, so a new one is reported again
+            run(history, 10.0)
+            sent = [run(history, 2 * slow_ms)[0] for _ in range(urls_checker.SLOW_URL_CHECKS)]
+            assert sent[-1] and not any(sent[:-1]), f"A new slow streak should be reported once: {sent}"
+
+    print(f"✓ Reported a URL slow for {urls_checker.SLOW_URL_CHECKS} checks once per streak")
+    return True
+
+
+def test_timing_fields():
+    """Test the trace hooks and the timing fields of a result"""
+    trace_config = urls_checker.timing_trace_config()
+    timings = {}
+    ctx = SimpleNamespace(trace_request_ctx=timings)
+
+    async def fire(signal):
+        for handler in signal:
+            await handler(None, ctx, None)
+
+    async def run():
+        await fire(trace_config.on_request_start)
+        await fire(trace_config.on_dns_resolvehost_start)
+        await asyncio.sleep(0.01)
+        await fire(trace_config.on_dns_resolvehost_end)
+        await fire(trace_config.on_connection_create_start)
+        await fire(trace_config.on_connection_create_end)
+        await fire(trace_config.on_request_end)
+
+    asyncio.run(run())
+    assert timings["dns_ms"] >= 10 * 0.9, f"DNS time not recorded: {timings}"
+    assert timings["ttfb_ms"] >= timings["dns_ms"] + timings["connect_ms"], "TTFB should include DNS and connect"
+
+    session = FakeSession([FakeResponse(200, body=b"hello world")],
+                          timings={"dns_ms": 1.0, "connect_ms": 2.0, "ttfb_ms": 3.0})
+    result = asyncio.run(urls_checker.test_url(session, "https://example.org/", 200, "hello"))
+    assert (result["dns_ms"], result["connect_ms"], result["ttfb_ms"]) == (1.0, 2.0, 3.0)
+    assert result["attempts"] == 1 and result["bytes_read"] == len(b"hello world")
+    assert result["latency_ms"] is not None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        metrics_file = urls_checker.METRICS_FILE
+        urls_checker.METRICS_FILE = os.path.join(temp_dir, "url_metrics.json")
+        try:
+            urls_checker.save_metrics([result])
+            with open(urls_checker.METRICS_FILE) as f:
+                saved = json.load(f)
+        finally:
+            urls_checker.METRICS_FILE = metrics_file
+    assert saved["results"][0]["ttfb_ms"] == 3.0, "Timings should be written to the metrics file"
+
+    print(f"✓ Recorded DNS {timings['dns_ms']:.1f} ms and TTFB {timings['ttfb_ms']:.1f} ms")
+    return True
+
+
+def run_all_tests():
+    """Run all tests"""
+    tests = [
+        ("Interleave By Host", test_interleave_by_host),
+        ("Host Limiter", test_host_limiter),
+        ("Body Contains", test_body_contains),
+        ("Retry After", test_retry_after),
+        ("Not Modified Reuse", test_not_modified_reuse),
+        ("URL History", test_url_history),
+        ("Slow URL Report", test_slow_url_report),
+        ("Timing Fields", test_timing_fields),
+    ]
+
+    passed = 0
+    failed = 0
+
+    print("=" * 60)
+    print("URL MONITOR TEST SUITE")
+    print("=" * 60)
+
+    for test_name, test_func in tests:
+        print(f"\n{test_name}:")
+        print("-" * 40)
+
+        try:
+            result = test_func()
+            if result:
+                print(f"✅ {test_name} PASSED")
+                passed += 1
+            else:
+                print(f"❌ {test_name} FAILED")
+                failed += 1
+        except Exception as e:
+            print(f"❌ {test_name} FAILED: {e}")
+            failed += 1
+
+    print("\n" + "=" * 60)
+    print(f"TEST RESULTS: {passed} passed, {failed} failed")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == '__main__':
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    checked_at TEXT NOT NULL,
+    status_code INTEGER,
+    latency_ms REAL,
+    bytes_read INTEGER,
+    passed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checks_by_url ON checks (url, checked_at);
+CREATE INDEX IF NOT EXISTS checks_by_time ON checks (checked_at);
+CREATE INDEX IF NOT EXISTS checks_by_latency ON checks (url, latency_ms, checked_at);
+
+CREATE TABLE IF NOT EXISTS url_state (
+    url TEXT PRIMARY KEY,
+    fail_count INTEGER NOT NULL DEFAULT 0,
+    last_fail_time TEXT,
+    notified INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS url_state_failing ON url_state (last_fail_time)
+    WHERE last_fail_time IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS slow_state (
+    url TEXT PRIMARY KEY,
+    slow_count INTEGER NOT NULL DEFAULT 0,
+    slow_since TEXT NOT NULL,
+    notified INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class UrlHistory:
+    """SQLite store of every URL check and the current failure state of each URL.
+
+    `checks` is append-only: one row per check with its status, latency, bytes
+    read and verdict. `url_state` only holds URLs that are failing or were
+    failing at their last check, and `slow_state` only holds URLs whose
+    consecutive latest checks passed slowly, so a run only writes the rows
+    whose state changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def import_status_file(self, status_file):
+        """Import the failure state of an old url_status.json into a new database."""
+        if not os.path.exists(status_file):
+            return 0
+        if self.conn.execute("SELECT 1 FROM checks LIMIT 1").fetchone():
+            return 0
+
+        with open(status_file, "r") as f:
+            status = json.load(f)
+
+        rows = [
+            (url, entry.get("fail_count", 0), entry.get("last_fail_time"), int(bool(entry.get("notified"))))
+            for url, entry in status.items()
+            if entry.get("fail_count") or entry.get("last_fail_time")
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO url_state (url, fail_count, last_fail_time, notified) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        logging.info(f"Imported the failure state of {len(rows)} URLs from {status_file}")
+        return len(rows)
+
+    def record_results(self, results, checked_at=None, slow_ms=None):
+        """Append the checks of a run and update the state of changed URLs.
+
+        Passing checks slower than `slow_ms` extend the slow streak of their
+        URL; any other check ends it.
+        """
+        checked_at = checked_at or datetime.now().isoformat()
+        checks = []
+        passed = []
+        failed = []
+        slow = []
+        for r in results:
+            ok = bool(r["code_passed"] and r["content_passed"])
+            checks.append((r["url"], checked_at, r["status_code"], r.get("latency_ms"), r.get("bytes_read"), int(ok)))
+            (passed if ok else failed).append(r["url"])
+            if ok and slow_ms is not None and (r.get("latency_ms") or 0) > slow_ms:
+                slow.append(r["url"])
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO checks (url, checked_at, status_code, latency_ms, bytes_read, passed) VALUES (?, ?, ?, ?, ?, ?)",
+                checks,
+            )
+            # A passing URL has no state, so only the URLs that recovered
+            # since their last check have a row to delete
+            failing = {url for (url,) in self.conn.execute("SELECT url FROM url_state")}
+            recovered = [url for url in passed if url in failing]
+            self.conn.executemany("DELETE FROM url_state WHERE url = ?", [(url,) for url in recovered])
+            self.conn.executemany(
+                "INSERT INTO url_state (url, fail_count, last_fail_time, notified) VALUES (?, 1, ?, 0) "
+                "ON CONFLICT (url) DO UPDATE SET fail_count = fail_count + 1",
+                [(url, checked_at) for url in failed],
+            )
+
+            slow_urls = set(slow)
+            streaks = {url for (url,) in self.conn.execute("SELECT url FROM slow_state")}
+            ended = [url for url in passed + failed if url in streaks and url not in slow_urls]
+            self.conn.executemany("DELETE FROM slow_state WHERE url = ?", [(url,) for url in ended])
+            self.conn.executemany(
+                "INSERT INTO slow_state (url, slow_count, slow_since, notified) VALUES (?, 1, ?, 0) "
+                "ON CONFLICT (url) DO UPDATE SET slow_count = slow_count + 1",
+                [(url, checked_at) for url in slow],
+            )
+
+    def failing_longer_than(self, minutes, now=None):
+        """Return the URLs failing for more than `minutes` that were not notified yet."""
+        cutoff = ((now or datetime.now()) - timedelta(minutes=minutes)).isoformat()
+        rows = self.conn.execute(
+            "SELECT url FROM url_state WHERE last_fail_time IS NOT NULL AND last_fail_time < ? AND notified = 0",
+            (cutoff,),
+        )
+        return {url for (url,) in rows}
+
+    def mark_notified(self, urls):
+        """Record that a failure of these URLs was reported."""
+        with self.conn:
+            self.conn.executemany("UPDATE url_state SET notified = 1 WHERE url = ?", [(url,) for url in urls])
+
+    def slow_for_checks(self, checks):
+        """Return the URLs slow for at least `checks` checks in a row that were not notified yet."""
+        rows = self.conn.execute(
+            "SELECT url FROM slow_state WHERE slow_count >= ? AND notified = 0",
+            (checks,),
+        )
+        return {url for (url,) in rows}
+
+    def mark_slow_notified(self, urls):
+        """Record that the slowness of these URLs was reported."""
+        with self.conn:
+            self.conn.executemany("UPDATE slow_state SET notified = 1 WHERE url = ?", [(url,) for url in urls])
+
+    def uptime(self, url, since=None):
+        """Return the share of passed checks of a URL, or None without checks."""
+        (share,) = self.conn.execute(
+            "SELECT AVG(passed) FROM checks WHERE url = ? AND checked_at >= ?",
+            (url, since or ""),
+        ).fetchone()
+        return share
+
+    def latency_percentiles(self, url, percentiles=(50, 90, 99), since=None):
+        """Return the latency percentiles of a URL's checks, in milliseconds.
+
+        Each percentile is read with LIMIT 1 OFFSET from the checks_by_latency
+        index, which holds each URL's checks in latency order, so no latency
+        list is loaded into Python however long the history grows.
+        """
+        since = since or ""
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM checks WHERE url = ? AND latency_ms IS NOT NULL AND checked_at >= ?",
+            (url, since),
+        ).fetchone()
+        if not count:
+            return {}
+        return {
+            p: self.conn.execute(
+                "SELECT latency_ms FROM checks WHERE url = ? AND latency_ms IS NOT NULL AND checked_at >= ? "
+                "ORDER BY latency_ms LIMIT 1 OFFSET ?",
+                (url, since, min(count - 1, int(count * p / 100))),
+            ).fetchone()[0]
+            for p in percentiles
+        }
+
+    def prune(self, days):
+        """Delete checks older than `days`."""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self.conn:
+            deleted = self.conn.execute("DELETE FROM checks WHERE checked_at < ?", (cutoff,)).rowcount
+        if deleted:
+            logging.info(f"Pruned {deleted} checks older than {days} days")
+        return deleted
@@ -3,13 +3,17 @@
 import aiohttp
 import asyncio
 import gspread
+import itertools
 import urllib.parse
 import json
 import os
 import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from dotenv import load_dotenv
 from pathlib import Path
+from url_history import UrlHistory
 
 
 logging.basicConfig(
@@ -24,24 +28,55 @@ load_dotenv(dotenv_path=Path("secrets.env"))  # Loads from .env by default
 GOOGLE_SHEET_URL = os.getenv("GOOGLE_SHEET_URL")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
 
-STATUS_FILE = "url_status.json"
+STATUS_FILE = "url_status.json"  # Imported into the history database once
+HISTORY_DB = "url_history.db"
+HISTORY_RETENTION_DAYS = 365
+VALIDATORS_FILE = "url_validators.json"
+METRICS_FILE = "url_metrics.json"
 FAILURE_THRESHOLD_MINUTES = 4320  # 3 days
 
+# Passing URLs slower than this for SLOW_URL_CHECKS checks in a row are
+# reported once, until they speed up or fail
+SLOW_URL_MS = int(os.getenv("SLOW_URL_MS", "5000"))
+SLOW_URL_CHECKS = int(os.getenv("SLOW_URL_CHECKS", "3"))
+MAX_SLOW_URLS = 10
 
-def load_status():
-    """Load the status file containing previous URL test results."""
-    logging.info("Loading status from file...")
-    if os.path.exists(STATUS_FILE):
-        with open(STATUS_FILE, "r") as f:
-            return json.load(f)
-    logging.info("No status file found, starting fresh.")
+# Requests in flight at once, overall and per host
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "50"))
+MAX_REQUESTS_PER_HOST = int(os.getenv("MAX_REQUESTS_PER_HOST", "4"))
+MAX_RETRY_AFTER = 60  # seconds
+
+# Bytes of a response body searched for the expected content
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(5 * 1024 * 1024)))
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def load_validators():
+    """Load the ETag/Last-Modified validators and verdicts of the last run."""
+    if os.path.exists(VALIDATORS_FILE):
+        try:
+            with open(VALIDATORS_FILE, "r") as f:
+                return json.load(f)
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable validator cache: {e}")
     return {}
 
-def save_status(status):
-    """Save the updated URL status to the JSON file."""
-    logging.info("Saving updated status to file...")
-    with open(STATUS_FILE, "w") as f:
-        json.dump(status, f, indent=4)
+def save_validators(validators):
+    """Save the URL validators to the JSON file."""
+    logging.info("Saving URL validators to file...")
+    with open(VALIDATORS_FILE, "w") as f:
+        json.dump(validators, f, indent=4)
+
+def save_metrics(results):
+    """Save the timings of every check to the metrics file."""
+    logging.info("Saving URL metrics to file...")
+    metrics = {
+        "generated_at": datetime.now().isoformat(),
+        "slow_url_ms": SLOW_URL_MS,
+        "results": results,
+    }
+    with open(METRICS_FILE, "w") as f:
+        json.dump(metrics, f, indent=4)
 
 async def fetch_google_sheet_data(sheet_url):
     """Fetch data from the first tab of the Google Sheet."""
@@ -63,8 +98,173 @@ def is_valid_url(url):
     except ValueError:
         return False
 
-async def test_url(session, url, expected_code, expected_content, status, retries=4, backoff_factor=2):
-    """Test URL and update the failure count in the status file."""
+def url_host(url):
+    """Return the lowercased host of a URL, or an empty string."""
+    try:
+        return urllib.parse.urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+
+def interleave_by_host(rows):
+    """Order rows round-robin across hosts so no host gets a burst of requests."""
+    by_host = {}
+    for row in rows:
+        by_host.setdefault(url_host(row["URL"]), []).append(row)
+    return [row for group in itertools.zip_longest(*by_host.values())
+            for row in group if row is not None]
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header given in seconds."""
+    try:
+        return min(max(float(value), 0.0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return None
+
+async def body_contains(response, expected_content, max_bytes=MAX_BODY_BYTES, chunk_size=BODY_CHUNK_SIZE):
+    """Stream a response body until the expected content is found.
+
+    The body is read in chunks and searched as bytes, keeping the end of the
+    previous chunk so a marker split across chunks is still found. Reading
+    stops at the first match or after max_bytes. Returns whether the content
+    was found and the number of bytes read.
+    """
+    expected = str(expected_content)
+    if not expected:
+        return True, 0
+
+    try:
+        marker = expected.encode(response.charset or "utf-8")
+    except (LookupError, UnicodeEncodeError):
+        marker = expected.encode("utf-8")
+
+    overlap = len(marker) - 1
+    tail = b""
+    bytes_read = 0
+    while bytes_read < max_bytes:
+        chunk = await response.content.read(min(chunk_size, max_bytes - bytes_read))
+        if not chunk:
+            return False, bytes_read
+        bytes_read += len(chunk)
+        window = tail + chunk
+        if marker in window:
+            return True, bytes_read
+        tail = window[-overlap:] if overlap else b""
+
+    logging.info(f"Expected content not found in the first {max_bytes} bytes of {response.url}")
+    return False, bytes_read
+
+def timing_trace_config():
+    """Build a TraceConfig recording the DNS, connect and TTFB times of requests.
+
+    Timings are written in milliseconds to the dict passed to the request as
+    trace_request_ctx. DNS and connect times add up over redirects and are 0
+    for cached lookups and reused connections. TTFB is measured from the start
+    of the request to the response headers.
+    """
+    def elapsed(start):
+        return (time.perf_counter() - start) * 1000
+
+    def add(ctx, key, value):
+        timings = ctx.trace_request_ctx
+        if timings is not None:
+            timings[key] = timings.get(key, 0.0) + value
+
+    async def on_request_start(session, ctx, params):
+        ctx.request_start = time.perf_counter()
+
+    async def on_dns_resolvehost_start(session, ctx, params):
+        ctx.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, ctx, params):
+        add(ctx, "dns_ms", elapsed(ctx.dns_start))
+
+    async def on_dns_cache_hit(session, ctx, params):
+        add(ctx, "dns_ms", 0.0)
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        add(ctx, "connect_ms", elapsed(ctx.connect_start))
+
+    async def on_connection_reuseconn(session, ctx, params):
+        add(ctx, "connect_ms", 0.0)
+
+    async def on_request_end(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx["ttfb_ms"] = elapsed(ctx.request_start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+class HostLimiter:
+    """Caps the requests in flight overall and for each host."""
+
+    def __init__(self, max_requests=MAX_CONCURRENT_REQUESTS, max_per_host=MAX_REQUESTS_PER_HOST):
+        self.max_per_host = max(1, max_per_host)
+        self.requests = asyncio.Semaphore(max(1, max_requests))
+        self.hosts = {}
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Wait for a free slot on the URL's host, then for a global one."""
+        host = url_host(url)
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.max_per_host)
+        # The host slot is taken first so requests queued behind a busy
+        # host never hold global slots other hosts could use
+        async with self.hosts[host]:
+            async with self.requests:
+                yield
+
+def cached_validator(validators, url, expected_content):
+    """Return the URL's validator entry if its verdict is for this expected content."""
+    entry = (validators or {}).get(url)
+    if entry and entry.get("expected_content") == str(expected_content):
+        return entry
+    return None
+
+def conditional_headers(entry):
+    """Build If-None-Match/If-Modified-Since headers from a validator entry."""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def update_validator(validators, url, response, expected_content, result):
+    """Remember a response's validators and verdict for the next run."""
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if 200 <= response.status < 300 and (etag or last_modified):
+        validators[url] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "expected_content": str(expected_content),
+            "status_code": result["status_code"],
+            "content_passed": result["content_passed"],
+        }
+    else:
+        validators.pop(url, None)
+
+async def test_url(session, url, expected_code, expected_content, retries=4, backoff_factor=2, limiter=None, validators=None):
+    """Test URL, timing the request and counting the body bytes read.
+
+    The result holds the attempts made and, for the last attempt, its total
+    latency and the DNS/connect/TTFB times recorded by timing_trace_config,
+    when the session has it. With a validators dict, the request is made conditional on the last
+    run's ETag/Last-Modified, and a 304 reuses that run's verdict.
+    """
     logging.info(f"Testing URL: {url}")
     result = {
         "url": url,
@@ -72,6 +272,13 @@ async def test_url(session, url, expected_code, expected_content, status, retrie
         "content_passed": False,
         "valid": False,
         "status_code": None,
+        "not_modified": False,
+        "attempts": 0,
+        "latency_ms": None,
+        "dns_ms": None,
+        "connect_ms": None,
+        "ttfb_ms": None,
+        "bytes_read": 0,
     }
 
     headers = {
@@ -86,16 +293,45 @@ async def test_url(session, url, expected_code, expected_content, status, retrie
         logging.warning(f"Invalid URL: {url}")
         return result
 
+    limiter = limiter or HostLimiter(1, 1)
+    cached = cached_validator(validators, url, expected_content) if expected_code != 304 else None
+    headers.update(conditional_headers(cached))
+
     for attempt in range(retries):
+        result["attempts"] = attempt + 1
+        timings = {}
         try:
-            async with session.get(url, headers=headers, timeout=10) as response:
-                result["valid"] = True
-                result["status_code"] = response.status
-                result["code_passed"] = (response.status == expected_code)
-                body = await response.text()
-                result["content_passed"] = str(expected_content) in body
-                logging.info(f"Attempt {attempt+1} succeeded for {url} (status {response.status})")
-                break
+            async with limiter.slot(url):
+                started = time.perf_counter()
+                async with session.get(url, headers=headers, timeout=10, trace_request_ctx=timings) as response:
+                    wait_time = retry_after_seconds(response.headers.get("Retry-After"))
+                    if response.status == 429 and attempt < retries - 1 and expected_code != 429:
+                        # Throttled: wait outside the slot instead of failing
+                        wait_time = wait_time if wait_time is not None else backoff_factor ** attempt
+                        logging.info(f"Throttled by {url_host(url)}, retrying {url} in {wait_time:.2f} seconds...")
+                    elif response.status == 304 and cached:
+                        # Unchanged since the last run: reuse its verdict
+                        result["valid"] = True
+                        result["not_modified"] = True
+                        result["status_code"] = cached["status_code"]
+                        result["code_passed"] = (cached["status_code"] == expected_code)
+                        result["content_passed"] = cached["content_passed"]
+                        result["latency_ms"] = (time.perf_counter() - started) * 1000
+                        result.update(timings)
+                        logging.info(f"Attempt {attempt+1} succeeded for {url} (not modified)")
+                        break
+                    else:
+                        result["valid"] = True
+                        result["status_code"] = response.status
+                        result["code_passed"] = (response.status == expected_code)
+                        result["content_passed"], result["bytes_read"] = await body_contains(response, expected_content)
+                        result["latency_ms"] = (time.perf_counter() - started) * 1000
+                        result.update(timings)
+                        if validators is not None:
+                            update_validator(validators, url, response, expected_content, result)
+                        logging.info(f"Attempt {attempt+1} succeeded for {url} (status {response.status})")
+                        break
+            await asyncio.sleep(wait_time)
         except Exception as e:
             logging.warning(f"Error testing {url} (attempt {attempt+1}): {e}")
             if attempt < retries - 1:
@@ -105,23 +341,29 @@ async def test_url(session, url, expected_code, expected_content, status, retrie
             else:
                 logging.error(f"Max retries reached for {url}")
 
-    url_entry = status.get(url, {"fail_count": 0, "last_fail_time": None, "notified": False})
     if result["code_passed"] and result["content_passed"]:
         logging.info(f"Test passed for {url}")
-        url_entry["fail_count"] = 0  # Reset failure count on success
-        url_entry["last_fail_time"] = None
-        url_entry["notified"] = False
     else:
         logging.info(f"Test failed for {url}")
-        url_entry["fail_count"] += 1
-        if url_entry["last_fail_time"] is None:
-            url_entry["last_fail_time"] = datetime.now().isoformat()
-
-    status[url] = url_entry
     return result
 
-def generate_slack_report(results, status):
-    """Generate a Slack message based on the test results."""
+def format_timings(result):
+    """Describe a check's latency and its phases in seconds."""
+    phases = [f"{name} {result[key] / 1000:.1f} s" for name, key in (("TTFB", "ttfb_ms"), ("DNS", "dns_ms"), ("connect", "connect_ms")) if result[key] is not None]
+    text = f"{result['latency_ms'] / 1000:.1f} s"
+    if phases:
+        text += f" ({', '.join(phases)})"
+    return text
+
+def generate_slack_report(results, history):
+    """Generate a Slack message based on the test results.
+
+    URLs failing for longer than FAILURE_THRESHOLD_MINUTES are reported once
+    per failure episode and marked as notified in the history. Passing URLs
+    slower than SLOW_URL_MS for SLOW_URL_CHECKS checks in a row are reported
+    once per slow streak the same way, slowest first, in the failure report
+    or in a report of their own.
+    """
     logging.info("Generating Slack report...")
     total = len(results)
     failed = [
@@ -129,21 +371,19 @@ def generate_slack_report(results, status):
         for r in results if (not r['code_passed'] or not r['content_passed'])
     ]
 
-    now = datetime.now()
-    truly_failing = []
-    for entry in failed:
-        url = entry["url"]
-        status_entry = status.get(url, {})
-        last_fail_time = status_entry.get("last_fail_time")
-        if last_fail_time:
-            fail_duration = (now - datetime.fromisoformat(last_fail_time)).total_seconds() / 60
-            if fail_duration > FAILURE_THRESHOLD_MINUTES:
-                if not status_entry.get("notified", False):
-                    truly_failing.append(entry)
-                    status_entry["notified"] = True
-                # status[url] = status_entry
-
-    logging.info(f"Total URLs: {total}, Failing beyond threshold: {len(truly_failing)}")
+    overdue = history.failing_longer_than(FAILURE_THRESHOLD_MINUTES)
+    truly_failing = [entry for entry in failed if entry["url"] in overdue]
+    history.mark_notified(entry["url"] for entry in truly_failing)
+
+    slow_overdue = history.slow_for_checks(SLOW_URL_CHECKS)
+    slow = sorted(
+        (r for r in results if r["url"] in slow_overdue and r["code_passed"] and r["content_passed"]),
+        key=lambda r: r["latency_ms"],
+        reverse=True,
+    )
+    history.mark_slow_notified(r["url"] for r in slow)
+
+    logging.info(f"Total URLs: {total}, Failing beyond threshold: {len(truly_failing)}, Slow: {len(slow)}")
 
     message = {
         "blocks": [
@@ -168,9 +408,21 @@ def generate_slack_report(results, status):
                 str_error += "❌ Body mismatch"
 
             message["blocks"].append({"type": "section", "text": {"type": "mrkdwn", "text": f"• <{entry['url']}|{entry['url']}> {str_error}"}})
-        return True, message
-    else:
-        return False, message
+    elif slow:
+        message = {
+            "blocks": [
+                {"type": "section", "text": {"type": "mrkdwn", "text": f":large_yellow_circle: *NDE URL Test Report*\nTotal URLs tested: *{total}*\nFailed: *0*\nSlow: *{len(slow)}*"}},
+            ]
+        }
+
+    if slow:
+        message["blocks"].append({"type": "section", "text": {"type": "mrkdwn", "text": f"*Slow URLs (over {SLOW_URL_MS / 1000:g} s for {SLOW_URL_CHECKS} checks):*"}})
+        for r in slow[:MAX_SLOW_URLS]:
+            message["blocks"].append({"type": "section", "text": {"type": "mrkdwn", "text": f"• <{r['url']}|{r['url']}> ⏱ {format_timings(r)}"}})
+        if len(slow) > MAX_SLOW_URLS:
+            message["blocks"].append({"type": "section", "text": {"type": "mrkdwn", "text": f"…and {len(slow) - MAX_SLOW_URLS} more in `{METRICS_FILE}`"}})
+
+    return bool(truly_failing or slow), message
 
 async def send_to_slack(webhook_url, message):
     """Send the message to Slack using the webhook URL."""
@@ -182,6 +434,31 @@ async def send_to_slack(webhook_url, message):
     except Exception as e:
         logging.error(f"Error sending message to Slack: {e}")
 
+async def run_url_tests(rows, validators=None):
+    """Test every row's URL with global and per-host concurrency limits.
+
+    Requests are started round-robin across hosts and results are returned
+    in sheet order.
+    """
+    limiter = HostLimiter(MAX_CONCURRENT_REQUESTS, MAX_REQUESTS_PER_HOST)
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENT_REQUESTS,
+        limit_per_host=MAX_REQUESTS_PER_HOST,
+        ttl_dns_cache=300,
+    )
+    logging.info(f"Testing {len(rows)} URLs with at most {MAX_CONCURRENT_REQUESTS} requests in flight, {MAX_REQUESTS_PER_HOST} per host")
+
+    async with aiohttp.ClientSession(connector=connector, trace_configs=[timing_trace_config()]) as session:
+        tasks = {
+            id(row): asyncio.create_task(
+                test_url(session, row["URL"], int(row.get("Expected HTTP Code", 200)), row.get("Expected result", ""), limiter=limiter, validators=validators)
+            )
+            for row in interleave_by_host(rows)
+        }
+        await asyncio.gather(*tasks.values())
+
+    return [tasks[id(row)].result() for row in rows]
+
 async def main():
     logging.info("===== Starting URL Monitor Script =====")
     data = await fetch_google_sheet_data(GOOGLE_SHEET_URL)
@@ -190,24 +467,32 @@ async def main():
         logging.warning("No data fetched from Google Sheets.")
         return
 
-    status = load_status()
+    history = UrlHistory(HISTORY_DB)
+    history.import_status_file(STATUS_FILE)
+    validators = load_validators()
 
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            test_url(session, row["URL"], int(row.get("Expected HTTP Code", 200)), row.get("Expected result", ""), status)
-            for row in data if row.get("URL")
-        ]
-        results = await asyncio.gather(*tasks)
+    results = await run_url_tests([row for row in data if row.get("URL")], validators)
+    not_modified = sum(1 for r in results if r["not_modified"])
+    logging.info(f"{not_modified} of {len(results)} URLs were not modified since the last run")
+    timed = sorted(r["latency_ms"] for r in results if r["latency_ms"] is not None)
+    if timed:
+        logging.info(f"Latency median {timed[len(timed) // 2]:.0f} ms, max {timed[-1]:.0f} ms, {sum(r['attempts'] for r in results)} requests for {len(results)} URLs")
+
+    # Forget validators of URLs no longer in the sheet
+    tested = {r["url"] for r in results}
+    save_validators({url: entry for url, entry in validators.items() if url in tested})
 
-    save_status(status)
-    send_message, slack_message = generate_slack_report(results, status)
+    history.record_results(results, slow_ms=SLOW_URL_MS)
+    save_metrics(results)
+    send_message, slack_message = generate_slack_report(results, history)
     if send_message:
         logging.info("Sending message to Slack...")
         await send_to_slack(SLACK_WEBHOOK_URL, slack_message)
     else:
-        logging.info("Don't send Slack message: there are no active errors.")
+        logging.info("Don't send Slack message: there are no new failures or slow URLs.")
 
-    save_status(status)
+    history.prune(HISTORY_RETENTION_DAYS)
+    history.close()
     logging.info("===== Script completed =====")
 
 if __name__ == "__main__":